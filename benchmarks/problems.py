@@ -0,0 +1,208 @@
+# PopulationSim
+# See full license in LICENSE.txt.
+
+"""
+Synthetic balancing and integerizing problems for benchmarking
+
+Problems are parameterized by sample_count (number of seed households), control_count
+(number of controls, including the total households control), zone_count (number of sub zones
+for simultaneous problems) and sparsity (fraction of zero entries in the non-total incidence
+columns). All problems are generated from a seeded prng, so they are reproducible and are
+constructed to be feasible, so solve times are not dominated by relaxation.
+"""
+
+import numpy as np
+import pandas as pd
+
+TOTAL_HH_CONTROL = 'num_hh'
+
+
+def incidence_table(sample_count, control_count, sparsity=0.5, seed=0):
+    """
+    Household incidence table with a total households column and control_count-1 other
+    controls, alternating between household-based (0/1) and person-based (count) controls
+
+    Returns
+    -------
+    incidence_df : pandas.DataFrame
+        one row per household (indexed by hh_id) and one column per control
+    """
+
+    assert control_count > 1
+
+    prng = np.random.RandomState(seed)
+
+    columns = {TOTAL_HH_CONTROL: np.ones(sample_count, dtype=int)}
+    for c in range(1, control_count):
+        nonzero = (prng.rand(sample_count) >= sparsity).astype(int)
+        if c % 2:
+            columns['hh_control_%s' % c] = nonzero
+        else:
+            columns['person_control_%s' % c] = nonzero * prng.randint(1, 5, sample_count)
+
+    incidence_df = pd.DataFrame(columns)
+    incidence_df.index.name = 'hh_id'
+
+    return incidence_df
+
+
+def control_spec(incidence_df, sub_control_count=None):
+    """
+    control_spec for incidence_df controls, the first sub_control_count controls (including
+    the total households control) are sub zone controls and the rest are parent controls.
+    """
+
+    if sub_control_count is None:
+        sub_control_count = len(incidence_df.columns)
+
+    spec = pd.DataFrame({'target': incidence_df.columns})
+    spec['geography'] = ['SUB' if i < sub_control_count else 'PARENT' for i in range(len(spec))]
+    spec['seed_table'] = 'households'
+    spec['importance'] = 1000
+    spec.loc[spec.target == TOTAL_HH_CONTROL, 'importance'] = 1000000000
+
+    return spec
+
+
+def balancing_problem(sample_count, control_count, sparsity=0.5, max_iterations=10000, seed=0):
+    """
+    Arguments for balancer.np_balancer
+
+    Controls are computed from perturbed initial weights, so the problem is feasible
+    but initial weights do not already match controls.
+    """
+
+    prng = np.random.RandomState(seed)
+
+    incidence_df = incidence_table(sample_count, control_count, sparsity, seed)
+    incidence = incidence_df.values.transpose().astype(np.float64)
+
+    weights_initial = prng.uniform(10, 50, sample_count)
+    target_weights = weights_initial * prng.uniform(0.5, 2.0, sample_count)
+
+    return {
+        'sample_count': sample_count,
+        'control_count': control_count,
+        'master_control_index': 0,
+        'incidence': incidence,
+        'weights_initial': weights_initial,
+        'weights_lower_bound': np.zeros(sample_count),
+        'weights_upper_bound': weights_initial * 30,
+        'controls_constraint': np.round(incidence.dot(target_weights)),
+        'controls_importance': control_spec(incidence_df).importance.values.astype(np.float64),
+        'max_iterations': max_iterations,
+    }
+
+
+def sub_weights_and_controls(incidence_df, zone_count, prng):
+    """
+    Random allocation of integer-ish parent weights to zone_count sub zones, and the sub zone
+    controls implied by a perturbation of that allocation.
+
+    Returns
+    -------
+    parent_weights : numpy.ndarray(float) (sample_count,)
+    sub_weights : numpy.ndarray(float) (zone_count, sample_count)
+    sub_controls : numpy.ndarray(float) (zone_count, control_count)
+    """
+
+    sample_count = len(incidence_df.index)
+
+    parent_weights = prng.uniform(1, 20, sample_count)
+
+    allocation = prng.dirichlet(np.ones(zone_count), sample_count).transpose()
+    sub_weights = allocation * parent_weights
+
+    target_allocation = prng.dirichlet(np.ones(zone_count), sample_count).transpose()
+    sub_controls = np.round((target_allocation * parent_weights).dot(incidence_df.values))
+
+    return parent_weights, sub_weights, sub_controls
+
+
+def simul_balancing_problem(sample_count, control_count, zone_count, sparsity=0.5, seed=0):
+    """
+    Arguments for simul_balancer.np_simul_balancer
+    """
+
+    prng = np.random.RandomState(seed)
+
+    incidence_df = incidence_table(sample_count, control_count, sparsity, seed)
+    incidence = incidence_df.values.transpose().astype(np.float64)
+
+    parent_weights, sub_weights, sub_controls = sub_weights_and_controls(incidence_df, zone_count, prng)
+
+    return {
+        'sample_count': sample_count,
+        'control_count': control_count,
+        'zone_count': zone_count,
+        'master_control_index': 0,
+        'incidence': incidence,
+        'parent_weights': parent_weights,
+        'weights_lower_bound': np.zeros(sample_count),
+        'weights_upper_bound': parent_weights,
+        'sub_weights': sub_weights,
+        'parent_controls': sub_controls.sum(axis=0),
+        'controls_importance': control_spec(incidence_df).importance.values.astype(np.float64),
+        'sub_controls': sub_controls,
+    }
+
+
+def integerizing_problem(sample_count, control_count, sparsity=0.5, seed=0):
+    """
+    Arguments for integerizer.Integerizer
+    """
+
+    prng = np.random.RandomState(seed)
+
+    incidence_df = incidence_table(sample_count, control_count, sparsity, seed)
+    spec = control_spec(incidence_df)
+
+    float_weights = prng.uniform(0.1, 20, sample_count)
+
+    # controls relaxed to what float_weights achieve, as by balancing
+    relaxed_control_totals = np.round(float_weights.dot(incidence_df.values))
+
+    return {
+        'incidence_table': incidence_df,
+        'control_importance_weights': spec.importance,
+        'float_weights': float_weights,
+        'relaxed_control_totals': relaxed_control_totals,
+        'total_hh_control_value': relaxed_control_totals[0],
+        'total_hh_control_index': 0,
+        'control_is_hh_based': (incidence_df.max(axis=0) <= 1).values,
+        'trace_label': 'benchmark',
+    }
+
+
+def simul_integerizing_problem(sample_count, control_count, zone_count, sparsity=0.5, seed=0):
+    """
+    Arguments for multi_integerizer.SimulIntegerizer
+
+    Half the controls (including the total households control) are sub zone controls,
+    the rest are parent controls.
+    """
+
+    prng = np.random.RandomState(seed)
+
+    incidence_df = incidence_table(sample_count, control_count, sparsity, seed)
+    sub_control_count = max(control_count // 2, 1)
+    spec = control_spec(incidence_df, sub_control_count)
+
+    parent_weights, sub_weights, _ = sub_weights_and_controls(incidence_df, zone_count, prng)
+
+    zone_ids = pd.Index(range(1, zone_count + 1), name='SUB')
+    sub_weights_df = pd.DataFrame(sub_weights.transpose(), index=incidence_df.index, columns=zone_ids)
+
+    sub_control_cols = spec.target[spec.geography == 'SUB'].values
+    sub_controls_df = pd.DataFrame(
+        np.round(sub_weights.dot(incidence_df[sub_control_cols].values)),
+        index=zone_ids, columns=sub_control_cols)
+
+    return {
+        'incidence_df': incidence_df,
+        'sub_weights': sub_weights_df,
+        'sub_controls_df': sub_controls_df,
+        'control_spec': spec,
+        'total_hh_control_col': TOTAL_HH_CONTROL,
+        'trace_label': 'benchmark',
+    }
@@ -0,0 +1,464 @@
+# PopulationSim
+# See full license in LICENSE.txt.
+
+"""
+PopulationSim benchmark runner
+
+Run benchmarks and record results as json::
+
+    python run_benchmarks.py run --size small --output results/base.json
+
+Compare two sets of results, flagging (and exiting with status 1 on) slowdowns::
+
+    python run_benchmarks.py compare results/base.json results/new.json --threshold 0.2
+
+See README.md for details.
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from activitysim.core import inject
+from activitysim.core import pipeline
+from activitysim.core.config import setting
+
+from populationsim import steps  # noqa: F401 (registers populationsim steps)
+from populationsim.balancer import np_balancer
+from populationsim.simul_balancer import np_simul_balancer
+from populationsim.integerizer import Integerizer
+from populationsim.multi_integerizer import SimulIntegerizer
+from populationsim.lp_heuristic import control_fit
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import problems  # noqa: E402
+
+logger = logging.getLogger('benchmarks')
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+
+# problem sizes for micro benchmarks
+SIZES = {
+    'small': {'sample_count': 500, 'control_count': 8, 'zone_count': 5, 'sparsity': 0.5},
+    'medium': {'sample_count': 2000, 'control_count': 16, 'zone_count': 20, 'sparsity': 0.5},
+    'large': {'sample_count': 10000, 'control_count': 24, 'zone_count': 100, 'sparsity': 0.5},
+}
+
+SUITES = ['micro', 'steps', 'e2e']
+
+# base mode models for examples whose settings do not list models
+DEFAULT_MODELS = [
+    'input_pre_processor',
+    'setup_data_structures',
+    'initial_seed_balancing',
+    'meta_control_factoring',
+    'final_seed_balancing',
+    'integerize_final_seed_weights',
+    'sub_balancing.geography=TRACT',
+    'sub_balancing.geography=TAZ',
+    'expand_households',
+    'summarize',
+    'write_tables',
+    'write_synthetic_population',
+]
+
+# ignore changes smaller than this (in seconds) when comparing results
+MIN_REGRESSION_SECONDS = 0.01
+
+
+def time_calls(func, repeat):
+    """
+    Call func repeat times, returning list of elapsed wall times (in seconds) and last result
+    """
+
+    times = []
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - t0)
+    return times, result
+
+
+def benchmark_record(name, params, times=None, skipped=None, **info):
+
+    record = {'name': name, 'params': params}
+    if skipped:
+        record['status'] = 'skipped'
+        record['note'] = skipped
+    else:
+        record['status'] = 'ok'
+        record['times'] = times
+        record['median'] = float(np.median(times))
+        record['min'] = float(np.min(times))
+    record.update(info)
+
+    logger.info("%s %s %s" % (name, params,
+                              ('skipped: %s' % skipped) if skipped else ('median %.4f' % record['median'])))
+
+    return record
+
+
+def cvxpy_available():
+    try:
+        import cvxpy  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def integerize(integerizer, args):
+    """
+    Integerize, returning solver status and control fit of integerized weights to relaxed controls
+    """
+
+    status = integerizer.integerize()
+
+    control_values = integerizer.weights.integerized_weight.values.dot(args['incidence_table'].values)
+    fit = control_fit(control_values, args['relaxed_control_totals'],
+                      np.asanyarray(args['control_importance_weights']))
+
+    return status, fit
+
+
+def simul_integerize(integerizer, args):
+    """
+    Simul-integerize, returning solver status and control fit of integerized weights to sub zone
+    controls and (rounded) parent controls implied by sub zone float weights
+    """
+
+    status = integerizer.integerize()
+
+    incidence_df = args['incidence_df']
+    sub_controls_df = args['sub_controls_df']
+    spec = args['control_spec'].set_index('target')
+    parent_cols = [c for c in incidence_df.columns if c not in sub_controls_df.columns]
+
+    weights = integerizer.integerized_weights.values
+    control_values = np.concatenate([
+        weights.T.dot(incidence_df[sub_controls_df.columns].values).ravel(),
+        weights.sum(axis=1).dot(incidence_df[parent_cols].values)])
+    parent_controls = np.round(args['sub_weights'].values.sum(axis=1).dot(incidence_df[parent_cols].values))
+    controls = np.concatenate([sub_controls_df.values.ravel(), parent_controls])
+    importance = np.concatenate([
+        np.tile(spec.importance[sub_controls_df.columns].values, len(sub_controls_df.index)),
+        spec.importance[parent_cols].values])
+
+    return status, control_fit(control_values, controls, importance)
+
+
+def micro_benchmarks(size, repeat):
+    """
+    Time balancers and integerizers on synthetic problems of the specified size, recording
+    control fit of integerizer results so backends can be compared on fit vs time
+    """
+
+    sample_count = size['sample_count']
+    control_count = size['control_count']
+    zone_count = size['zone_count']
+    sparsity = size['sparsity']
+
+    results = []
+
+    # algorithm settings are read with setting(), so we inject them directly
+    benchmark_settings = {}
+    inject.add_injectable('settings', benchmark_settings)
+
+    params = {'sample_count': sample_count, 'control_count': control_count, 'sparsity': sparsity}
+
+    args = problems.balancing_problem(sample_count, control_count, sparsity)
+    times, (weights, relaxation_factors, status) = time_calls(lambda: np_balancer(**args), repeat)
+    results.append(benchmark_record('np_balancer', params, times, iterations=int(status['iter'])))
+
+    params = dict(params, zone_count=zone_count)
+    args = problems.simul_balancing_problem(sample_count, control_count, zone_count, sparsity)
+    times, (weights, relaxation_factors, status) = time_calls(lambda: np_simul_balancer(**args), repeat)
+    results.append(benchmark_record('np_simul_balancer', params, times, iterations=int(status['iter'])))
+
+    for backend in ['ortools', 'cvxpy', 'heuristic']:
+
+        benchmark_settings['USE_CVXPY'] = (backend == 'cvxpy')
+        benchmark_settings['USE_HEURISTIC_INTEGERIZER'] = (backend == 'heuristic')
+        skipped = 'cvxpy not installed' if backend == 'cvxpy' and not cvxpy_available() else None
+
+        params = {'backend': backend, 'sample_count': sample_count,
+                  'control_count': control_count, 'sparsity': sparsity}
+        if skipped:
+            results.append(benchmark_record('integerizer', params, skipped=skipped))
+        else:
+            args = problems.integerizing_problem(sample_count, control_count, sparsity)
+            times, (status, fit) = time_calls(lambda: integerize(Integerizer(**args), args), repeat)
+            results.append(benchmark_record('integerizer', params, times, solver_status=status, **fit))
+
+        params = dict(params, zone_count=zone_count)
+        if skipped:
+            results.append(benchmark_record('simul_integerizer', params, skipped=skipped))
+        else:
+            args = problems.simul_integerizing_problem(sample_count, control_count, zone_count, sparsity)
+            times, (status, fit) = \
+                time_calls(lambda: simul_integerize(SimulIntegerizer(**args), args), repeat)
+            results.append(benchmark_record('simul_integerizer', params, times, solver_status=status, **fit))
+
+    # restore decorated settings injectable
+    inject.reinject_decorated_tables()
+
+    return results
+
+
+def setup_example(example_dir, output_dir):
+
+    inject.reinject_decorated_tables()
+
+    inject.add_injectable('configs_dir', os.path.join(example_dir, 'configs'))
+    inject.add_injectable('data_dir', os.path.join(example_dir, 'data'))
+    inject.add_injectable('output_dir', output_dir)
+
+    inject.clear_cache()
+
+
+def missing_example_inputs(example_dir):
+    """
+    Return list of input files listed in example settings input_table_list that do not exist
+    """
+
+    data_dir = os.path.join(example_dir, 'data')
+    filenames = [table_info.get('filename') for table_info in setting('input_table_list', [])]
+    return [f for f in filenames if f and not os.path.exists(os.path.join(data_dir, f))]
+
+
+def pipeline_benchmarks(example_dir, suites, repeat):
+    """
+    Time full runs of the example and (by resuming the pipeline from the last full run)
+    the expand_households and summarize steps.
+    """
+
+    example_dir = os.path.abspath(example_dir)
+    example = os.path.basename(example_dir)
+    output_dir = tempfile.mkdtemp(prefix='populationsim_benchmark_')
+
+    results = []
+
+    try:
+        setup_example(example_dir, output_dir)
+
+        models = setting('models', DEFAULT_MODELS)
+        missing = missing_example_inputs(example_dir)
+        skipped = ('missing input files %s' % missing) if missing else None
+
+        def run_models(models, resume_after=None):
+            setup_example(example_dir, output_dir)
+            pipeline.run(models=models, resume_after=resume_after)
+            pipeline.close_pipeline()
+
+        # a full run is needed to create checkpoints for step benchmarks
+        e2e_repeat = repeat if 'e2e' in suites else 1
+        if skipped:
+            times = None
+        else:
+            times, _ = time_calls(lambda: run_models(models), e2e_repeat)
+        if 'e2e' in suites:
+            results.append(benchmark_record('full_run', {'example': example}, times, skipped=skipped))
+
+        if 'steps' in suites:
+            for step_name in ['expand_households', 'summarize']:
+                params = {'example': example}
+                if skipped:
+                    results.append(benchmark_record(step_name, params, skipped=skipped))
+                    continue
+                if step_name not in models:
+                    results.append(benchmark_record(step_name, params, skipped='not in models'))
+                    continue
+                if step_name == 'summarize':
+                    resume_after = 'expand_households'
+                else:
+                    resume_after = models[models.index(step_name) - 1]
+                times, _ = time_calls(lambda: run_models([step_name], resume_after), repeat)
+                results.append(benchmark_record(step_name, params, times))
+    finally:
+        inject.reinject_decorated_tables()
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    return results
+
+
+def metadata(size_name, size):
+
+    try:
+        commit = subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, stderr=subprocess.DEVNULL)
+        commit = commit.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    try:
+        import ortools
+        ortools_version = ortools.__version__
+    except (ImportError, AttributeError):
+        ortools_version = None
+
+    return {
+        'commit': commit,
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'size': size_name,
+        'size_params': size,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'ortools': ortools_version,
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+    }
+
+
+def benchmark_key(record):
+    return record['name'], json.dumps(record['params'], sort_keys=True)
+
+
+def compare_results(baseline, current, threshold):
+    """
+    Compare median times of benchmarks present (and not skipped) in both baseline and current
+
+    Returns
+    -------
+    comparison : pandas.DataFrame
+        one row per benchmark with baseline and current median times, ratio and regression flag
+    """
+
+    baseline_times = {benchmark_key(r): r['median'] for r in baseline['benchmarks'] if r['status'] == 'ok'}
+
+    rows = []
+    for record in current['benchmarks']:
+        key = benchmark_key(record)
+        if record['status'] != 'ok' or key not in baseline_times:
+            continue
+        base = baseline_times[key]
+        rows.append({
+            'name': record['name'],
+            'params': key[1],
+            'baseline': base,
+            'current': record['median'],
+            'ratio': record['median'] / base if base > 0 else np.nan,
+        })
+
+    comparison = pd.DataFrame(rows, columns=['name', 'params', 'baseline', 'current', 'ratio'])
+    comparison['regression'] = \
+        (comparison.ratio > 1.0 + threshold) & \
+        (comparison.current - comparison.baseline > MIN_REGRESSION_SECONDS)
+
+    return comparison
+
+
+def report_comparison(comparison, baseline, current):
+
+    print("baseline %s (%s) vs current %s (%s)" %
+          (baseline['metadata'].get('commit'), baseline['metadata'].get('timestamp'),
+           current['metadata'].get('commit'), current['metadata'].get('timestamp')))
+    with pd.option_context('display.max_colwidth', 80, 'display.width', 200):
+        print(comparison.to_string(index=False))
+
+    regressions = comparison[comparison.regression]
+    if len(regressions):
+        print("\n%s regression(s):" % len(regressions))
+        for _, row in regressions.iterrows():
+            print("  %s %s %.4fs -> %.4fs (x%.2f)" %
+                  (row['name'], row['params'], row.baseline, row.current, row.ratio))
+
+    return len(regressions)
+
+
+def read_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def run(args):
+
+    size = dict(SIZES[args.size])
+    for key in ['sample_count', 'control_count', 'zone_count', 'sparsity']:
+        if getattr(args, key) is not None:
+            size[key] = getattr(args, key)
+
+    results = {'metadata': metadata(args.size, size), 'benchmarks': []}
+
+    if 'micro' in args.suite:
+        results['benchmarks'] += micro_benchmarks(size, args.repeat)
+
+    if 'steps' in args.suite or 'e2e' in args.suite:
+        results['benchmarks'] += pipeline_benchmarks(args.example, args.suite, args.repeat)
+
+    output = args.output or \
+        os.path.join(BENCHMARKS_DIR, 'results', '%s_%s.json' % (results['metadata']['commit'], args.size))
+    if os.path.dirname(output):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print("wrote %s" % output)
+
+    if args.baseline:
+        baseline = read_results(args.baseline)
+        return 1 if report_comparison(compare_results(baseline, results, args.threshold),
+                                      baseline, results) else 0
+
+    return 0
+
+
+def compare(args):
+
+    baseline = read_results(args.baseline)
+    current = read_results(args.current)
+
+    return 1 if report_comparison(compare_results(baseline, current, args.threshold),
+                                  baseline, current) else 0
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='PopulationSim benchmarks')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    run_parser = subparsers.add_parser('run', help='run benchmarks')
+    run_parser.add_argument('--suite', nargs='+', choices=SUITES, default=SUITES)
+    run_parser.add_argument('--size', choices=list(SIZES.keys()), default='small',
+                            help='micro benchmark problem size')
+    run_parser.add_argument('--sample-count', type=int)
+    run_parser.add_argument('--control-count', type=int)
+    run_parser.add_argument('--zone-count', type=int)
+    run_parser.add_argument('--sparsity', type=float)
+    run_parser.add_argument('--repeat', type=int, default=3)
+    run_parser.add_argument('--example', default=os.path.join(REPO_DIR, 'example_calm'),
+                            help='example directory (with configs and data) for steps and e2e suites')
+    run_parser.add_argument('--output', help='results json file (default results/<commit>_<size>.json)')
+    run_parser.add_argument('--baseline', help='results json file to compare against')
+    run_parser.add_argument('--threshold', type=float, default=0.2,
+                            help='flag benchmarks more than this fraction slower than baseline')
+    run_parser.set_defaults(func=run)
+
+    compare_parser = subparsers.add_parser('compare', help='compare benchmark results')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=0.2)
+    compare_parser.set_defaults(func=compare)
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(name)s %(levelname)s %(message)s')
+    logger.setLevel(logging.INFO)
+
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,424 @@
+# PopulationSim
+# See full license in LICENSE.txt.
+
+"""
+Synthetic region generator for scaling tests
+
+Writes a complete example directory (configs and data) for a synthetic region with a
+REGION > PUMA > TAZ > MAZ geography hierarchy (seed geography PUMA) at arbitrary scale::
+
+    python synthetic_region.py --households 5000000 --maz 40000 --taz 4000 --puma 100 \\
+        --output synthetic_region
+
+The seed sample (seed_households.csv and seed_persons.csv) is drawn from simple parametric
+distributions with PUMA-level variation. Control totals are aggregated from a 'true' population
+created by sampling seed households (within each PUMA) into MAZs, with MAZ-specific tilts
+towards larger or higher income households, so controls are mutually consistent and feasible,
+but vary realistically from zone to zone.
+
+The configs follow the same input_table_list and controls.csv schema as example_calm, and the
+example can be run with run_populationsim.py or benchmarked with run_benchmarks.py --example.
+"""
+
+import argparse
+import logging
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import yaml
+
+logger = logging.getLogger('synthetic_region')
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+GEOGRAPHIES = ['REGION', 'PUMA', 'TAZ', 'MAZ']
+SEED_GEOGRAPHY = 'PUMA'
+
+# household size distribution for NP = 1..7
+HH_SIZE_PROBS = [0.28, 0.34, 0.15, 0.13, 0.06, 0.03, 0.01]
+
+# number of MAZ tilt classes (MAZs in the same class share sampling probabilities)
+TILT_CLASS_COUNT = 8
+
+# target,geography,seed_table,importance,control_field,expression
+CONTROLS = [
+    ['num_hh', 'MAZ', 'households', 1000000000, 'HHBASE', '(households.WGTP > 0) & (households.WGTP < np.inf)'],
+    ['hh_size_1', 'MAZ', 'households', 5000, 'HHSIZE1', 'households.NP == 1'],
+    ['hh_size_2', 'MAZ', 'households', 5000, 'HHSIZE2', 'households.NP == 2'],
+    ['hh_size_3', 'MAZ', 'households', 5000, 'HHSIZE3', 'households.NP == 3'],
+    ['hh_size_4_plus', 'MAZ', 'households', 5000, 'HHSIZE4', 'households.NP >= 4'],
+    ['hh_inc_30', 'TAZ', 'households', 500, 'HHINC1', 'households.HHINCADJ <= 30000'],
+    ['hh_inc_30_60', 'TAZ', 'households', 500, 'HHINC2',
+     '(households.HHINCADJ > 30000) & (households.HHINCADJ <= 60000)'],
+    ['hh_inc_60_100', 'TAZ', 'households', 500, 'HHINC3',
+     '(households.HHINCADJ > 60000) & (households.HHINCADJ <= 100000)'],
+    ['hh_inc_100_plus', 'TAZ', 'households', 500, 'HHINC4', 'households.HHINCADJ > 100000'],
+    ['hh_wrks_0', 'TAZ', 'households', 1000, 'HHWORK0', 'households.NWESR == 0'],
+    ['hh_wrks_1', 'TAZ', 'households', 1000, 'HHWORK1', 'households.NWESR == 1'],
+    ['hh_wrks_2', 'TAZ', 'households', 1000, 'HHWORK2', 'households.NWESR == 2'],
+    ['hh_wrks_3_plus', 'TAZ', 'households', 1000, 'HHWORK3', 'households.NWESR >= 3'],
+    ['pers_age_00_19', 'REGION', 'persons', 500, 'AGE1', 'persons.AGEP <= 19'],
+    ['pers_age_20_34', 'REGION', 'persons', 500, 'AGE2', '(persons.AGEP > 19) & (persons.AGEP <= 34)'],
+    ['pers_age_35_64', 'REGION', 'persons', 500, 'AGE3', '(persons.AGEP > 34) & (persons.AGEP <= 64)'],
+    ['pers_age_65_plus', 'REGION', 'persons', 500, 'AGE4', 'persons.AGEP > 64'],
+]
+CONTROL_COLUMNS = ['target', 'geography', 'seed_table', 'importance', 'control_field', 'expression']
+
+CONTROL_FILE_NAMES = {
+    'MAZ': 'control_totals_maz.csv',
+    'TAZ': 'control_totals_taz.csv',
+    'REGION': 'control_totals_meta.csv',
+}
+
+MODELS = [
+    'input_pre_processor',
+    'setup_data_structures',
+    'initial_seed_balancing',
+    'meta_control_factoring',
+    'final_seed_balancing',
+    'integerize_final_seed_weights',
+    'sub_balancing.geography=TAZ',
+    'sub_balancing.geography=MAZ',
+    'expand_households',
+    'write_data_dictionary',
+    'summarize',
+    'write_tables',
+    'write_synthetic_population',
+]
+
+
+def nested_zones(child_count, parent_count, prng):
+    """
+    Assign child_count zones to parent_count parent zones (each parent gets at least one child)
+    so that consecutively numbered children have the same parent.
+
+    Returns
+    -------
+    parent : numpy.ndarray(int) (child_count,)
+        zero-based parent index of each child
+    """
+
+    assert child_count >= parent_count
+    parent = np.concatenate([np.arange(parent_count),
+                             prng.randint(parent_count, size=child_count - parent_count)])
+    return np.sort(parent)
+
+
+def geo_cross_walk(maz_count, taz_count, puma_count, prng):
+    """
+    Geographic crosswalk with one row per MAZ
+    """
+
+    taz_puma = nested_zones(taz_count, puma_count, prng)
+    maz_taz = nested_zones(maz_count, taz_count, prng)
+
+    crosswalk = pd.DataFrame({
+        'MAZ': np.arange(1, maz_count + 1),
+        'TAZ': maz_taz + 1,
+        'PUMA': taz_puma[maz_taz] + 100,
+        'REGION': 1,
+    })
+
+    return crosswalk
+
+
+def seed_sample(seed_count, puma_ids, sample_rate, prng):
+    """
+    Seed households and persons with PUMA-level variation in income and household size.
+
+    Returns
+    -------
+    households : pandas.DataFrame
+    persons : pandas.DataFrame
+    """
+
+    puma_count = len(puma_ids)
+    assert seed_count >= puma_count
+
+    # every puma has seed households
+    puma_index = np.concatenate([np.arange(puma_count), prng.randint(puma_count, size=seed_count - puma_count)])
+    puma_affluence = prng.normal(0, 0.3, puma_count)[puma_index]
+
+    hh_size = prng.choice(np.arange(1, len(HH_SIZE_PROBS) + 1), size=seed_count, p=HH_SIZE_PROBS)
+    age_of_head = np.clip(prng.normal(50, 16, seed_count), 18, 95).astype(int)
+
+    # workers (at most hh_size and 3, fewer if head of household is retirement age)
+    work_prob = np.where(age_of_head < 65, 0.7, 0.15)
+    workers = prng.binomial(np.minimum(hh_size, 3), work_prob)
+
+    income = np.exp(prng.normal(10.6 + 0.35 * workers + puma_affluence, 0.7)).round(-2).astype(int)
+
+    households = pd.DataFrame({
+        'hh_id': np.arange(1, seed_count + 1),
+        'PUMA': puma_ids[puma_index],
+        'REGION': 1,
+        'WGTP': np.maximum(np.round(prng.uniform(0.5, 1.5, seed_count) / sample_rate), 1).astype(int),
+        'NP': hh_size,
+        'AGEHOH': age_of_head,
+        'HHINCADJ': income,
+        'NWESR': workers,
+        'HTYPE': prng.randint(1, 5, seed_count),
+    })
+
+    # persons - one row per person, head of household first and workers next
+    person_hh = np.repeat(np.arange(seed_count), hh_size)
+    person_count = len(person_hh)
+    first_person = np.repeat(np.cumsum(hh_size) - hh_size, hh_size)
+    per_num = np.arange(person_count) - first_person + 1
+
+    is_worker = per_num <= workers[person_hh]
+    other_age = np.where(is_worker, prng.randint(18, 66, person_count), prng.randint(0, 91, person_count))
+    age = np.where(per_num == 1, age_of_head[person_hh], other_age)
+
+    persons = pd.DataFrame({
+        'hh_id': person_hh + 1,
+        'PUMA': households.PUMA.values[person_hh],
+        'per_num': per_num,
+        'AGEP': age,
+        'SEX': prng.randint(1, 3, person_count),
+        'OCCP': np.where(is_worker, prng.randint(1, 9, person_count), 0),
+    })
+
+    return households, persons
+
+
+def true_population(households, crosswalk, total_households, prng):
+    """
+    Sample seed households (within PUMA) into MAZs to create a 'true' population, from which
+    control totals are aggregated.
+
+    Returns
+    -------
+    maz : numpy.ndarray(int)
+        MAZ of each true household
+    seed_index : numpy.ndarray(int)
+        (zero-based) households row of each true household
+    """
+
+    maz_count = len(crosswalk.index)
+
+    # households per maz (lognormal variation in size)
+    maz_share = prng.lognormal(0, 0.5, maz_count)
+    maz_households = prng.multinomial(total_households, maz_share / maz_share.sum())
+
+    # mazs in each tilt class prefer larger/smaller and richer/poorer households
+    tilt_class = prng.randint(TILT_CLASS_COUNT, size=maz_count)
+    size_tilt = prng.normal(0, 0.3, TILT_CLASS_COUNT)
+    income_tilt = prng.normal(0, 0.5, TILT_CLASS_COUNT)
+
+    log_income = np.log(np.maximum(households.HHINCADJ.values, 1))
+    income_z = (log_income - log_income.mean()) / log_income.std()
+    size_z = (households.NP.values - households.NP.mean()) / households.NP.std()
+
+    maz_list = []
+    seed_index_list = []
+    for puma, puma_mazs in crosswalk.groupby('PUMA').groups.items():
+
+        puma_seed_index = np.flatnonzero(households.PUMA.values == puma)
+        puma_mazs = crosswalk.index.get_indexer(puma_mazs)
+
+        for k in range(TILT_CLASS_COUNT):
+
+            mazs = puma_mazs[tilt_class[puma_mazs] == k]
+            draw_count = maz_households[mazs].sum()
+            if draw_count == 0:
+                continue
+
+            utility = size_tilt[k] * size_z[puma_seed_index] + income_tilt[k] * income_z[puma_seed_index]
+            probs = households.WGTP.values[puma_seed_index] * np.exp(utility)
+
+            seed_index_list.append(prng.choice(puma_seed_index, size=draw_count, p=probs / probs.sum()))
+            maz_list.append(np.repeat(crosswalk.MAZ.values[mazs], maz_households[mazs]))
+
+    return np.concatenate(maz_list), np.concatenate(seed_index_list)
+
+
+def control_totals(households, persons, crosswalk, maz, seed_index):
+    """
+    Aggregate controls from true population
+
+    Returns
+    -------
+    controls : dict
+        dict of control data DataFrames keyed by geography
+    """
+
+    controls_df = pd.DataFrame(CONTROLS, columns=CONTROL_COLUMNS)
+
+    # incidence of each control for each seed household
+    incidence = pd.DataFrame(index=households.index)
+    for _, control in controls_df.iterrows():
+        if control.seed_table == 'households':
+            incidence[control.control_field] = \
+                eval(control.expression, {'np': np}, {'households': households}).astype(int).values
+        else:
+            person_incidence = \
+                eval(control.expression, {'np': np}, {'persons': persons}).astype(int).values
+            incidence[control.control_field] = \
+                np.bincount(persons.hh_id.values - 1, weights=person_incidence, minlength=len(households))
+
+    maz_ids = crosswalk.MAZ.values
+    maz_position = pd.Series(np.arange(len(maz_ids)), index=maz_ids).loc[maz].values
+
+    maz_totals = pd.DataFrame(index=pd.Index(maz_ids, name='MAZ'))
+    for col in incidence.columns:
+        maz_totals[col] = np.bincount(maz_position, weights=incidence[col].values[seed_index],
+                                      minlength=len(maz_ids)).round().astype(int)
+    maz_totals = maz_totals.join(crosswalk.set_index('MAZ'))
+
+    controls = {}
+    for geography in CONTROL_FILE_NAMES:
+        fields = list(controls_df.control_field[controls_df.geography == geography])
+        df = maz_totals.groupby(geography)[fields].sum()
+        controls[geography] = df.reset_index()
+
+    return controls
+
+
+def settings(households_file_name, persons_file_name):
+
+    input_table_list = [
+        {'tablename': 'households', 'filename': households_file_name, 'index_col': 'hh_id'},
+        {'tablename': 'persons', 'filename': persons_file_name},
+        {'tablename': 'geo_cross_walk', 'filename': 'geo_cross_walk.csv'},
+    ] + [
+        {'tablename': '%s_control_data' % geography, 'filename': file_name}
+        for geography, file_name in CONTROL_FILE_NAMES.items()
+    ]
+
+    return {
+        'INTEGERIZE_WITH_BACKSTOPPED_CONTROLS': True,
+        'SUB_BALANCE_WITH_FLOAT_SEED_WEIGHTS': False,
+        'GROUP_BY_INCIDENCE_SIGNATURE': True,
+        'USE_SIMUL_INTEGERIZER': True,
+        'USE_CVXPY': False,
+        'max_expansion_factor': 30,
+        'geographies': GEOGRAPHIES,
+        'seed_geography': SEED_GEOGRAPHY,
+        'data_dir': 'data',
+        'input_table_list': input_table_list,
+        'household_weight_col': 'WGTP',
+        'household_id_col': 'hh_id',
+        'total_hh_control': 'num_hh',
+        'control_file_name': 'controls.csv',
+        'output_tables': {
+            'action': 'include',
+            'tables': ['summary_MAZ', 'summary_TAZ', 'summary_MAZ_PUMA', 'expanded_household_ids'],
+        },
+        'output_synthetic_population': {
+            'household_id': 'household_id',
+            'households': {
+                'filename': 'synthetic_households.csv',
+                'columns': ['NP', 'AGEHOH', 'HHINCADJ', 'NWESR'],
+            },
+            'persons': {
+                'filename': 'synthetic_persons.csv',
+                'columns': ['per_num', 'AGEP', 'OCCP'],
+            },
+        },
+        'models': MODELS,
+        'resume_after': None,
+    }
+
+
+def generate_region(output_dir, households=100000, maz_count=1000, taz_count=200, puma_count=5,
+                    sample_rate=0.05, seed=0):
+    """
+    Write configs and data for a synthetic region to output_dir
+
+    Parameters
+    ----------
+    output_dir : str
+        example directory (configs, data and output sub directories are created)
+    households : int
+        number of households in the region
+    maz_count : int
+    taz_count : int
+    puma_count : int
+    sample_rate : float
+        seed sample size as a fraction of households
+    seed : int
+        random seed
+
+    Returns
+    -------
+    summary : dict
+        counts of seed households, seed persons, and zones at each geography
+    """
+
+    assert maz_count >= taz_count >= puma_count
+
+    prng = np.random.RandomState(seed)
+
+    configs_dir = os.path.join(output_dir, 'configs')
+    data_dir = os.path.join(output_dir, 'data')
+    for d in [configs_dir, data_dir, os.path.join(output_dir, 'output')]:
+        os.makedirs(d, exist_ok=True)
+
+    crosswalk = geo_cross_walk(maz_count, taz_count, puma_count, prng)
+    puma_ids = np.unique(crosswalk.PUMA.values)
+
+    seed_count = max(int(round(households * sample_rate)), puma_count)
+    seed_households, seed_persons = seed_sample(seed_count, puma_ids, sample_rate, prng)
+    logger.info("generated %s seed households and %s seed persons" % (seed_count, len(seed_persons)))
+
+    maz, seed_index = true_population(seed_households, crosswalk, households, prng)
+    logger.info("sampled %s true households into %s MAZ" % (len(maz), maz_count))
+
+    controls = control_totals(seed_households, seed_persons, crosswalk, maz, seed_index)
+
+    seed_households.to_csv(os.path.join(data_dir, 'seed_households.csv'), index=False)
+    seed_persons.to_csv(os.path.join(data_dir, 'seed_persons.csv'), index=False)
+    crosswalk.to_csv(os.path.join(data_dir, 'geo_cross_walk.csv'), index=False)
+    for geography, file_name in CONTROL_FILE_NAMES.items():
+        controls[geography].to_csv(os.path.join(data_dir, file_name), index=False)
+
+    pd.DataFrame(CONTROLS, columns=CONTROL_COLUMNS).to_csv(os.path.join(configs_dir, 'controls.csv'), index=False)
+
+    with open(os.path.join(configs_dir, 'settings.yaml'), 'w') as f:
+        yaml.safe_dump(settings('seed_households.csv', 'seed_persons.csv'), f,
+                       default_flow_style=False, sort_keys=False)
+
+    logging_config = os.path.join(REPO_DIR, 'example_calm', 'configs', 'logging.yaml')
+    if os.path.exists(logging_config):
+        shutil.copy(logging_config, configs_dir)
+
+    summary = {
+        'seed_households': seed_count,
+        'seed_persons': len(seed_persons.index),
+        'households': int(len(maz)),
+        'PUMA': puma_count,
+        'TAZ': taz_count,
+        'MAZ': maz_count,
+    }
+
+    return summary
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='generate a synthetic PopulationSim region')
+    parser.add_argument('--households', type=int, default=100000, help='households in region')
+    parser.add_argument('--maz', type=int, default=1000, help='number of MAZ zones')
+    parser.add_argument('--taz', type=int, help='number of TAZ zones (default maz/10)')
+    parser.add_argument('--puma', type=int, help='number of PUMA zones (default taz/40, at least 1)')
+    parser.add_argument('--sample-rate', type=float, default=0.05, help='seed sample rate')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument('--output', default='synthetic_region', help='example directory to write')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(name)s %(levelname)s %(message)s')
+
+    taz_count = args.taz or max(args.maz // 10, 1)
+    puma_count = args.puma or max(taz_count // 40, 1)
+
+    summary = generate_region(args.output, args.households, args.maz, taz_count, puma_count,
+                              args.sample_rate, args.seed)
+
+    print("wrote %s: %s" % (args.output, summary))
+
+
+if __name__ == '__main__':
+    main()
@@ -11,6 +11,8 @@ import pandas as pd
 
 from activitysim.core.config import setting
 
+from .performance import set_status
+
 
 logger = logging.getLogger(__name__)
 
@@ -103,7 +105,7 @@ class ListBalancer(object):
         sample_count = len(self.incidence_table.index)
         control_count = len(self.incidence_table.columns)
         master_control_index = self.master_control_index
-        incidence = self.incidence_table.values.transpose()
+        incidence = self.incidence_table.values.transpose().astype(np.float64)
         weights_initial = np.asanyarray(self.initial_weights).astype(np.float64)
         weights_lower_bound = np.asanyarray(self.lb_weights).astype(np.float64)
         weights_upper_bound = np.asanyarray(self.ub_weights).astype(np.float64)
@@ -239,70 +241,240 @@ def np_balancer(
     return weights_final, relaxation_factors, status
 
 
-def do_balancing(control_spec,
-                 total_hh_control_col,
-                 max_expansion_factor, min_expansion_factor,
-                 absolute_upper_bound, absolute_lower_bound,
-                 incidence_df, control_totals, initial_weights):
+def np_multi_balancer(
+        sample_count,
+        control_count,
+        master_control_index,
+        incidence,
+        weights_initial,
+        weights_lower_bound,
+        weights_upper_bound,
+        controls_constraint,
+        controls_importance,
+        max_iterations):
+    """
+    Balance several zones that share the same incidence table at once.
+
+    Equivalent to calling np_balancer for each zone (the arithmetic is the same, row by row)
+    but each iteration updates the weights of all zones still balancing with one array
+    operation per control, instead of re-running the python control loop for every zone.
+    Zones stop updating on the iteration they converge, exactly as they would on their own.
+
+    Parameters
+    ----------
+    sample_count : int
+    control_count : int
+    master_control_index : int or None
+    incidence : numpy.ndarray(control_count, sample_count) float
+    weights_initial : numpy.ndarray(zone_count, sample_count) float
+    weights_lower_bound : float or numpy.ndarray(zone_count, sample_count) float
+    weights_upper_bound : float or numpy.ndarray(zone_count, sample_count) float
+    controls_constraint : numpy.ndarray(zone_count, control_count) float
+    controls_importance : numpy.ndarray(control_count,) float
+    max_iterations : int
+
+    Returns
+    -------
+    weights_final : numpy.ndarray(zone_count, sample_count) float
+    relaxation_factors : numpy.ndarray(zone_count, control_count) float
+    status : dict of numpy.ndarray(zone_count,)
+        converged, iter, delta and max_gamma_dif of each zone
+    """
 
-    # incidence table should only have control columns
-    incidence_df = incidence_df[control_spec.target]
+    zone_count = weights_initial.shape[0]
 
-    # master_control_index is total_hh_control_col
-    if total_hh_control_col not in incidence_df.columns:
-        raise RuntimeError("total_hh_control column '%s' not found in incidence table"
-                           % total_hh_control_col)
-    total_hh_control_index = incidence_df.columns.get_loc(total_hh_control_col)
+    weights_lower_bound = np.broadcast_to(weights_lower_bound, (zone_count, sample_count))
+    weights_upper_bound = np.broadcast_to(weights_upper_bound, (zone_count, sample_count))
 
-    # control_totals series rows and incidence_df columns should be aligned
-    assert total_hh_control_index == control_totals.index.get_loc(total_hh_control_col)
+    # results, filled in as zones converge (or run out of iterations)
+    weights_out = weights_initial.copy()
+    relaxation_factors_out = np.ones((zone_count, control_count))
+    status = {
+        'converged': np.zeros(zone_count, dtype=bool),
+        'iter': np.zeros(zone_count, dtype=int),
+        'delta': np.zeros(zone_count),
+        'max_gamma_dif': np.zeros(zone_count),
+    }
 
-    control_totals = control_totals.values
+    # indexes (into results) of zones still balancing, and their balancing state
+    zones = np.arange(zone_count)
+    relaxation_factors = np.ones((zone_count, control_count))
+    importance_adjustment = 1.0
+    weights_final = weights_initial.copy()
+    lower_bound = weights_lower_bound
+    upper_bound = weights_upper_bound
+    constraint = controls_constraint
 
-    control_importance_weights = control_spec.importance
+    # array of control indexes for iterating over controls
+    control_indexes = list(range(control_count))
+    if master_control_index is not None:
+        # reorder indexes so we handle master_control_index last
+        control_indexes.append(control_indexes.pop(master_control_index))
 
-    if min_expansion_factor:
+    # precompute incidence squared
+    incidence2 = incidence * incidence
 
-        # number_of_households in this seed geograpy as specified in seed_controls
-        number_of_households = control_totals[total_hh_control_index]
+    for iter in range(max_iterations):
 
-        total_weights = initial_weights.sum()
-        lb_ratio = min_expansion_factor * float(number_of_households) / float(total_weights)
+        weights_previous = weights_final.copy()
+
+        # reset gamma every iteration
+        gamma = np.ones((len(zones), control_count))
+
+        # importance adjustment as number of iterations progress
+        if iter > 0 and iter % IMPORTANCE_ADJUST_COUNT == 0:
+            importance_adjustment = importance_adjustment / IMPORTANCE_ADJUST
+
+        for c in control_indexes:
 
-        lb_weights = initial_weights * lb_ratio
+            xx = (weights_final * incidence[c]).sum(axis=1)
+            yy = (weights_final * incidence2[c]).sum(axis=1)
+
+            # adjust importance (unless this is master_control)
+            if c == master_control_index:
+                importance = controls_importance[c]
+            else:
+                importance = max(controls_importance[c] * importance_adjustment,
+                                 MIN_IMPORTANCE)
+
+            # calculate constraint balancing factors, gamma
+            relaxed_constraint = np.maximum(constraint[:, c] * relaxation_factors[:, c], MIN_CONTROL_VALUE)
+            gamma[:, c] = np.where(
+                xx > 0,
+                1.0 - (xx - relaxed_constraint) / (yy + relaxed_constraint / float(importance)),
+                1.0)
+
+            # update HH weights
+            weights_final *= np.power(gamma[:, c][:, np.newaxis], incidence[c])
+
+            # clip weights to upper and lower bounds
+            weights_final = np.clip(weights_final, lower_bound, upper_bound)
+
+            relaxation_factors[:, c] *= np.power(1.0 / gamma[:, c], 1.0 / importance)
+
+            # clip relaxation_factors
+            relaxation_factors = np.minimum(relaxation_factors, MAX_RELAXATION_FACTOR)
+
+        max_gamma_dif = np.absolute(gamma - 1).max(axis=1)
+
+        delta = np.absolute(weights_final - weights_previous).sum(axis=1) / float(sample_count)
+
+        converged = (delta < MAX_GAP) & (max_gamma_dif < MAX_GAP)
+
+        done = converged if iter < max_iterations - 1 else np.ones_like(converged)
+        if done.any():
+            done_zones = zones[done]
+            weights_out[done_zones] = weights_final[done]
+            relaxation_factors_out[done_zones] = relaxation_factors[done]
+            status['converged'][done_zones] = converged[done]
+            status['iter'][done_zones] = iter
+            status['delta'][done_zones] = delta[done]
+            status['max_gamma_dif'][done_zones] = max_gamma_dif[done]
+
+            # carry on with the zones still balancing
+            balancing = ~done
+            zones = zones[balancing]
+            if len(zones) == 0:
+                break
+            weights_final = weights_final[balancing]
+            relaxation_factors = relaxation_factors[balancing]
+            lower_bound = lower_bound[balancing]
+            upper_bound = upper_bound[balancing]
+            constraint = constraint[balancing]
+
+    return weights_out, relaxation_factors_out, status
+
+
+def weight_bounds(initial_weights, number_of_households,
+                  max_expansion_factor, min_expansion_factor,
+                  absolute_upper_bound, absolute_lower_bound):
+    """
+    Lower and upper bounds on balanced weights implied by expansion factor settings
+
+    Parameters
+    ----------
+    initial_weights : numpy.ndarray(sample_count,) or numpy.ndarray(zone_count, sample_count)
+        initial weights of households (of each zone)
+    number_of_households : float or numpy.ndarray(zone_count,)
+        total households control (of each zone)
+    max_expansion_factor, min_expansion_factor : float or None
+        bounds as multiples of average weight
+    absolute_upper_bound, absolute_lower_bound : float or None
+        absolute bounds
+
+    Returns
+    -------
+    lb_weights : numpy.ndarray (same shape as initial_weights) or None
+    ub_weights : numpy.ndarray (same shape as initial_weights) of int or None
+    """
+
+    # number_of_households and total initial weights (of each zone)
+    number_of_households = np.asanyarray(number_of_households, dtype=np.float64)[..., np.newaxis]
+    total_weights = initial_weights.sum(axis=-1, keepdims=True)
+
+    if min_expansion_factor:
+
+        lb_weights = initial_weights * (min_expansion_factor * number_of_households / total_weights)
 
         if absolute_lower_bound:
-            lb_weights = lb_weights.clip(lower=absolute_lower_bound)
+            lb_weights = np.maximum(lb_weights, absolute_lower_bound)
         else:
-            lb_weights = lb_weights.clip(lower=0)
+            lb_weights = np.maximum(lb_weights, 0)
 
     elif absolute_lower_bound:
-        lb_weights = initial_weights.clip(lower=absolute_lower_bound)
+        lb_weights = np.maximum(initial_weights, absolute_lower_bound)
 
     else:
         lb_weights = None
 
     if max_expansion_factor:
 
-        # number_of_households in this seed geograpy as specified in seed_controlss
-        number_of_households = control_totals[total_hh_control_index]
-
-        total_weights = initial_weights.sum()
-        ub_ratio = max_expansion_factor * float(number_of_households) / float(total_weights)
-
-        ub_weights = initial_weights * ub_ratio
+        ub_weights = initial_weights * (max_expansion_factor * number_of_households / total_weights)
 
         if absolute_upper_bound:
-            ub_weights = ub_weights.round().clip(upper=absolute_upper_bound, lower=1).astype(int)
+            ub_weights = np.clip(np.round(ub_weights), 1, absolute_upper_bound).astype(int)
         else:
-            ub_weights = ub_weights.round().clip(lower=1).astype(int)
+            ub_weights = np.maximum(np.round(ub_weights), 1).astype(int)
 
     elif absolute_upper_bound:
-        ub_weights = ub_weights.round().clip(upper=absolute_upper_bound, lower=1).astype(int)
+        ub_weights = np.clip(np.round(initial_weights), 1, absolute_upper_bound).astype(int)
 
     else:
         ub_weights = None
 
+    return lb_weights, ub_weights
+
+
+def do_balancing(control_spec,
+                 total_hh_control_col,
+                 max_expansion_factor, min_expansion_factor,
+                 absolute_upper_bound, absolute_lower_bound,
+                 incidence_df, control_totals, initial_weights):
+
+    # incidence table should only have control columns
+    incidence_df = incidence_df[control_spec.target]
+
+    # master_control_index is total_hh_control_col
+    if total_hh_control_col not in incidence_df.columns:
+        raise RuntimeError("total_hh_control column '%s' not found in incidence table"
+                           % total_hh_control_col)
+    total_hh_control_index = incidence_df.columns.get_loc(total_hh_control_col)
+
+    # control_totals series rows and incidence_df columns should be aligned
+    assert total_hh_control_index == control_totals.index.get_loc(total_hh_control_col)
+
+    control_totals = control_totals.values
+
+    control_importance_weights = control_spec.importance
+
+    lb_weights, ub_weights = weight_bounds(
+        initial_weights=initial_weights.values,
+        number_of_households=control_totals[total_hh_control_index],
+        max_expansion_factor=max_expansion_factor,
+        min_expansion_factor=min_expansion_factor,
+        absolute_upper_bound=absolute_upper_bound,
+        absolute_lower_bound=absolute_lower_bound)
+
     max_iterations = setting('MAX_BALANCE_ITERATIONS_SEQUENTIAL', DEFAULT_MAX_ITERATIONS)
 
     balancer = ListBalancer(
@@ -318,4 +490,82 @@ def do_balancing(control_spec,
 
     status, weights, controls = balancer.balance()
 
+    set_status('converged' if status['converged'] else 'not_converged')
+
     return status, weights, controls
+
+
+def do_multi_balancing(control_spec,
+                       total_hh_control_col,
+                       max_expansion_factor, min_expansion_factor,
+                       absolute_upper_bound, absolute_lower_bound,
+                       incidence_df, control_totals, initial_weights):
+    """
+    Balance several zones sharing the same incidence table (e.g. the low zones of a seed zone)
+    together, with the same results as calling do_balancing for each zone.
+
+    Parameters
+    ----------
+    control_spec : pandas.Dataframe
+    total_hh_control_col : str
+    max_expansion_factor, min_expansion_factor : float or None
+    absolute_upper_bound, absolute_lower_bound : float or None
+    incidence_df : pandas.Dataframe
+        incidence table with one row per sample household
+    control_totals : pandas.Dataframe
+        control totals with one row per zone and one column per control
+    initial_weights : pandas.Dataframe
+        initial weights with one row per sample household and one column per zone
+
+    Returns
+    -------
+    status : pandas.Dataframe
+        converged, iter, delta and max_gamma_dif with one row per zone
+    weights : pandas.Dataframe
+        balanced (final) weights with one row per sample household and one column per zone
+    """
+
+    # incidence table should only have control columns
+    incidence_df = incidence_df[control_spec.target]
+
+    # master_control_index is total_hh_control_col
+    if total_hh_control_col not in incidence_df.columns:
+        raise RuntimeError("total_hh_control column '%s' not found in incidence table"
+                           % total_hh_control_col)
+    total_hh_control_index = incidence_df.columns.get_loc(total_hh_control_col)
+
+    # control_totals columns and incidence_df columns should be aligned
+    assert (control_totals.columns == incidence_df.columns).all()
+    assert (initial_weights.columns == control_totals.index).all()
+
+    zone_weights = initial_weights.values.transpose().astype(np.float64)
+
+    lb_weights, ub_weights = weight_bounds(
+        initial_weights=zone_weights,
+        number_of_households=control_totals.values[:, total_hh_control_index],
+        max_expansion_factor=max_expansion_factor,
+        min_expansion_factor=min_expansion_factor,
+        absolute_upper_bound=absolute_upper_bound,
+        absolute_lower_bound=absolute_lower_bound)
+
+    max_iterations = setting('MAX_BALANCE_ITERATIONS_SEQUENTIAL', DEFAULT_MAX_ITERATIONS)
+
+    weights_final, relaxation_factors, status = np_multi_balancer(
+        sample_count=len(incidence_df.index),
+        control_count=len(incidence_df.columns),
+        master_control_index=total_hh_control_index,
+        incidence=incidence_df.values.transpose().astype(np.float64),
+        weights_initial=zone_weights,
+        weights_lower_bound=0.0 if lb_weights is None else lb_weights.astype(np.float64),
+        weights_upper_bound=MAX_INT if ub_weights is None else ub_weights.astype(np.float64),
+        controls_constraint=np.maximum(control_totals.values, MIN_CONTROL_VALUE),
+        controls_importance=np.maximum(np.asanyarray(control_spec.importance), MIN_IMPORTANCE),
+        max_iterations=max_iterations)
+
+    for converged in status['converged']:
+        set_status('converged' if converged else 'not_converged')
+
+    status = pd.DataFrame(status, index=control_totals.index)
+    weights = pd.DataFrame(weights_final.transpose(), index=incidence_df.index, columns=initial_weights.columns)
+
+    return status, weights
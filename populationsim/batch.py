@@ -0,0 +1,229 @@
+# PopulationSim
+# See full license in LICENSE.txt.
+
+import argparse
+import logging
+import multiprocessing
+import os
+import shutil
+
+from activitysim.core import config
+from activitysim.core import inject
+from activitysim.core import pipeline
+from activitysim.core import tracing
+from activitysim.core.config import setting
+
+from . import steps
+
+
+logger = logging.getLogger(__name__)
+
+# last step of base run, whose checkpoint scenario runs resume from
+BASE_STEP = 'setup_data_structures'
+
+# name of (generated) setting with input_table_list entries of tables read for each scenario
+SCENARIO_TABLE_LIST = 'batch_input_table_list'
+
+
+def split_models(models):
+    """
+    Split models into base models, run once to read seed data and build the incidence table,
+    and scenario models, run for each scenario after replacing its control data.
+
+    share_tables (if in models) is moved to the base models, so that scenarios share the
+    base run's tables.
+
+    Parameters
+    ----------
+    models : list of str
+
+    Returns
+    -------
+    base_models : list of str
+    scenario_models : list of str
+    """
+
+    assert BASE_STEP in models, "batch models must include %s" % BASE_STEP
+
+    base_models = models[:models.index(BASE_STEP) + 1]
+    scenario_models = models[models.index(BASE_STEP) + 1:]
+
+    if 'share_tables' in scenario_models:
+        scenario_models.remove('share_tables')
+        base_models.append('share_tables')
+
+    scenario_models = ['input_pre_processor.table_list=%s;repop' % SCENARIO_TABLE_LIST,
+                       'setup_control_tables'] + scenario_models
+
+    return base_models, scenario_models
+
+
+def scenario_settings(settings, base_output_dir):
+    """
+    Settings for scenario runs: the base run settings, with input_table_list entries of the
+    tables to read for each scenario (batch_input_tables setting, or by default all
+    <geography>_control_data tables) as SCENARIO_TABLE_LIST, and with the seed partitions and
+    shared tables written by the base run read from the base output dir.
+    """
+
+    settings = dict(settings)
+
+    input_tables = settings.get('batch_input_tables', None)
+    if input_tables is None:
+        input_tables = [t['tablename'] for t in settings['input_table_list']
+                        if t['tablename'].endswith('_control_data')]
+    settings[SCENARIO_TABLE_LIST] = \
+        [t for t in settings['input_table_list'] if t['tablename'] in input_tables]
+
+    settings['seed_partitions_file_name'] = \
+        os.path.join(base_output_dir, settings.get('seed_partitions_file_name', 'seed_partitions.h5'))
+    settings['shared_tables_dir_name'] = \
+        os.path.join(base_output_dir, settings.get('shared_tables_dir_name', 'shared_tables'))
+
+    return settings
+
+
+def setup_injectables(configs_dir, data_dir, output_dir, settings=None):
+
+    inject.reinject_decorated_tables()
+
+    inject.add_injectable('configs_dir', configs_dir)
+    inject.add_injectable('data_dir', data_dir)
+    inject.add_injectable('output_dir', output_dir)
+
+    inject.clear_cache()
+
+    if settings is not None:
+        inject.add_injectable('settings', settings)
+
+    tracing.config_logger()
+
+    # registers populationsim's write_tables
+    assert inject.get_injectable('preload_injectables', None)
+
+
+def run_scenario(scenario, settings, configs_dir, data_dir, models, base_pipeline_path, resume_after):
+    """
+    Run models for a scenario, resuming from a copy of the base run's pipeline
+
+    Parameters
+    ----------
+    scenario : dict
+        name, data_dir (searched for input files before the base data dirs) and output_dir
+    settings : dict
+        scenario_settings
+    configs_dir : str or list of str
+    data_dir : str or list of str
+        base data dirs
+    models : list of str
+        scenario models
+    base_pipeline_path : str
+    resume_after : str
+        last base model
+
+    Returns
+    -------
+    str
+        scenario name
+    """
+
+    data_dirs = [data_dir] if isinstance(data_dir, str) else list(data_dir)
+    os.makedirs(scenario['output_dir'], exist_ok=True)
+
+    setup_injectables(configs_dir, [scenario['data_dir']] + data_dirs, scenario['output_dir'], settings)
+
+    logger.info("running batch scenario %s" % scenario['name'])
+
+    pipeline_path = config.pipeline_file_path(inject.get_injectable('pipeline_file_name'))
+    shutil.copyfile(base_pipeline_path, pipeline_path)
+
+    pipeline.run(models=models, resume_after=resume_after)
+    pipeline.close_pipeline()
+
+    return scenario['name']
+
+
+def run_batch(scenarios, models=None, num_processes=1):
+    """
+    Synthesize populations for several control data scenarios with the same seed data and
+    control spec, reading seed data and building the incidence table (and household groups)
+    once, rather than once per scenario.
+
+    The base run (models up to setup_data_structures) is run in the output dir. Each scenario
+    then resumes from a copy of the base pipeline in its own output dir, rereads its control
+    data tables from its data dir (falling back to the base data dirs for files it doesn't
+    have), rebuilds the control tables and runs the remaining models.
+
+    Scenarios run in this process, or in a pool of num_processes processes. Scenarios run in
+    the same process reuse integerizer models built for earlier scenarios (see
+    INTEGERIZER_MODEL_CACHE_SIZE), and with share_tables in models all processes map the base
+    run's shared tables. Balancing isn't warm started from other scenarios' weights, so each
+    scenario's results are the same as those of a separate run.
+
+    Parameters
+    ----------
+    scenarios : list of dict
+        name, data_dir and (optionally) output_dir (default <output_dir>/<name>)
+    models : list of str
+        models to run (default models setting)
+    num_processes : int
+    """
+
+    settings = inject.get_injectable('settings')
+    configs_dir = inject.get_injectable('configs_dir')
+    data_dir = inject.get_injectable('data_dir')
+    output_dir = inject.get_injectable('output_dir')
+
+    base_models, scenario_models = split_models(models or settings['models'])
+
+    logger.info("running batch base models %s" % base_models)
+    pipeline.run(models=base_models, resume_after=None)
+    pipeline.close_pipeline()
+
+    base_pipeline_path = config.pipeline_file_path(inject.get_injectable('pipeline_file_name'))
+
+    settings_for_scenarios = scenario_settings(settings, output_dir)
+    args = []
+    for scenario in scenarios:
+        scenario = dict(scenario)
+        scenario['data_dir'] = os.path.abspath(scenario['data_dir'])
+        scenario['output_dir'] = \
+            os.path.abspath(scenario.get('output_dir', os.path.join(output_dir, scenario['name'])))
+        args.append((scenario, settings_for_scenarios, configs_dir, data_dir,
+                     scenario_models, base_pipeline_path, base_models[-1]))
+
+    if num_processes > 1:
+        with multiprocessing.get_context('spawn').Pool(num_processes) as pool:
+            pool.starmap(run_scenario, args)
+    else:
+        for scenario_args in args:
+            run_scenario(*scenario_args)
+
+        # restore base run injectables
+        setup_injectables(configs_dir, data_dir, output_dir, settings)
+
+
+def main():
+    """
+    Run batch_scenarios setting scenarios (see run_batch)
+
+    ::
+
+      python -m populationsim.batch -c configs -d data -o output
+    """
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--config', action='append', required=True, help='path to config dir')
+    parser.add_argument('-d', '--data', action='append', required=True, help='path to data dir')
+    parser.add_argument('-o', '--output', required=True, help='path to output dir')
+    parser.add_argument('-n', '--num_processes', type=int, help='number of scenario processes')
+    args = parser.parse_args()
+
+    setup_injectables(args.config, args.data, args.output)
+
+    num_processes = args.num_processes or setting('batch_num_processes', 1)
+    run_batch(setting('batch_scenarios'), num_processes=num_processes)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+# PopulationSim
+# See full license in LICENSE.txt.
+
+import logging
+
+import pandas as pd
+
+from activitysim.core import pipeline
+from activitysim.core.config import setting
+
+from .zone_checkpoints import fingerprint
+
+
+logger = logging.getLogger(__name__)
+
+# content hash attribute of pipeline table nodes
+CONTENT_HASH = 'content_hash'
+
+
+def content_hash(df):
+    return fingerprint(df.index.name, [str(dtype) for dtype in df.dtypes], df)
+
+
+class CheckpointStore(pd.HDFStore):
+    """
+    Pipeline HDF5 store that (optionally) compresses tables and, rather than writing a table
+    again when it is checkpointed with the same contents as a version already in the store
+    (e.g. when a step replaces a table without changing it), adds a hard link to that version.
+
+    The file is an ordinary pipeline HDF5 file (with the same keys) that can be read by
+    activitysim (e.g. when multiprocessing or resuming) and other HDF5 tools.
+
+    Parameters
+    ----------
+    path : str
+    mode : str
+    complevel : int or None
+    complib : str or None
+        e.g. 'blosc:lz4'
+    link_unchanged : bool
+        whether to hash checkpointed tables and link unchanged versions
+    """
+
+    def __init__(self, path, mode='a', complevel=None, complib=None, link_unchanged=True):
+        super().__init__(path, mode=mode, complevel=complevel, complib=complib)
+        self.link_unchanged = link_unchanged
+
+    def unchanged_version(self, table_name, digest):
+        """
+        Path of a stored version of table_name with content hash digest, or None
+        """
+
+        group_path = '/%s' % table_name
+        if group_path not in self._handle:
+            return None
+
+        for node in self._handle.get_node(group_path)._f_iter_nodes():
+            if getattr(node._v_attrs, CONTENT_HASH, None) == digest:
+                return node._v_pathname
+        return None
+
+    def __setitem__(self, key, value):
+
+        table_name, _, checkpoint_name = key.strip('/').partition('/')
+
+        # checkpoints table is stored without a checkpoint name
+        if not (self.link_unchanged and checkpoint_name and isinstance(value, pd.DataFrame)):
+            super().__setitem__(key, value)
+            return
+
+        digest = content_hash(value)
+        key = '/%s/%s' % (table_name, checkpoint_name)
+
+        version = self.unchanged_version(table_name, digest)
+        if version == key:
+            return
+
+        if key in self:
+            self.remove(key)
+
+        if version is not None:
+            logger.debug("checkpoint %s unchanged from %s" % (key, version))
+            self._handle.create_hard_link('/%s' % table_name, checkpoint_name, version)
+            return
+
+        super().__setitem__(key, value)
+        setattr(self._handle.get_node(key)._v_attrs, CONTENT_HASH, digest)
+
+
+activitysim_open_pipeline_store = pipeline.open_pipeline_store
+
+
+def open_pipeline_store(overwrite=False, mode='a'):
+    """
+    Open pipeline store as activitysim does, reopening it as a CheckpointStore if
+    checkpoint_store settings are specified
+
+    checkpoint_store settings (all optional):
+
+    +----------------+----------------------------------------------------------+
+    | key            | description                                              |
+    +================+==========================================================+
+    | complib        | compression library (e.g. blosc:lz4), default none       |
+    +----------------+----------------------------------------------------------+
+    | complevel      | compression level 0-9, default 1                         |
+    +----------------+----------------------------------------------------------+
+    | link_unchanged | link unchanged table versions, default True              |
+    +----------------+----------------------------------------------------------+
+    """
+
+    activitysim_open_pipeline_store(overwrite=overwrite, mode=mode)
+
+    store_settings = setting('checkpoint_store')
+    if store_settings is None or mode == 'r':
+        return
+
+    store = pipeline.get_pipeline_store()
+    file_path = store.filename
+    store.close()
+
+    complib = store_settings.get('complib', None)
+    pipeline._PIPELINE.pipeline_store = CheckpointStore(
+        file_path,
+        # file was already created (or truncated) by activitysim
+        mode='a' if mode == 'w' else mode,
+        complevel=store_settings.get('complevel', 1) if complib else None,
+        complib=complib,
+        link_unchanged=store_settings.get('link_unchanged', True))
+
+    logger.debug("reopened pipeline store %s as CheckpointStore" % file_path)
+
+
+def install():
+    """
+    Have activitysim pipeline open its store with open_pipeline_store
+    (activitysim has no extension point for the pipeline store)
+    """
+
+    pipeline.open_pipeline_store = open_pipeline_store
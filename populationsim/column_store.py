@@ -0,0 +1,160 @@
+# PopulationSim
+# See full license in LICENSE.txt.
+
+import json
+import logging
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = 'manifest.json'
+
+
+class ColumnStore(object):
+    """
+    Dataframe stored in a directory as one .npy file per column (and one for the index), so
+    that it can be read back one column at a time, or memory-mapped.
+
+    Frames (with the same columns) can be appended as chunks, each adding an .npy record to
+    every column file. A manifest with the column names and the number of rows and chunks is
+    (re)written after each append, so readers only see complete chunks.
+
+    Numeric and boolean columns of single chunk stores can be memory-mapped. Object (e.g.
+    string) columns are pickled, and are loaded into memory by each reader.
+
+    Parameters
+    ----------
+    dir_path : str
+    """
+
+    def __init__(self, dir_path):
+        self.dir_path = dir_path
+
+        # column labels of appended frames (the manifest only has their names as str)
+        self.columns = None
+
+    def index_path(self):
+        return os.path.join(self.dir_path, 'index.npy')
+
+    def column_path(self, i):
+        # position rather than name, as column names needn't be valid file names
+        return os.path.join(self.dir_path, 'column_%s.npy' % i)
+
+    def manifest(self):
+        """
+        Manifest dict (columns, index_name, rows and chunks) or None if nothing has been stored
+        """
+
+        file_path = os.path.join(self.dir_path, MANIFEST)
+        if not os.path.exists(file_path):
+            return None
+        with open(file_path) as f:
+            return json.load(f)
+
+    def append(self, df):
+        """
+        Append df (which must have the same columns as frames already appended)
+
+        Parameters
+        ----------
+        df : pandas.DataFrame
+        """
+
+        if isinstance(df.index, pd.MultiIndex):
+            raise RuntimeError("ColumnStore can't store frame with MultiIndex")
+
+        arrays = [df.index.values] + [df.iloc[:, i].values for i in range(len(df.columns))]
+        for a in arrays:
+            if not isinstance(a, np.ndarray):
+                raise RuntimeError("ColumnStore can't store column with dtype %s" % a.dtype)
+
+        manifest = self.manifest()
+        if manifest is None:
+            os.makedirs(self.dir_path, exist_ok=True)
+            manifest = {'columns': [str(c) for c in df.columns], 'index_name': df.index.name,
+                        'rows': 0, 'chunks': 0}
+        assert manifest['columns'] == [str(c) for c in df.columns]
+
+        if self.columns is None:
+            self.columns = list(df.columns)
+
+        paths = [self.index_path()] + [self.column_path(i) for i in range(len(df.columns))]
+        for file_path, a in zip(paths, arrays):
+            with open(file_path, 'ab') as f:
+                np.save(f, a, allow_pickle=True)
+
+        manifest['rows'] += len(df.index)
+        manifest['chunks'] += 1
+        with open(os.path.join(self.dir_path, MANIFEST), 'w') as f:
+            json.dump(manifest, f)
+
+    @staticmethod
+    def read_array(file_path, chunks, mmap=False):
+
+        if chunks == 1 and mmap:
+            try:
+                return np.load(file_path, mmap_mode='r')
+            except ValueError:
+                # object arrays can't be memory-mapped
+                return np.load(file_path, allow_pickle=True)
+
+        with open(file_path, 'rb') as f:
+            arrays = [np.load(f, allow_pickle=True) for _ in range(chunks)]
+
+        # numpy promotes chunks whose dtypes differ
+        return arrays[0] if chunks == 1 else np.concatenate(arrays)
+
+    def read(self, columns=None, mmap=False, remove_files=False):
+        """
+        Read stored frame (all appended chunks, in order) one column at a time
+
+        The frame's blocks aren't consolidated, so memory-mapped columns are read-only views
+        of their files rather than copies, and peak memory while reading is the frame plus
+        the chunks of a single column.
+
+        Parameters
+        ----------
+        columns : list, optional
+            column labels (default those of appended frames, or their names in the manifest)
+        mmap : bool
+            memory-map columns of single chunk stores
+        remove_files : bool
+            delete column files as they are read
+
+        Returns
+        -------
+        pandas.DataFrame
+        """
+
+        manifest = self.manifest()
+        assert manifest is not None, "nothing stored in %s" % self.dir_path
+
+        if columns is None:
+            columns = self.columns if self.columns is not None else manifest['columns']
+        assert len(columns) == len(manifest['columns'])
+
+        chunks = manifest['chunks']
+
+        index = pd.Index(self.read_array(self.index_path(), chunks, mmap), name=manifest['index_name'], copy=False)
+        if remove_files:
+            os.remove(self.index_path())
+
+        arrays = {}
+        for i in range(len(columns)):
+            arrays[i] = self.read_array(self.column_path(i), chunks, mmap)
+            if remove_files:
+                os.remove(self.column_path(i))
+
+        # copy=False leaves each column in its own block
+        df = pd.DataFrame(arrays, index=index, copy=False)
+        df.columns = columns
+
+        return df
+
+    def remove(self):
+        shutil.rmtree(self.dir_path, ignore_errors=True)
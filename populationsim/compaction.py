@@ -0,0 +1,170 @@
+# PopulationSim
+# See full license in LICENSE.txt.
+
+import logging
+
+import numpy as np
+
+from activitysim.core.config import setting
+
+
+logger = logging.getLogger(__name__)
+
+# signed only, as differences of unsigned values wrap around even when small (uint8 3 - 5 is 254).
+# Signed dtypes still wrap around when results don't fit (int8 AGEP * 2 is -116 for age 70), so
+# seed table attribute columns, which controls expressions do arithmetic on, are only downcast
+# if listed in compact_columns
+INT_DTYPES = [np.int8, np.int16, np.int32, np.int64]
+
+# zone ids are stored with at least this dtype, so they are the same dtype in every table
+ZONE_ID_DTYPE = np.int32
+
+
+def smallest_int_dtype(values, min_dtype=np.int8):
+    """
+    Smallest signed integer dtype (no smaller than min_dtype) that can hold values
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        integer values
+    min_dtype : numpy dtype
+
+    Returns
+    -------
+    numpy dtype
+        values.dtype if no smaller dtype can hold values (e.g. uint64 beyond int64 range)
+    """
+
+    if len(values) == 0:
+        return values.dtype
+
+    lo, hi = values.min(), values.max()
+    for dtype in map(np.dtype, INT_DTYPES[INT_DTYPES.index(min_dtype):]):
+        # never upcast
+        if dtype == values.dtype or dtype.itemsize > values.dtype.itemsize:
+            break
+        info = np.iinfo(dtype)
+        if info.min <= lo and hi <= info.max:
+            return dtype
+
+    return values.dtype
+
+
+def compact_integer_columns(df, columns, min_dtype=np.int8):
+    """
+    Downcast integer columns of df to the smallest signed integer dtype that holds their values
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+    columns : list of str
+        columns to downcast (non-integer columns are left as they are)
+    min_dtype : numpy dtype
+
+    Returns
+    -------
+    pandas.DataFrame
+        shallow copy of df with downcast columns (or df, if no columns were downcast)
+    """
+
+    compacted_df = None
+    for c in columns:
+        values = df[c].values
+        if not isinstance(values, np.ndarray) or values.dtype.kind not in 'iu':
+            continue
+        dtype = smallest_int_dtype(values, min_dtype)
+        if dtype != values.dtype:
+            if compacted_df is None:
+                compacted_df = df.copy(deep=False)
+            compacted_df[c] = values.astype(dtype)
+
+    return df if compacted_df is None else compacted_df
+
+
+def memory_usage(df):
+    return df.memory_usage(index=True, deep=True).sum()
+
+
+def compact_table(df, trace_label, columns=None):
+    """
+    Downcast integer columns of an input table: zone id (geographies) columns to int32 (or larger,
+    if their ids don't fit) and columns listed in columns to the smallest dtype that holds their
+    values.
+
+    Other columns are left as they are, as controls expressions do arithmetic on seed table
+    columns in their dtype, which could overflow (silently wrapping around) if they were
+    downcast. Object columns are left as they are (the pipeline's fixed format HDF5 store can't
+    hold categoricals) but are reported, as PyTables pickles them when checkpointing.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+    trace_label : str
+        table name for logging
+    columns : list of str, optional
+        non-zone columns to downcast (compact_columns in the input_table_list entry)
+
+    Returns
+    -------
+    pandas.DataFrame
+    """
+
+    geographies = setting('geographies', [])
+
+    zone_cols = [c for c in df.columns if c in geographies]
+    other_cols = [c for c in (columns or []) if c not in geographies]
+
+    missing_cols = [c for c in other_cols if c not in df.columns]
+    if missing_cols:
+        raise RuntimeError("%s compact_columns %s not in table" % (trace_label, missing_cols))
+
+    compacted_df = compact_integer_columns(df, zone_cols, min_dtype=ZONE_ID_DTYPE)
+    compacted_df = compact_integer_columns(compacted_df, other_cols)
+
+    object_cols = [c for c in df.columns if df[c].dtype == object]
+    if object_cols:
+        logger.info("%s object columns %s will be pickled when checkpointed "
+                    "(consider drop_columns if unused)" % (trace_label, object_cols))
+
+    log_savings(df, compacted_df, trace_label)
+
+    return compacted_df
+
+
+def compact_incidence_table(incidence_df, control_spec):
+    """
+    Downcast incidence_table control columns (counts, usually int8) and zone id columns
+
+    Parameters
+    ----------
+    incidence_df : pandas.DataFrame
+    control_spec : pandas.DataFrame
+
+    Returns
+    -------
+    pandas.DataFrame
+    """
+
+    geographies = setting('geographies', [])
+
+    control_cols = [c for c in control_spec.target if c in incidence_df.columns]
+    zone_cols = [c for c in incidence_df.columns if c in geographies]
+
+    compacted_df = compact_integer_columns(incidence_df, control_cols)
+    compacted_df = compact_integer_columns(compacted_df, zone_cols, min_dtype=ZONE_ID_DTYPE)
+
+    log_savings(incidence_df, compacted_df, 'incidence_table')
+
+    return compacted_df
+
+
+def log_savings(df, compacted_df, trace_label):
+
+    if compacted_df is df:
+        return
+
+    before = memory_usage(df)
+    after = memory_usage(compacted_df)
+    logger.info("compacted %s from %.2f MB to %.2f MB (saved %.0f%%)" %
+                (trace_label, before / 1e6, after / 1e6, 100.0 * (before - after) / max(before, 1)))
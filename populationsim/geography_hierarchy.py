@@ -0,0 +1,144 @@
+# PopulationSim
+# See full license in LICENSE.txt.
+
+import logging
+
+import numpy as np
+import pandas as pd
+
+
+logger = logging.getLogger(__name__)
+
+
+class GeographyHierarchy(object):
+    """
+    Index of the nesting of zones in the crosswalk, built once so that steps can look up
+    the sub zones of a zone, or the ancestor zones of a zone, without rescanning the crosswalk.
+
+    For each geography, zone ids are kept in order of first appearance in the crosswalk (the
+    order in which crosswalk_df[geography].unique() returns them) along with a vector of the
+    id of each zone's ancestor at every higher geography. For each pair of geographies, the
+    ids of the sub zones of each zone are stored in CSR form (zone offsets into a single
+    array of sub zone ids).
+
+    Parameters
+    ----------
+    crosswalk_df : pandas.DataFrame
+        crosswalk with one column per geography (and one row per lowest geography zone)
+    geographies : list of str
+        geographies in descending order (e.g. meta, seed, ... low)
+    """
+
+    def __init__(self, crosswalk_df, geographies):
+
+        self.geographies = list(geographies)
+
+        # {geography: zone ids}
+        self.zone_ids = {}
+        # {geography: pandas.Index of zone ids (for positional lookup)}
+        self.zone_index = {}
+        # {geography: {ancestor_geography: ancestor zone id of each zone}}
+        self.ancestor_ids = {}
+        # {(geography, sub_geography): (zone offsets, sub zone ids)}
+        self.sub_zones = {}
+        # {(geography, ancestor_geography): whether each zone has a single ancestor zone}
+        self.nested = {}
+
+        for i, g in enumerate(self.geographies):
+
+            # one row per zone, in order of first appearance
+            zones_df = crosswalk_df[self.geographies[:i + 1]].drop_duplicates(subset=g)
+
+            self.zone_ids[g] = zones_df[g].values
+            self.zone_index[g] = pd.Index(zones_df[g].values)
+
+            self.ancestor_ids[g] = {a: zones_df[a].values for a in self.geographies[:i]}
+
+            for a in self.geographies[:i]:
+                self.nested[(g, a)] = crosswalk_df.groupby(g)[a].nunique().max() <= 1
+                if not self.nested[(g, a)]:
+                    logger.warning("%s zones are not nested in %s zones" % (g, a))
+
+        for i, g in enumerate(self.geographies):
+            for sub_geography in self.geographies[i + 1:]:
+
+                # position of each sub zone's ancestor zone
+                parent = self.zone_index[g].get_indexer(self.ancestor_ids[sub_geography][g])
+
+                # stable sort keeps sub zones in crosswalk order within each zone
+                order = np.argsort(parent, kind='stable')
+                offsets = np.zeros(len(self.zone_ids[g]) + 1, dtype=np.int64)
+                offsets[1:] = np.cumsum(np.bincount(parent, minlength=len(self.zone_ids[g])))
+
+                self.sub_zones[(g, sub_geography)] = (offsets, self.zone_ids[sub_geography][order])
+
+    def is_nested(self, geography, ancestor_geography):
+        """
+        Whether every geography zone lies within a single ancestor_geography zone
+        """
+        return geography == ancestor_geography or self.nested[(geography, ancestor_geography)]
+
+    def sub_zone_ids(self, geography, zone_id, sub_geography):
+        """
+        Ids of the sub_geography zones within a geography zone
+
+        Parameters
+        ----------
+        geography : str
+        zone_id : zone id
+        sub_geography : str
+            geography at or below geography
+
+        Returns
+        -------
+        numpy.ndarray of sub zone ids (in crosswalk order)
+        """
+
+        if sub_geography == geography:
+            return self.zone_ids[geography][[self.zone_index[geography].get_loc(zone_id)]]
+
+        offsets, sub_zone_ids = self.sub_zones[(geography, sub_geography)]
+        i = self.zone_index[geography].get_loc(zone_id)
+        return sub_zone_ids[offsets[i]:offsets[i + 1]]
+
+    def ancestors(self, geography):
+        """
+        Ancestor zone ids of every zone of a geography
+
+        Parameters
+        ----------
+        geography : str
+
+        Returns
+        -------
+        pandas.DataFrame
+            indexed by geography zone id with one column per higher geography (in order)
+        """
+
+        return pd.DataFrame(self.ancestor_ids[geography],
+                            index=pd.Index(self.zone_ids[geography], name=geography),
+                            columns=self.geographies[:self.geographies.index(geography)])
+
+    def ancestor_map(self, geography, ancestor_geography):
+        """
+        Series mapping geography zone ids to their ancestor_geography zone ids
+        (e.g. for use with pandas.Series.map)
+
+        Parameters
+        ----------
+        geography : str
+        ancestor_geography : str
+            geography at or above geography
+
+        Returns
+        -------
+        pandas.Series
+        """
+
+        if ancestor_geography == geography:
+            ids = self.zone_ids[geography]
+        else:
+            ids = self.ancestor_ids[geography][ancestor_geography]
+
+        return pd.Series(ids, index=pd.Index(self.zone_ids[geography], name=geography),
+                         name=ancestor_geography)
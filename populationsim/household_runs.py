@@ -0,0 +1,125 @@
+# PopulationSim
+# See full license in LICENSE.txt.
+
+import logging
+
+import numpy as np
+import pandas as pd
+
+
+logger = logging.getLogger(__name__)
+
+# name of expanded_household_ids column with number of synthetic households in each run
+COUNT_COL = 'household_count'
+
+# default maximum number of synthetic households to expand at a time
+DEFAULT_CHUNK_SIZE = 1000000
+
+
+def household_runs(runs_df, key_cols, count_col=COUNT_COL):
+    """
+    Canonical run-length encoded synthetic household list: one row per distinct combination
+    of key_cols (zone ids and household id) with the number of synthetic households in that
+    zone drawn from that household, sorted by key_cols.
+
+    Expanding the runs gives the same synthetic household list (in the same order) as
+    expanding runs_df and sorting the expanded rows by key_cols.
+
+    Parameters
+    ----------
+    runs_df : pandas.DataFrame
+        key_cols and count_col columns, possibly with duplicate or zero count rows
+    key_cols : list of str
+        geography zone id columns and household id column
+    count_col : str
+        name of column with number of households in each row of runs_df
+
+    Returns
+    -------
+    pandas.DataFrame
+        with key_cols and count_col columns
+    """
+
+    runs_df = runs_df[runs_df[count_col] > 0]
+    runs_df = runs_df.groupby(key_cols, as_index=False, sort=True)[count_col].sum()
+
+    return runs_df
+
+
+def expand_runs(runs_df, count_col=COUNT_COL):
+    """
+    Expand runs into one row per synthetic household (without count_col)
+
+    Unlike numpy.repeat on the frame's values, column dtypes are preserved.
+
+    Parameters
+    ----------
+    runs_df : pandas.DataFrame
+    count_col : str
+
+    Returns
+    -------
+    pandas.DataFrame
+        with one row per synthetic household, indexed from 0
+    """
+
+    counts = runs_df[count_col].values.astype(np.int64)
+    positions = np.repeat(np.arange(len(runs_df.index)), counts)
+
+    columns = [c for c in runs_df.columns if c != count_col]
+    expanded_df = pd.DataFrame({c: runs_df[c].values[positions] for c in columns}, columns=columns)
+
+    return expanded_df
+
+
+def iter_run_chunks(runs_df, chunk_size=DEFAULT_CHUNK_SIZE, count_col=COUNT_COL):
+    """
+    Generator yielding consecutive slices of runs_df with at most chunk_size synthetic households
+    (or a single run, if that run alone has more than chunk_size)
+
+    Parameters
+    ----------
+    runs_df : pandas.DataFrame
+    chunk_size : int
+    count_col : str
+
+    Yields
+    ------
+    first_household : int
+        position in the expanded household list of the first household in chunk
+    chunk_df : pandas.DataFrame
+        slice of runs_df
+    """
+
+    counts = runs_df[count_col].values.astype(np.int64)
+    ends = np.cumsum(counts)
+
+    start = 0
+    while start < len(counts):
+        first_household = ends[start] - counts[start]
+        end = max(np.searchsorted(ends, first_household + chunk_size, side='right'), start + 1)
+        yield first_household, runs_df.iloc[start:end]
+        start = end
+
+
+def iter_expanded(runs_df, chunk_size=DEFAULT_CHUNK_SIZE, count_col=COUNT_COL):
+    """
+    Lazily expand runs, a chunk at a time
+
+    Parameters
+    ----------
+    runs_df : pandas.DataFrame
+    chunk_size : int
+    count_col : str
+
+    Yields
+    ------
+    pandas.DataFrame
+        one row per synthetic household (as for expand_runs) indexed by position in the
+        expanded household list
+    """
+
+    for first_household, chunk_df in iter_run_chunks(runs_df, chunk_size, count_col):
+        expanded_df = expand_runs(chunk_df, count_col)
+        expanded_df.index += first_household
+        yield expanded_df
@@ -11,9 +11,13 @@ import numpy as np
 import pandas as pd
 from activitysim.core.config import setting
 
+from .performance import set_status
 from .lp import get_single_integerizer
+from .lp import get_solver_time_budget
 from .lp import STATUS_SUCCESS
 from .lp import STATUS_OPTIMAL
+from .lp_enumerate import np_integerizer_enumerate
+from .lp_enumerate import DEFAULT_MAX_ENUMERATIONS
 
 
 logger = logging.getLogger(__name__)
@@ -61,6 +65,43 @@ def smart_round(int_weights, resid_weights, target_sum):
     return rounded_weights
 
 
+def resid_weights_hint(resid_weights, shortfall):
+    """
+    Initial solution hint for the integerizer lp: round up the shortfall highest resid_weights
+    (as smart_round does) so the hint satisfies the total households constraint if possible.
+
+    Parameters
+    ----------
+    resid_weights : numpy.ndarray(float)
+        fractional part of float weights (zero for weights that are already integers)
+    shortfall : int
+        number of resid_weights to round up (total households lp right hand side)
+
+    Returns
+    -------
+    hint : numpy.ndarray(float) of 0.0 and 1.0 values
+    """
+
+    hint = smart_round(np.zeros(len(resid_weights), dtype=int), resid_weights, shortfall)
+
+    # can't round up integer weights (lp constrains them to zero)
+    hint[resid_weights == 0.0] = 0
+
+    return hint.astype(np.float64)
+
+
+def use_integerizer_hints():
+
+    # off by default: the ortools and CVXPY integerizers solve continuous lp relaxations,
+    # which ignore initial solutions, so hints only cost the time to build them
+    return setting('USE_INTEGERIZER_HINTS', False)
+
+
+def integerizer_max_enumerations():
+
+    return setting('INTEGERIZER_MAX_ENUMERATIONS', DEFAULT_MAX_ENUMERATIONS)
+
+
 class Integerizer(object):
     def __init__(self,
                  incidence_table,
@@ -172,9 +213,7 @@ class Integerizer(object):
                             ((resid_weights == 0).sum(), sample_count))
                 # assert False
 
-            integerizer_func = get_single_integerizer()
-
-            resid_weights, status = integerizer_func(
+            lp = dict(
                 incidence=incidence,
                 resid_weights=resid_weights,
                 log_resid_weights=log_resid_weights,
@@ -182,9 +221,31 @@ class Integerizer(object):
                 total_hh_control_index=self.total_hh_control_index,
                 lp_right_hand_side=lp_right_hand_side,
                 relax_ge_upper_bound=relax_ge_upper_bound,
-                hh_constraint_ge_bound=hh_constraint_ge_bound
+                hh_constraint_ge_bound=hh_constraint_ge_bound,
             )
 
+            # small problems (e.g. zones with a handful of households) are solved exactly
+            # by enumeration, falling back to the lp solver if too large or infeasible
+            status = None
+            max_enumerations = integerizer_max_enumerations()
+            if max_enumerations > 0:
+                enumerated_weights, status = \
+                    np_integerizer_enumerate(max_enumerations=max_enumerations, **lp)
+                logger.debug("Integerizer: np_integerizer_enumerate status %s" % status)
+
+            if status in STATUS_SUCCESS:
+                resid_weights = enumerated_weights
+            else:
+                if use_integerizer_hints():
+                    hint = resid_weights_hint(resid_weights, lp_right_hand_side[self.total_hh_control_index])
+                else:
+                    hint = None
+
+                integerizer_func = get_single_integerizer()
+
+                with get_solver_time_budget().allocate(sample_count, self.trace_label) as time_limit:
+                    resid_weights, status = integerizer_func(hint=hint, time_limit=time_limit, **lp)
+
             print("smart_round with self.total_hh_control_value: {:.8f}".format(self.total_hh_control_value))
             integerized_weights = \
                 smart_round(int_weights, resid_weights, self.total_hh_control_value)
@@ -319,6 +380,8 @@ def do_integerizing(
     elif status != 'OPTIMAL':
         logger.warning("Integerizer status non-optimal for %s status %s." % (trace_label, status))
 
+    set_status(status)
+
     integerized_weights = pd.Series(0, index=zero_weight_rows.index)
     integerized_weights.update(integerizer.weights['integerized_weight'])
     return integerized_weights, status
@@ -2,23 +2,160 @@
 # PopulationSim
 # See full license in LICENSE.txt.
 
+import contextlib
 import logging
+import time
 
+from activitysim.core import inject
 from activitysim.core.config import setting
 from . import lp_cvx
+from . import lp_heuristic
 from . import lp_ortools
 
+logger = logging.getLogger(__name__)
 
 STATUS_OPTIMAL = 'OPTIMAL'
 STATUS_FEASIBLE = 'FEASIBLE'
 STATUS_SUCCESS = [STATUS_OPTIMAL, STATUS_FEASIBLE]
 
+# default maximum seconds for any single integerizer solve
+DEFAULT_SOLVER_TIME_LIMIT = 60
+
+# default minimum seconds for a single integerizer solve (e.g. once budget is exhausted)
+DEFAULT_SOLVER_MIN_TIME_LIMIT = 1
+
+# log budget consumption when it crosses each of these fractions of the budget
+BUDGET_LOG_FRACTIONS = [0.25, 0.5, 0.75, 0.9, 1.0]
+
 
 def use_cvxpy():
 
     return setting('USE_CVXPY', False)
 
 
+def use_heuristic_integerizer():
+
+    return setting('USE_HEURISTIC_INTEGERIZER', False)
+
+
+class SolverTimeBudget(object):
+    """
+    Allocate integerizer solver time limits from an (optional) run-level budget.
+
+    Each solve gets at most max_time_limit seconds, scaled down for small problems by
+    seconds_per_variable (if specified), and no more than what is left of the budget
+    (if specified), but never less than min_time_limit.
+
+    Solvers return their best incumbent solution (status FEASIBLE) if they reach the
+    time limit after finding a feasible solution.
+    """
+
+    def __init__(self, budget=None, max_time_limit=DEFAULT_SOLVER_TIME_LIMIT,
+                 min_time_limit=DEFAULT_SOLVER_MIN_TIME_LIMIT, seconds_per_variable=None):
+        """
+        Parameters
+        ----------
+        budget : float or None
+            total seconds available for all integerizer solves (None for no budget)
+        max_time_limit : float
+            maximum seconds for any single solve
+        min_time_limit : float
+            minimum seconds for any single solve
+        seconds_per_variable : float or None
+            seconds per household variable, to scale time limits by problem size
+        """
+
+        self.budget = budget
+        self.max_time_limit = max_time_limit
+        self.min_time_limit = min(min_time_limit, max_time_limit)
+        self.seconds_per_variable = seconds_per_variable
+
+        self.used = 0.0
+        self.solve_count = 0
+        self.time_limit_count = 0
+        self.logged_fractions = 0
+
+    def remaining(self):
+
+        return None if self.budget is None else max(self.budget - self.used, 0)
+
+    def time_limit(self, variable_count):
+        """
+        Return time limit in seconds for a problem with variable_count household variables
+        """
+
+        time_limit = self.max_time_limit
+
+        if self.seconds_per_variable:
+            time_limit = min(time_limit, self.seconds_per_variable * variable_count)
+
+        if self.budget is not None:
+            time_limit = min(time_limit, self.remaining())
+
+        return max(time_limit, self.min_time_limit)
+
+    def charge(self, elapsed, time_limit, trace_label):
+        """
+        Record elapsed solver time and log budget consumption
+        """
+
+        self.used += elapsed
+        self.solve_count += 1
+
+        if elapsed >= time_limit:
+            self.time_limit_count += 1
+            logger.warning("%s integerizer reached time limit of %s seconds" % (trace_label, time_limit))
+
+        logger.debug("%s integerizer used %.3f of %s seconds" % (trace_label, elapsed, time_limit))
+
+        if self.budget is None:
+            return
+
+        while self.logged_fractions < len(BUDGET_LOG_FRACTIONS) and \
+                self.used >= BUDGET_LOG_FRACTIONS[self.logged_fractions] * self.budget:
+            self.logged_fractions += 1
+            log = logger.warning if self.used >= self.budget else logger.info
+            log("solver time budget %.0f%% consumed: %.1f of %s seconds by %s solves (%s reached time limit)"
+                % (100 * self.used / self.budget, self.used, self.budget,
+                   self.solve_count, self.time_limit_count))
+
+    @contextlib.contextmanager
+    def allocate(self, variable_count, trace_label):
+        """
+        Context manager yielding time limit for a solve and charging elapsed time to budget
+
+        Parameters
+        ----------
+        variable_count : int
+            number of household variables (problem size)
+        trace_label : str
+        """
+
+        time_limit = self.time_limit(variable_count)
+
+        start = time.perf_counter()
+        yield time_limit
+        self.charge(time.perf_counter() - start, time_limit, trace_label)
+
+
+@inject.injectable(cache=True)
+def solver_time_budget():
+
+    return SolverTimeBudget(
+        budget=setting('SOLVER_TIME_BUDGET', None),
+        max_time_limit=setting('SOLVER_TIME_LIMIT', DEFAULT_SOLVER_TIME_LIMIT),
+        min_time_limit=setting('SOLVER_MIN_TIME_LIMIT', DEFAULT_SOLVER_MIN_TIME_LIMIT),
+        seconds_per_variable=setting('SOLVER_SECONDS_PER_VARIABLE', None))
+
+
+def get_solver_time_budget():
+    """
+    Return the SolverTimeBudget for this run
+    """
+
+    return inject.get_injectable('solver_time_budget')
+
+
 def get_single_integerizer():
     """
     Return single integerizer function using installed/configured Linear Programming library.
@@ -38,11 +175,18 @@ def get_single_integerizer():
             total_hh_control_index,
             lp_right_hand_side,
             relax_ge_upper_bound,
-            hh_constraint_ge_bound)
+            hh_constraint_ge_bound,
+            hint=None,
+            time_limit=None)
+
+    If USE_HEURISTIC_INTEGERIZER is set, an LP-free greedy rounding and local search heuristic
+    (lp_heuristic) is used instead, trading control fit for speed on very large zones.
 
     """
 
-    if use_cvxpy():
+    if use_heuristic_integerizer():
+        integerizer_func = lp_heuristic.np_integerizer_heuristic
+    elif use_cvxpy():
         integerizer_func = lp_cvx.np_integerizer_cvx
     else:
         integerizer_func = lp_ortools.np_integerizer_ortools
@@ -78,11 +222,24 @@ def get_simul_integerizer():
             hh_constraint_ge_bound,
             parent_resid_weights,
             total_hh_sub_control_index,
-            total_hh_parent_control_index)
+            total_hh_parent_control_index,
+            hint=None,
+            time_limit=None)
+
+    hint is an optional initial solution (e.g. smart-rounded resid weights) with the shape of
+    the resid weights, which solvers that support warm starts use to find a feasible
+    solution sooner.
+
+    time_limit is an optional solver time limit in seconds (see SolverTimeBudget)
+
+    If USE_HEURISTIC_INTEGERIZER is set, an LP-free greedy rounding and local search heuristic
+    (lp_heuristic) is used instead.
 
     """
 
-    if use_cvxpy():
+    if use_heuristic_integerizer():
+        integerizer_func = lp_heuristic.np_simul_integerizer_heuristic
+    elif use_cvxpy():
         integerizer_func = lp_cvx.np_simul_integerizer_cvx
     else:
         integerizer_func = lp_ortools.np_simul_integerizer_ortools
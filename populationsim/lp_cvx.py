@@ -1,4 +1,3 @@
-
 # PopulationSim
 # See full license in LICENSE.txt.
 
@@ -13,8 +12,177 @@ STATUS_OPTIMAL = 'OPTIMAL'
 STATUS_FEASIBLE = 'FEASIBLE'
 STATUS_SUCCESS = [STATUS_OPTIMAL, STATUS_FEASIBLE]
 
-# 'CBC', 'GLPK_MI', 'ECOS_BB'
-CVX_SOLVER = 'GLPK_MI'
+# integerizer lp variables are continuous, so any installed lp solver will do, but
+# simplex solvers (HIGHS, or SCIPY which wraps HiGHS) return the basic solutions that smart_round expects
+# solver can be specified with CVX_SOLVER setting, otherwise the first installed of these is used
+CVX_SOLVERS = ['HIGHS', 'SCIPY', 'SCIP', 'CBC', 'GLPK_MI', 'GLPK', 'GLOP', 'CLARABEL', 'ECOS']
+
+# solver-specific time limit options (in seconds) for cvxpy solve
+CVX_TIME_LIMIT_OPTIONS = {
+    'HIGHS': lambda seconds: {'time_limit': seconds},
+    'SCIPY': lambda seconds: {'scipy_options': {'time_limit': seconds}},
+    'SCIP': lambda seconds: {'scip_params': {'limits/time': seconds}},
+    'CBC': lambda seconds: {'maximumSeconds': int(seconds)},
+    'CLARABEL': lambda seconds: {'time_limit': seconds},
+}
+
+# number of compiled cvxpy problems to keep for reuse (shared with lp_ortools)
+DEFAULT_INTEGERIZER_MODEL_CACHE_SIZE = 8
+
+LOG_OVERFLOW = -725
+
+# most recently used compiled problems (most recent last)
+_INTEGERIZER_PROBLEMS = []
+
+
+def cvx_solver():
+    """
+    Return name of the cvxpy solver to use for integerizing (CVX_SOLVER setting if specified,
+    otherwise first installed solver in CVX_SOLVERS)
+    """
+
+    import cvxpy as cvx
+
+    installed_solvers = cvx.installed_solvers()
+
+    solver = setting('CVX_SOLVER', None)
+    if solver is None:
+        solvers = [s for s in CVX_SOLVERS if s in installed_solvers]
+        assert solvers, "None of CVX_SOLVERS %s in installed solvers %s." % (CVX_SOLVERS, installed_solvers)
+        solver = solvers[0]
+
+    assert solver in installed_solvers, \
+        "CVX Solver '%s' not in installed solvers %s." % (solver, installed_solvers)
+
+    return solver
+
+
+def status_text(status):
+
+    import cvxpy as cvx
+
+    STATUS_TEXT = {
+        cvx.OPTIMAL: STATUS_OPTIMAL,
+        cvx.OPTIMAL_INACCURATE: STATUS_FEASIBLE,  # for compatability with ortools
+        cvx.INFEASIBLE: 'INFEASIBLE',
+        cvx.UNBOUNDED: 'UNBOUNDED',
+        cvx.INFEASIBLE_INACCURATE: 'INFEASIBLE_INACCURATE',
+        cvx.UNBOUNDED_INACCURATE: 'UNBOUNDED_INACCURATE',
+        None: 'FAILED'
+    }
+
+    return STATUS_TEXT.get(status, str(status).upper())
+
+
+def get_problem(key, build_problem):
+    """
+    Return cached (problem, parameters, variables) for key, or build (and cache) it if not found.
+
+    cvxpy problems built from Parameters are Disciplined Parametrized Programs (DPP), so
+    cvxpy canonicalizes them on the first solve and only substitutes new parameter values
+    on subsequent solves. Problems are keyed by shape, so zones of the same shape share them.
+    """
+
+    for cached_key, problem in _INTEGERIZER_PROBLEMS:
+        if cached_key == key:
+            _INTEGERIZER_PROBLEMS.remove((cached_key, problem))
+            _INTEGERIZER_PROBLEMS.append((cached_key, problem))
+            return problem
+
+    problem = build_problem()
+
+    cache_size = setting('INTEGERIZER_MODEL_CACHE_SIZE', DEFAULT_INTEGERIZER_MODEL_CACHE_SIZE)
+    if cache_size > 0:
+        _INTEGERIZER_PROBLEMS.append((key, problem))
+        del _INTEGERIZER_PROBLEMS[:-cache_size]
+
+    return problem
+
+
+def solve(prob, x, time_limit, trace_label):
+    """
+    Solve prob (with time_limit in seconds, if supported by solver) and return status text
+
+    If the solver reaches the time limit with a solution for x, status is STATUS_FEASIBLE
+    """
+
+    import cvxpy as cvx
+
+    solver = cvx_solver()
+    logger.info("%s with '%s' solver." % (trace_label, solver))
+
+    solver_options = {}
+    if time_limit is not None:
+        if solver in CVX_TIME_LIMIT_OPTIONS:
+            solver_options = CVX_TIME_LIMIT_OPTIONS[solver](time_limit)
+        else:
+            logger.debug("%s time limit not supported for '%s' solver" % (trace_label, solver))
+
+    try:
+        prob.solve(solver=solver, warm_start=True, **solver_options)
+    except cvx.SolverError as e:
+        logger.warning('Solver error in %s: %s' % (trace_label, e))
+        return status_text(None)
+
+    # best incumbent solution if solver reached time limit
+    if prob.status == cvx.USER_LIMIT and x.value is not None:
+        return STATUS_FEASIBLE
+
+    return status_text(prob.status)
+
+
+def build_integerizer_problem(control_count, sample_count):
+
+    import cvxpy as cvx
+
+    p = {
+        'incidence': cvx.Parameter((control_count, sample_count)),
+        'log_resid_weights': cvx.Parameter(sample_count),
+        'control_importance_weights': cvx.Parameter(control_count, nonneg=True),
+        'lp_right_hand_side': cvx.Parameter(control_count, nonneg=True),
+        'relax_ge_upper_bound': cvx.Parameter(control_count, nonneg=True),
+        'hh_constraint_ge_bound': cvx.Parameter(control_count),
+        'max_x': cvx.Parameter(sample_count, nonneg=True),
+        'total_hh_constraint': cvx.Parameter(),
+    }
+
+    # - Decision variables for optimization
+    x = cvx.Variable(sample_count)
+
+    # - Create positive continuous constraint relaxation variables
+    relax_le = cvx.Variable(control_count)
+    relax_ge = cvx.Variable(control_count)
+
+    # - Set objective
+    objective = cvx.Maximize(
+        p['log_resid_weights'] @ x -
+        p['control_importance_weights'] @ relax_le -
+        p['control_importance_weights'] @ relax_ge
+    )
+
+    weighted_incidence = p['incidence'] @ x
+
+    constraints = [
+        # - inequality constraints
+        weighted_incidence - relax_le >= 0,
+        weighted_incidence - relax_le <= p['lp_right_hand_side'],
+        weighted_incidence + relax_ge >= p['lp_right_hand_side'],
+        weighted_incidence + relax_ge <= p['hh_constraint_ge_bound'],
+
+        x >= 0.0,
+        x <= p['max_x'],
+
+        relax_le >= 0.0,
+        relax_le <= p['lp_right_hand_side'],
+
+        relax_ge >= 0.0,
+        relax_ge <= p['relax_ge_upper_bound'],
+
+        # - equality constraint for the total households control
+        cvx.sum(x) == p['total_hh_constraint'],
+    ]
+
+    return cvx.Problem(objective, constraints), p, x
 
 
 def np_integerizer_cvx(
@@ -25,7 +193,9 @@ def np_integerizer_cvx(
         total_hh_control_index,
         lp_right_hand_side,
         relax_ge_upper_bound,
-        hh_constraint_ge_bound):
+        hh_constraint_ge_bound,
+        hint=None,
+        time_limit=None):
     """
     cvx-based single-integerizer function taking numpy data types and conforming to a
     standard function signature that allows it to be swapped interchangeably with alternate
@@ -41,6 +211,10 @@ def np_integerizer_cvx(
     lp_right_hand_side : numpy.ndarray(control_count,) float
     relax_ge_upper_bound : numpy.ndarray(control_count,) float
     hh_constraint_ge_bound : numpy.ndarray(control_count,) float
+    hint : numpy.ndarray(sample_count,) float
+        optional initial solution (values in range [0..1]) used to warm start solver
+    time_limit : float
+        optional solver time limit in seconds (if supported by solver)
 
     Returns
     -------
@@ -48,87 +222,115 @@ def np_integerizer_cvx(
     status_text : str
     """
 
+    control_count, sample_count = incidence.shape
+
+    prob, p, x = get_problem(
+        ('integerizer', control_count, sample_count),
+        lambda: build_integerizer_problem(control_count, sample_count))
+
+    # FIXME - could ignore as handled by constraint?
+    control_importance_weights = control_importance_weights.copy()
+    control_importance_weights[total_hh_control_index] = 0
+
+    p['incidence'].value = incidence
+    p['log_resid_weights'].value = log_resid_weights
+    p['control_importance_weights'].value = control_importance_weights
+    p['lp_right_hand_side'].value = lp_right_hand_side
+    p['relax_ge_upper_bound'].value = relax_ge_upper_bound
+    p['hh_constraint_ge_bound'].value = hh_constraint_ge_bound
+    # 1.0 unless resid_weights is zero
+    p['max_x'].value = (~(resid_weights == 0.0)).astype(float)
+    p['total_hh_constraint'].value = lp_right_hand_side[total_hh_control_index]
+
+    # - initial solution for solvers that support warm starts
+    x.value = hint
+
+    status = solve(prob, x, time_limit, 'integerizing')
+
+    if status in STATUS_SUCCESS:
+        assert x.value is not None
+        resid_weights_out = np.clip(np.asarray(x.value), 0.0, 1.0)
+    else:
+        resid_weights_out = resid_weights
+
+    return resid_weights_out, status
+
+
+def build_simul_integerizer_problem(sub_zone_count, sample_count, sub_control_count, parent_control_count):
+
     import cvxpy as cvx
 
-    STATUS_TEXT = {
-        cvx.OPTIMAL: STATUS_OPTIMAL,
-        cvx.INFEASIBLE: 'INFEASIBLE',
-        cvx.UNBOUNDED: 'UNBOUNDED',
-        cvx.OPTIMAL_INACCURATE: STATUS_FEASIBLE,
-        cvx.INFEASIBLE_INACCURATE: 'INFEASIBLE_INACCURATE',
-        cvx.UNBOUNDED_INACCURATE: 'UNBOUNDED_INACCURATE',
-        None: 'FAILED'
+    p = {
+        'sub_incidence': cvx.Parameter((sample_count, sub_control_count)),
+        'parent_incidence': cvx.Parameter((sample_count, parent_control_count)),
+        'log_resid_weights': cvx.Parameter((sub_zone_count, sample_count)),
+        'log_parent_resid_weights': cvx.Parameter(sample_count),
+        'sub_countrol_importance': cvx.Parameter(sub_control_count, nonneg=True),
+        'parent_countrol_importance': cvx.Parameter(parent_control_count, nonneg=True),
+        'lp_right_hand_side': cvx.Parameter((sub_zone_count, sub_control_count), nonneg=True),
+        'relax_ge_upper_bound': cvx.Parameter((sub_zone_count, sub_control_count), nonneg=True),
+        'hh_constraint_ge_bound': cvx.Parameter((sub_zone_count, sub_control_count)),
+        'parent_lp_right_hand_side': cvx.Parameter(parent_control_count, nonneg=True),
+        'parent_relax_ge_upper_bound': cvx.Parameter(parent_control_count, nonneg=True),
+        'parent_hh_constraint_ge_bound': cvx.Parameter(parent_control_count),
+        'total_hh_right_hand_side': cvx.Parameter(sub_zone_count),
+        'x_max': cvx.Parameter((sub_zone_count, sample_count), nonneg=True),
     }
-    CVX_MAX_ITERS = 300
-
-    incidence = incidence.T
-    sample_count, control_count = incidence.shape
 
     # - Decision variables for optimization
-    x = cvx.Variable(1, sample_count)
+    x = cvx.Variable((sub_zone_count, sample_count))
 
     # - Create positive continuous constraint relaxation variables
-    relax_le = cvx.Variable(control_count)
-    relax_ge = cvx.Variable(control_count)
-
-    # FIXME - could ignore as handled by constraint?
-    control_importance_weights[total_hh_control_index] = 0
+    relax_le = cvx.Variable((sub_zone_count, sub_control_count))
+    relax_ge = cvx.Variable((sub_zone_count, sub_control_count))
 
-    # - Set objective
+    parent_relax_le = cvx.Variable(parent_control_count)
+    parent_relax_ge = cvx.Variable(parent_control_count)
 
+    # subzone and parent objective and relaxation penalties
     objective = cvx.Maximize(
-        cvx.sum_entries(cvx.mul_elemwise(log_resid_weights, cvx.vec(x))) -
-        cvx.sum_entries(cvx.mul_elemwise(control_importance_weights, relax_le)) -
-        cvx.sum_entries(cvx.mul_elemwise(control_importance_weights, relax_ge))
+        cvx.sum(cvx.multiply(p['log_resid_weights'], x)) +
+        p['log_parent_resid_weights'] @ cvx.sum(x, axis=0) -
+        cvx.sum(relax_le @ p['sub_countrol_importance']) -
+        cvx.sum(relax_ge @ p['sub_countrol_importance']) -
+        p['parent_countrol_importance'] @ parent_relax_le -
+        p['parent_countrol_importance'] @ parent_relax_ge
     )
 
-    total_hh_constraint = lp_right_hand_side[total_hh_control_index]
-
-    # 1.0 unless resid_weights is zero
-    max_x = (~(resid_weights == 0.0)).astype(float).reshape((1, -1))
+    sub_weighted_incidence = x @ p['sub_incidence']
+    parent_weighted_incidence = cvx.sum(x, axis=0) @ p['parent_incidence']
 
     constraints = [
-        # - inequality constraints
-        cvx.vec(x * incidence) - relax_le >= 0,
-        cvx.vec(x * incidence) - relax_le <= lp_right_hand_side,
-        cvx.vec(x * incidence) + relax_ge >= lp_right_hand_side,
-        cvx.vec(x * incidence) + relax_ge <= hh_constraint_ge_bound,
+        sub_weighted_incidence - relax_le >= 0,
+        sub_weighted_incidence - relax_le <= p['lp_right_hand_side'],
+        sub_weighted_incidence + relax_ge >= p['lp_right_hand_side'],
+        sub_weighted_incidence + relax_ge <= p['hh_constraint_ge_bound'],
 
         x >= 0.0,
-        x <= max_x,
+        x <= p['x_max'],
 
         relax_le >= 0.0,
-        relax_le <= lp_right_hand_side,
+        relax_le <= p['lp_right_hand_side'],
 
         relax_ge >= 0.0,
-        relax_ge <= relax_ge_upper_bound,
+        relax_ge <= p['relax_ge_upper_bound'],
 
         # - equality constraint for the total households control
-        cvx.sum_entries(x) == total_hh_constraint,
-    ]
-
-    prob = cvx.Problem(objective, constraints)
+        cvx.sum(x, axis=1) == p['total_hh_right_hand_side'],
 
-    assert CVX_SOLVER in cvx.installed_solvers(), \
-        "CVX Solver '%s' not in installed solvers %s." % (CVX_SOLVER, cvx.installed_solvers())
-    logger.info("integerizing with '%s' solver." % CVX_SOLVER)
+        parent_weighted_incidence - parent_relax_le >= 0,
+        parent_weighted_incidence - parent_relax_le <= p['parent_lp_right_hand_side'],
+        parent_weighted_incidence + parent_relax_ge >= p['parent_lp_right_hand_side'],
+        parent_weighted_incidence + parent_relax_ge <= p['parent_hh_constraint_ge_bound'],
 
-    try:
-        prob.solve(solver=CVX_SOLVER, verbose=True, max_iters=CVX_MAX_ITERS)
-    except cvx.SolverError:
-        logging.exception(
-            'Solver error encountered in weight discretization. Weights will be rounded.')
-
-    status_text = STATUS_TEXT[prob.status]
+        parent_relax_le >= 0.0,
+        parent_relax_le <= p['parent_lp_right_hand_side'],
 
-    if status_text in STATUS_SUCCESS:
-        assert x.value is not None
-        resid_weights_out = np.asarray(x.value)[0]
-    else:
-        assert x.value is None
-        resid_weights_out = resid_weights
+        parent_relax_ge >= 0.0,
+        parent_relax_ge <= p['parent_relax_ge_upper_bound'],
+    ]
 
-    return resid_weights_out, status_text
+    return cvx.Problem(objective, constraints), p, x
 
 
 def np_simul_integerizer_cvx(
@@ -147,7 +349,10 @@ def np_simul_integerizer_cvx(
         parent_lp_right_hand_side,
         hh_constraint_ge_bound,
         parent_resid_weights,
-        total_hh_sub_control_index):
+        total_hh_sub_control_index,
+        total_hh_parent_control_index,
+        hint=None,
+        time_limit=None):
     """
     cvx-based siuml-integerizer function taking numpy data types and conforming to a
     standard function signature that allows it to be swapped interchangeably with alternate
@@ -171,6 +376,11 @@ def np_simul_integerizer_cvx(
     hh_constraint_ge_bound : numpy.ndarray(sub_zone_count, sub_control_count) float
     parent_resid_weights : numpy.ndarray(sample_count,) float
     total_hh_sub_control_index : int
+    total_hh_parent_control_index : int
+    hint : numpy.ndarray(sub_zone_count, sample_count) float
+        optional initial solution (values in range [0..1]) used to warm start solver
+    time_limit : float
+        optional solver time limit in seconds (if supported by solver)
 
     Returns
     -------
@@ -181,108 +391,55 @@ def np_simul_integerizer_cvx(
         STATUS_OPTIMAL, STATUS_FEASIBLE in case of success, or a solver-specific failure status
     """
 
-    import cvxpy as cvx
-
-    STATUS_TEXT = {
-        cvx.OPTIMAL: 'OPTIMAL',
-        cvx.INFEASIBLE: 'INFEASIBLE',
-        cvx.UNBOUNDED: 'UNBOUNDED',
-        cvx.OPTIMAL_INACCURATE: 'FEASIBLE',  # for compatability with ortools
-        cvx.INFEASIBLE_INACCURATE: 'INFEASIBLE_INACCURATE',
-        cvx.UNBOUNDED_INACCURATE: 'UNBOUNDED_INACCURATE',
-        None: 'FAILED'
-    }
-    CVX_MAX_ITERS = 1000
-
     sample_count, sub_control_count = sub_incidence.shape
     _, parent_control_count = parent_incidence.shape
     sub_zone_count, _ = sub_float_weights.shape
 
-    # - Decision variables for optimization
-    x = cvx.Variable(sub_zone_count, sample_count)
-
-    # x range is 0.0 to 1.0 unless resid_weights is zero, in which case constrain x to 0.0
-    x_max = (~(sub_float_weights == sub_int_weights)).astype(float)
-
-    # - Create positive continuous constraint relaxation variables
-    relax_le = cvx.Variable(sub_zone_count, sub_control_count)
-    relax_ge = cvx.Variable(sub_zone_count, sub_control_count)
-
-    parent_relax_le = cvx.Variable(parent_control_count)
-    parent_relax_ge = cvx.Variable(parent_control_count)
-
-    # - Set objective
+    prob, p, x = get_problem(
+        ('simul_integerizer', sub_zone_count, sample_count, sub_control_count, parent_control_count),
+        lambda: build_simul_integerizer_problem(
+            sub_zone_count, sample_count, sub_control_count, parent_control_count))
 
     # can probably ignore as handled by constraint
+    sub_countrol_importance = sub_countrol_importance.copy()
     sub_countrol_importance[total_hh_sub_control_index] = 0
 
-    LOG_OVERFLOW = -725
-    log_resid_weights = np.log(np.maximum(sub_resid_weights, np.exp(LOG_OVERFLOW))).flatten('F')
+    # FIXME total_hh_parent_control_index should not exist???
+    parent_countrol_importance = parent_countrol_importance.copy()
+    if total_hh_parent_control_index > 0:
+        parent_countrol_importance[total_hh_parent_control_index] = 0
+
+    log_resid_weights = np.log(np.maximum(sub_resid_weights, np.exp(LOG_OVERFLOW)))
     assert not np.isnan(log_resid_weights).any()
 
-    log_parent_resid_weights = \
-        np.log(np.maximum(parent_resid_weights, np.exp(LOG_OVERFLOW))).flatten('F')
+    log_parent_resid_weights = np.log(np.maximum(parent_resid_weights, np.exp(LOG_OVERFLOW)))
     assert not np.isnan(log_parent_resid_weights).any()
 
-    # subzone and parent objective and relaxation penalties
-    # note: cvxpy overloads * so * in following is matrix multiplication
-    objective = cvx.Maximize(
-        cvx.sum_entries(cvx.mul_elemwise(log_resid_weights, cvx.vec(x))) +
-        cvx.sum_entries(cvx.mul_elemwise(log_parent_resid_weights, cvx.vec(cvx.sum_entries(x, axis=0)))) -  # nopep8
-        cvx.sum_entries(relax_le * sub_countrol_importance) -
-        cvx.sum_entries(relax_ge * sub_countrol_importance) -
-        cvx.sum_entries(cvx.mul_elemwise(parent_countrol_importance, parent_relax_le)) -
-        cvx.sum_entries(cvx.mul_elemwise(parent_countrol_importance, parent_relax_ge))
-    )
-
-    constraints = [
-        (x * sub_incidence) - relax_le >= 0,
-        (x * sub_incidence) - relax_le <= lp_right_hand_side,
-        (x * sub_incidence) + relax_ge >= lp_right_hand_side,
-        (x * sub_incidence) + relax_ge <= hh_constraint_ge_bound,
-
-        x >= 0.0,
-        x <= x_max,
-
-        relax_le >= 0.0,
-        relax_le <= lp_right_hand_side,
-
-        relax_ge >= 0.0,
-        relax_ge <= relax_ge_upper_bound,
-
-        # - equality constraint for the total households control
-        cvx.sum_entries(x, axis=1) == total_hh_right_hand_side,
-
-        cvx.vec(cvx.sum_entries(x, axis=0) * parent_incidence) - parent_relax_le >= 0,                              # nopep8
-        cvx.vec(cvx.sum_entries(x, axis=0) * parent_incidence) - parent_relax_le <= parent_lp_right_hand_side,      # nopep8
-        cvx.vec(cvx.sum_entries(x, axis=0) * parent_incidence) + parent_relax_ge >= parent_lp_right_hand_side,      # nopep8
-        cvx.vec(cvx.sum_entries(x, axis=0) * parent_incidence) + parent_relax_ge <= parent_hh_constraint_ge_bound,  # nopep8
-
-        parent_relax_le >= 0.0,
-        parent_relax_le <= parent_lp_right_hand_side,
-
-        parent_relax_ge >= 0.0,
-        parent_relax_ge <= parent_relax_ge_upper_bound,
-    ]
-
-    prob = cvx.Problem(objective, constraints)
+    p['sub_incidence'].value = sub_incidence
+    p['parent_incidence'].value = parent_incidence
+    p['log_resid_weights'].value = log_resid_weights
+    p['log_parent_resid_weights'].value = log_parent_resid_weights
+    p['sub_countrol_importance'].value = sub_countrol_importance
+    p['parent_countrol_importance'].value = parent_countrol_importance
+    p['lp_right_hand_side'].value = lp_right_hand_side
+    p['relax_ge_upper_bound'].value = relax_ge_upper_bound
+    p['hh_constraint_ge_bound'].value = hh_constraint_ge_bound
+    p['parent_lp_right_hand_side'].value = parent_lp_right_hand_side
+    p['parent_relax_ge_upper_bound'].value = parent_relax_ge_upper_bound
+    p['parent_hh_constraint_ge_bound'].value = parent_hh_constraint_ge_bound
+    p['total_hh_right_hand_side'].value = total_hh_right_hand_side
+    # x range is 0.0 to 1.0 unless resid_weights is zero, in which case constrain x to 0.0
+    p['x_max'].value = (~(sub_float_weights == sub_int_weights)).astype(float)
 
-    assert CVX_SOLVER in cvx.installed_solvers(), \
-        "CVX Solver '%s' not in installed solvers %s." % (
-        CVX_SOLVER, cvx.installed_solvers())
-    logger.info("simul_integerizing with '%s' solver." % CVX_SOLVER)
+    # - initial solution for solvers that support warm starts
+    x.value = hint
 
-    try:
-        prob.solve(solver=CVX_SOLVER, verbose=True, max_iters=CVX_MAX_ITERS)
-    except cvx.SolverError as e:
-        logging.warning('Solver error in SimulIntegerizer: %s' % e)
+    status = solve(prob, x, time_limit, 'simul_integerizing')
 
-    # if we got a result
-    if np.any(x.value):
-        resid_weights_out = np.asarray(x.value)
+    if status in STATUS_SUCCESS:
+        assert x.value is not None
+        resid_weights_out = np.clip(np.asarray(x.value), 0.0, 1.0)
     else:
         resid_weights_out = sub_resid_weights
 
-    status_text = STATUS_TEXT[prob.status]
-
-    return resid_weights_out, status_text
+    return resid_weights_out, status
@@ -0,0 +1,182 @@
+# PopulationSim
+# See full license in LICENSE.txt.
+
+import itertools
+import logging
+from math import comb
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+STATUS_OPTIMAL = 'OPTIMAL'
+STATUS_INFEASIBLE = 'INFEASIBLE'
+STATUS_NOT_SOLVED = 'NOT_SOLVED'
+
+# default maximum number of candidate solutions to enumerate
+DEFAULT_MAX_ENUMERATIONS = 10000
+
+# maximum candidate solutions times incidence groups (e.g. 10000 groups with a shortfall of 1)
+MAX_ENUMERATION_CELLS = 10 ** 8
+
+
+def incidence_groups(incidence, unfixed, log_resid_weights):
+    """
+    Group unfixed households by incidence signature (households with identical incidence are
+    interchangeable, except for their resid weights, so only the households with the highest
+    resid weights in each group need be considered for rounding up)
+
+    Parameters
+    ----------
+    incidence : numpy.ndarray(control_count, sample_count) float
+    unfixed : numpy.ndarray(sample_count,) bool
+        households whose resid weights can be rounded up
+    log_resid_weights : numpy.ndarray(sample_count,) float
+
+    Returns
+    -------
+    group_incidence : numpy.ndarray(group_count, control_count) float
+        incidence of each group
+    group_members : list of numpy.ndarray(int)
+        sample indexes of each group's households, in descending order of log_resid_weights
+    """
+
+    unfixed_index = np.flatnonzero(unfixed)
+
+    group_incidence, group_ids = np.unique(incidence[:, unfixed_index].T, axis=0, return_inverse=True)
+    group_ids = group_ids.ravel()
+
+    # sort by group, then by descending log_resid_weights within group
+    order = np.lexsort((-log_resid_weights[unfixed_index], group_ids))
+    group_starts = np.searchsorted(group_ids[order], np.arange(len(group_incidence)))
+    group_members = np.split(unfixed_index[order], group_starts[1:])
+
+    return group_incidence, group_members
+
+
+def np_integerizer_enumerate(
+        incidence,
+        resid_weights,
+        log_resid_weights,
+        control_importance_weights,
+        total_hh_control_index,
+        lp_right_hand_side,
+        relax_ge_upper_bound,
+        hh_constraint_ge_bound,
+        hint=None,
+        time_limit=None,
+        max_enumerations=DEFAULT_MAX_ENUMERATIONS):
+    """
+    Exact single-integerizer for problems with a small total households shortfall, conforming
+    to the single integerizer function signature (see lp.get_single_integerizer) so it can be
+    used in place of the LP integerizers.
+
+    Enumerates every way of rounding up total households shortfall (k) resid weights to 1
+    (up to max_enumerations) and returns the one that maximizes the LP objective: sum of
+    log_resid_weights of rounded up households less control_importance_weights times the
+    relaxation of each control. Households with identical incidence are grouped so that
+    only combinations of groups need be enumerated.
+
+    Unlike the LP integerizers, the result is integer (0 or 1) and is the integer optimum
+    rather than an LP optimum that smart_round has to round.
+
+    Parameters
+    ----------
+    incidence : numpy.ndarray(control_count, sample_count) float
+    resid_weights : numpy.ndarray(sample_count,) float
+    log_resid_weights : numpy.ndarray(sample_count,) float
+    control_importance_weights : numpy.ndarray(control_count,) float
+    total_hh_control_index : int
+    lp_right_hand_side : numpy.ndarray(control_count,) float
+    relax_ge_upper_bound : numpy.ndarray(control_count,) float
+    hh_constraint_ge_bound : numpy.ndarray(control_count,) float
+    hint : numpy.ndarray(sample_count,) float
+        ignored (enumeration is exhaustive)
+    time_limit : float
+        ignored (enumeration is bounded by max_enumerations)
+    max_enumerations : int
+        maximum number of candidate solutions to enumerate
+
+    Returns
+    -------
+    resid_weights_out : numpy.ndarray(sample_count,)
+        resid weights rounded to 0 or 1 if solved, otherwise resid_weights unchanged
+    status_text : str
+        STATUS_OPTIMAL if solved, STATUS_INFEASIBLE if there is no feasible integer solution
+        or STATUS_NOT_SOLVED if there were too many candidate solutions to enumerate
+    """
+
+    control_count, sample_count = incidence.shape
+
+    # resid weights constrained to zero can't be rounded up
+    unfixed = resid_weights > 0.0
+    k = int(round(lp_right_hand_side[total_hh_control_index]))
+
+    if k > unfixed.sum():
+        return resid_weights, STATUS_INFEASIBLE
+
+    group_incidence, group_members = incidence_groups(incidence, unfixed, log_resid_weights)
+    group_count = len(group_members)
+
+    enumeration_count = comb(group_count + k - 1, k) if k > 0 else 1
+    if enumeration_count > max_enumerations:
+        logger.debug("np_integerizer_enumerate %s candidates exceeds max_enumerations %s"
+                     % (enumeration_count, max_enumerations))
+        return resid_weights, STATUS_NOT_SOLVED
+
+    # scoring takes memory and time in proportion to candidate_count * (k + control_count),
+    # but keep this pre-lp pass cheap for zones with very many groups
+    if enumeration_count * group_count > MAX_ENUMERATION_CELLS:
+        logger.debug("np_integerizer_enumerate %s candidates of %s groups exceeds MAX_ENUMERATION_CELLS %s"
+                     % (enumeration_count, group_count, MAX_ENUMERATION_CELLS))
+        return resid_weights, STATUS_NOT_SOLVED
+
+    # - candidate solutions: one row per multiset of k groups (in ascending group order)
+    combinations = np.array(list(itertools.combinations_with_replacement(range(group_count), k)),
+                            dtype=int).reshape(enumeration_count, k)
+
+    # log_resid_weights of the nth household rounded up in each group (-inf if too few)
+    group_log_resid_weights = np.full((group_count, max(k, 1)), -np.inf)
+    for g, members in enumerate(group_members):
+        n = min(len(members), k)
+        group_log_resid_weights[g, :n] = log_resid_weights[members[:n]]
+
+    # score candidates one position at a time, gathering from the group vectors, rather than
+    # from a (candidate_count, group_count) matrix of counts
+    objective = np.zeros(enumeration_count)
+    control_values = np.zeros((enumeration_count, control_count))
+    rank = np.zeros(enumeration_count, dtype=int)
+    for i in range(k):
+        group = combinations[:, i]
+        if i > 0:
+            # rank of household within its group (groups are in ascending order)
+            rank = np.where(group == combinations[:, i - 1], rank + 1, 0)
+        objective += group_log_resid_weights[group, rank]
+        control_values += group_incidence[group]
+
+    # - control relaxations implied by weighted incidence of rounded up households
+    controls = np.arange(control_count) != total_hh_control_index
+    relax_le = np.maximum(control_values - lp_right_hand_side, 0)
+    relax_ge = np.maximum(lp_right_hand_side - control_values, 0)
+
+    objective -= (relax_le + relax_ge)[:, controls].dot(control_importance_weights[controls])
+
+    # relaxation variable and inequality constraint bounds
+    feasible = \
+        (relax_le[:, controls] <= lp_right_hand_side[controls]).all(axis=1) & \
+        (relax_ge[:, controls] <= relax_ge_upper_bound[controls]).all(axis=1) & \
+        (control_values[:, controls] <= hh_constraint_ge_bound[controls]).all(axis=1) & \
+        np.isfinite(objective)
+
+    if not feasible.any():
+        return resid_weights, STATUS_INFEASIBLE
+
+    best = np.argmax(np.where(feasible, objective, -np.inf))
+
+    counts = np.bincount(combinations[best], minlength=group_count)
+
+    resid_weights_out = np.zeros(sample_count)
+    for g, members in enumerate(group_members):
+        resid_weights_out[members[:counts[g]]] = 1.0
+
+    return resid_weights_out, STATUS_OPTIMAL
@@ -0,0 +1,501 @@
+# PopulationSim
+# See full license in LICENSE.txt.
+
+import logging
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+STATUS_FEASIBLE = 'FEASIBLE'
+STATUS_INFEASIBLE = 'INFEASIBLE'
+
+# greedy rounding rounds up this fraction (1 / GREEDY_BATCH_DIVISOR) of remaining households per batch
+GREEDY_BATCH_DIVISOR = 10
+
+# maximum number of local search iterations, and of households tried for swapping (in order
+# of removal cost) and swaps made per iteration (scores are recomputed between iterations)
+MAX_REPAIR_ITERATIONS = 100
+REPAIR_CANDIDATES = 32
+REPAIR_SWAPS = 16
+
+# bound violations are penalized this many times more than the most important control
+BOUND_IMPORTANCE_FACTOR = 1000
+
+# ignore local search improvements smaller than this
+MIN_IMPROVEMENT = 1e-9
+
+LOG_OVERFLOW = -725
+
+
+class ControlPenalty(object):
+    """
+    Relaxation penalty of a set of (integerizer LP) controls as a function of control values.
+
+    Mirrors the LP relaxation variables: the penalty is control_importance_weights times the
+    absolute difference between control values and lp_right_hand_side. Values outside the
+    bounds of the LP relaxation variables and inequality constraints (which the LP would
+    find infeasible) are penalized BOUND_IMPORTANCE_FACTOR times more heavily than the
+    most important control.
+
+    The penalty is separable by control and controls have few distinct incidence values, so
+    the change in penalty from adding (or removing) each household is computed by looking up
+    per control and incidence value changes rather than by evaluating penalties for every
+    household.
+    """
+
+    def __init__(self, incidence, lp_right_hand_side, control_importance_weights,
+                 relax_ge_upper_bound, hh_constraint_ge_bound):
+        """
+        Parameters
+        ----------
+        incidence : numpy.ndarray(sample_count, control_count) float
+        lp_right_hand_side : numpy.ndarray(control_count,) float
+        control_importance_weights : numpy.ndarray(control_count,) float
+        relax_ge_upper_bound : numpy.ndarray(control_count,) float
+        hh_constraint_ge_bound : numpy.ndarray(control_count,) float
+        """
+
+        self.incidence = incidence
+        self.lp_right_hand_side = lp_right_hand_side
+        self.control_importance_weights = control_importance_weights
+
+        # relax_le <= lp_right_hand_side, control values <= hh_constraint_ge_bound
+        self.upper_bound = np.minimum(2 * lp_right_hand_side, hh_constraint_ge_bound)
+        # relax_ge <= relax_ge_upper_bound
+        self.lower_bound = lp_right_hand_side - relax_ge_upper_bound
+
+        self.bound_importance = \
+            BOUND_IMPORTANCE_FACTOR * max(np.max(control_importance_weights, initial=0), 1.0)
+
+        # distinct incidence values of each control, and households' codes for their values
+        code_values = []
+        code_controls = []
+        self.codes = np.empty(incidence.shape, dtype=np.int64)
+        for c in range(incidence.shape[1]):
+            values, codes = np.unique(incidence[:, c], return_inverse=True)
+            self.codes[:, c] = codes.ravel() + len(code_values)
+            code_values.extend(values)
+            code_controls.extend([c] * len(values))
+        self.code_values = np.array(code_values, dtype=np.float64)
+        self.code_controls = np.array(code_controls, dtype=np.int64)
+
+    def control_penalties(self, control_values, controls=slice(None)):
+
+        relaxation = np.abs(control_values - self.lp_right_hand_side[controls])
+        bound_violation = np.maximum(control_values - self.upper_bound[controls], 0) + \
+            np.maximum(self.lower_bound[controls] - control_values, 0)
+
+        return relaxation * self.control_importance_weights[controls] + \
+            self.bound_importance * bound_violation
+
+    def penalty(self, control_values):
+
+        return self.control_penalties(control_values).sum()
+
+    def penalty_changes(self, control_values, sign=1, rows=slice(None)):
+        """
+        Change in penalty from adding (sign=1) or removing (sign=-1) each household (or each
+        of rows) to (or from) a solution with control_values
+        """
+
+        control_penalties = self.control_penalties(control_values)
+        changes = \
+            self.control_penalties(control_values[self.code_controls] + sign * self.code_values,
+                                   self.code_controls) - control_penalties[self.code_controls]
+
+        return np.take(changes, self.codes[rows]).sum(axis=1)
+
+    def share_deviations(self, average_values):
+        """
+        Importance weighted distance between each household's incidence and average_values
+        """
+
+        deviations = self.control_importance_weights[self.code_controls] * \
+            np.abs(self.code_values - average_values[self.code_controls])
+
+        return np.take(deviations, self.codes).sum(axis=1)
+
+    def bound_violation(self, control_values):
+
+        return (np.maximum(control_values - self.upper_bound, 0) +
+                np.maximum(self.lower_bound - control_values, 0)).sum()
+
+    def relaxed(self, control_values):
+        """
+        bool mask of controls whose values are relaxed (differ from lp_right_hand_side)
+        """
+
+        return np.abs(control_values - self.lp_right_hand_side) > 0.5
+
+
+def control_fit(control_values, lp_right_hand_side, control_importance_weights):
+    """
+    Control fit diagnostics of integerized control values
+
+    Returns
+    -------
+    fit : dict
+        relaxed_controls - number of controls with values different from lp_right_hand_side
+        relaxation - total absolute difference between control values and lp_right_hand_side
+        weighted_relaxation - relaxation weighted by control_importance_weights
+    """
+
+    relaxation = np.abs(control_values - lp_right_hand_side)
+
+    return {
+        'relaxed_controls': int((relaxation > 0.5).sum()),
+        'relaxation': float(relaxation.sum()),
+        'weighted_relaxation': float((relaxation * control_importance_weights).sum()),
+    }
+
+
+def greedy_batch(log_resid_weights, available, selected, batch_size, penalties, control_values,
+                 target_fractions):
+    """
+    Round up a batch of batch_size available households (not yet rounded up), choosing those
+    with the largest log_resid_weights less importance weighted distance from the average
+    incidence the batch needs to bring control values to their target fractions of
+    lp_right_hand_side (so that households are chosen in proportion to control shortfalls,
+    rather than those that most reduce shortfalls first).
+
+    The batch is cut short before it would exceed control upper bounds (but rounds up at
+    least one household).
+
+    Parameters
+    ----------
+    log_resid_weights : numpy.ndarray(sample_count,)
+    available : numpy.ndarray(sample_count,) bool
+        households that can be rounded up (updated in place)
+    selected : numpy.ndarray(sample_count,) bool
+        households rounded up (updated in place)
+    batch_size : int
+        number of households to round up
+    penalties : list of ControlPenalty
+    control_values : list of numpy.ndarray(control_count,)
+        current control values for each of penalties (updated in place)
+    target_fractions : list of float
+        fraction of lp_right_hand_side control values should reach after the batch
+
+    Returns
+    -------
+    batch_size : int
+        number of households rounded up
+    """
+
+    score = log_resid_weights.copy()
+    for penalty, values, fraction in zip(penalties, control_values, target_fractions):
+        score -= penalty.share_deviations((fraction * penalty.lp_right_hand_side - values) / batch_size)
+    score[~available] = -np.inf
+
+    if batch_size == 1:
+        batch = [np.argmax(score)]
+    else:
+        batch = np.argpartition(-score, batch_size - 1)[:batch_size]
+        batch = batch[np.argsort(-score[batch], kind='stable')]
+
+        within_bounds = np.ones(batch_size, dtype=bool)
+        for penalty, values in zip(penalties, control_values):
+            batch_values = values + np.cumsum(penalty.incidence[batch], axis=0)
+            within_bounds &= (batch_values <= np.maximum(penalty.upper_bound, values)).all(axis=1)
+        if not within_bounds.all():
+            batch = batch[:max(np.argmin(within_bounds), 1)]
+
+    available[batch] = False
+    selected[batch] = True
+    for penalty, values in zip(penalties, control_values):
+        values += penalty.incidence[batch].sum(axis=0)
+
+    return len(batch)
+
+
+def repair(log_resid_weights, available, selected, penalties, control_values, deadline):
+    """
+    Local search repair of relaxed controls by swapping rounded up households for ones that
+    are not.
+
+    Each iteration tries (up to REPAIR_CANDIDATES) rounded up households in order of removal
+    cost, out of those whose removal would reduce relaxation (contributing to controls that
+    are over their targets or not contributing to controls that are under), swapping each for
+    the available household that most improves the objective, until REPAIR_SWAPS swaps are
+    made. Repair stops when no swap improves the objective, MAX_REPAIR_ITERATIONS is reached
+    or time runs out.
+
+    Parameters
+    ----------
+    log_resid_weights : numpy.ndarray(sample_count,)
+    available : numpy.ndarray(sample_count,) bool
+        households that can be rounded up (updated in place)
+    selected : numpy.ndarray(sample_count,) bool
+        households rounded up (updated in place)
+    penalties : list of ControlPenalty
+    control_values : list of numpy.ndarray(control_count,)
+        current control values for each of penalties (updated in place)
+    deadline : float or None
+        time.perf_counter() deadline
+
+    Returns
+    -------
+    swap_count : int
+    """
+
+    swap_count = 0
+    for _ in range(MAX_REPAIR_ITERATIONS):
+
+        # households whose removal would reduce relaxation of some relaxed control
+        candidates = np.zeros(len(selected), dtype=bool)
+        for penalty, values in zip(penalties, control_values):
+            over = values > penalty.lp_right_hand_side + 0.5
+            under = values < penalty.lp_right_hand_side - 0.5
+            candidates |= (penalty.incidence[:, over] > 0).any(axis=1)
+            candidates |= (penalty.incidence[:, under] == 0).any(axis=1)
+        candidates = np.flatnonzero(candidates & selected)
+        if len(candidates) == 0:
+            break
+
+        # try candidates in order of objective change from removing them
+        removal_delta = -log_resid_weights[candidates]
+        for penalty, values in zip(penalties, control_values):
+            removal_delta -= penalty.penalty_changes(values, sign=-1, rows=candidates)
+        candidates = candidates[np.argsort(-removal_delta, kind='stable')[:REPAIR_CANDIDATES]]
+
+        swaps = 0
+        for hh in candidates:
+
+            if swaps == REPAIR_SWAPS:
+                break
+
+            if deadline is not None and time.perf_counter() > deadline:
+                return swap_count
+
+            delta = -log_resid_weights[hh]
+            score = log_resid_weights.copy()
+            for penalty, values in zip(penalties, control_values):
+                values_without = values - penalty.incidence[hh]
+                delta += penalty.penalty(values) - penalty.penalty(values_without)
+                score -= penalty.penalty_changes(values_without)
+            score[~available] = -np.inf
+
+            swap = np.argmax(score)
+            if delta + score[swap] > MIN_IMPROVEMENT:
+                selected[hh], available[hh] = False, True
+                selected[swap], available[swap] = True, False
+                for penalty, values in zip(penalties, control_values):
+                    values += penalty.incidence[swap] - penalty.incidence[hh]
+                swaps += 1
+
+        swap_count += swaps
+        if swaps == 0:
+            break
+
+    return swap_count
+
+
+def np_integerizer_heuristic(
+        incidence,
+        resid_weights,
+        log_resid_weights,
+        control_importance_weights,
+        total_hh_control_index,
+        lp_right_hand_side,
+        relax_ge_upper_bound,
+        hh_constraint_ge_bound,
+        hint=None,
+        time_limit=None):
+    """
+    Heuristic (LP-free) single-integerizer conforming to the single integerizer function
+    signature (see lp.get_single_integerizer), for draft runs and very large zones.
+
+    Greedily rounds up total households shortfall resid weights in batches (see greedy_batch),
+    ordered by log_resid_weights and fit to control shortfalls, then repairs relaxed controls
+    by local search (see repair).
+
+    Solutions are integer, but not necessarily optimal, so status is STATUS_FEASIBLE.
+
+    Parameters
+    ----------
+    incidence : numpy.ndarray(control_count, sample_count) float
+    resid_weights : numpy.ndarray(sample_count,) float
+    log_resid_weights : numpy.ndarray(sample_count,) float
+    control_importance_weights : numpy.ndarray(control_count,) float
+    total_hh_control_index : int
+    lp_right_hand_side : numpy.ndarray(control_count,) float
+    relax_ge_upper_bound : numpy.ndarray(control_count,) float
+    hh_constraint_ge_bound : numpy.ndarray(control_count,) float
+    hint : numpy.ndarray(sample_count,) float
+        ignored (greedy rounding constructs its own initial solution)
+    time_limit : float
+        optional time limit in seconds for local search
+
+    Returns
+    -------
+    resid_weights_out : numpy.ndarray(sample_count,)
+        resid weights rounded to 0 or 1, or, in case of failure, resid_weights unchanged
+    status_text : str
+        STATUS_FEASIBLE or STATUS_INFEASIBLE
+    """
+
+    deadline = None if time_limit is None else time.perf_counter() + time_limit
+
+    control_count, sample_count = incidence.shape
+    controls = np.arange(control_count) != total_hh_control_index
+
+    available = resid_weights > 0.0
+    k = int(round(lp_right_hand_side[total_hh_control_index]))
+
+    if k > available.sum():
+        return resid_weights, STATUS_INFEASIBLE
+
+    penalty = ControlPenalty(incidence[controls].T, lp_right_hand_side[controls],
+                             control_importance_weights[controls],
+                             relax_ge_upper_bound[controls], hh_constraint_ge_bound[controls])
+    control_values = [np.zeros(controls.sum())]
+
+    selected = np.zeros(sample_count, dtype=bool)
+
+    # - greedy rounding, in batches of a fraction of the households left to round up
+    rounded_up = 0
+    while rounded_up < k:
+        batch_size = max((k - rounded_up) // GREEDY_BATCH_DIVISOR, 1)
+        rounded_up += greedy_batch(log_resid_weights, available, selected, batch_size, [penalty],
+                                   control_values, [(rounded_up + batch_size) / k])
+
+    swap_count = repair(log_resid_weights, available, selected, [penalty], control_values, deadline)
+
+    fit = control_fit(control_values[0], penalty.lp_right_hand_side, penalty.control_importance_weights)
+    logger.debug("np_integerizer_heuristic: %s swaps, %s relaxed controls, relaxation %s" %
+                 (swap_count, fit['relaxed_controls'], fit['relaxation']))
+
+    if penalty.bound_violation(control_values[0]) > 0:
+        return resid_weights, STATUS_INFEASIBLE
+
+    return selected.astype(np.float64), STATUS_FEASIBLE
+
+
+def np_simul_integerizer_heuristic(
+        sub_int_weights,
+        parent_countrol_importance,
+        parent_relax_ge_upper_bound,
+        sub_countrol_importance,
+        sub_float_weights,
+        sub_resid_weights,
+        lp_right_hand_side,
+        parent_hh_constraint_ge_bound,
+        sub_incidence,
+        parent_incidence,
+        total_hh_right_hand_side,
+        relax_ge_upper_bound,
+        parent_lp_right_hand_side,
+        hh_constraint_ge_bound,
+        parent_resid_weights,
+        total_hh_sub_control_index,
+        total_hh_parent_control_index,
+        hint=None,
+        time_limit=None):
+    """
+    Heuristic (LP-free) simul-integerizer conforming to the simul-integerizer function
+    signature (see lp.get_simul_integerizer).
+
+    Greedily rounds up each sub zone's total households shortfall resid weights in batches
+    (taking turns, zone with most households left to round up first) ordered by log resid
+    weights and fit to sub zone and parent control shortfalls, then repairs relaxed controls
+    by local search within each sub zone.
+
+    Parameters
+    ----------
+    sub_int_weights : numpy.ndarray(sub_zone_count, sample_count) int
+    parent_countrol_importance : numpy.ndarray(parent_control_count,) float
+    parent_relax_ge_upper_bound : numpy.ndarray(parent_control_count,) float
+    sub_countrol_importance : numpy.ndarray(sub_control_count,) float
+    sub_float_weights : numpy.ndarray(sub_zone_count, sample_count) float
+    sub_resid_weights : numpy.ndarray(sub_zone_count, sample_count) float
+    lp_right_hand_side : numpy.ndarray(sub_zone_count, sub_control_count) float
+    parent_hh_constraint_ge_bound : numpy.ndarray(parent_control_count,) float
+    sub_incidence : numpy.ndarray(sample_count, sub_control_count) float
+    parent_incidence : numpy.ndarray(sample_count, parent_control_count) float
+    total_hh_right_hand_side : numpy.ndarray(sub_zone_count,) float
+    relax_ge_upper_bound : numpy.ndarray(sub_zone_count, sub_control_count) float
+    parent_lp_right_hand_side : numpy.ndarray(parent_control_count,) float
+    hh_constraint_ge_bound : numpy.ndarray(sub_zone_count, sub_control_count) float
+    parent_resid_weights : numpy.ndarray(sample_count,) float
+    total_hh_sub_control_index : int
+    total_hh_parent_control_index : int
+    hint : numpy.ndarray(sub_zone_count, sample_count) float
+        ignored (greedy rounding constructs its own initial solution)
+    time_limit : float
+        optional time limit in seconds for local search
+
+    Returns
+    -------
+    resid_weights_out : numpy.ndarray(sub_zone_count, sample_count)
+        resid weights rounded to 0 or 1, or, in case of failure, sub_resid_weights unchanged
+    status_text : str
+        STATUS_FEASIBLE or STATUS_INFEASIBLE
+    """
+
+    deadline = None if time_limit is None else time.perf_counter() + time_limit
+
+    sample_count, sub_control_count = sub_incidence.shape
+    _, parent_control_count = parent_incidence.shape
+    sub_zone_count, _ = sub_float_weights.shape
+
+    sub_controls = np.arange(sub_control_count) != total_hh_sub_control_index
+    parent_controls = np.arange(parent_control_count) != total_hh_parent_control_index
+
+    # resid weights constrained to zero can't be rounded up
+    available = sub_float_weights != sub_int_weights
+    k = np.round(total_hh_right_hand_side).astype(int)
+
+    if (k > available.sum(axis=1)).any():
+        return sub_resid_weights, STATUS_INFEASIBLE
+
+    log_resid_weights = \
+        np.log(np.maximum(sub_resid_weights, np.exp(LOG_OVERFLOW))) + \
+        np.log(np.maximum(parent_resid_weights, np.exp(LOG_OVERFLOW)))
+
+    parent_penalty = ControlPenalty(
+        parent_incidence[:, parent_controls],
+        parent_lp_right_hand_side[parent_controls], parent_countrol_importance[parent_controls],
+        parent_relax_ge_upper_bound[parent_controls], parent_hh_constraint_ge_bound[parent_controls])
+    parent_values = np.zeros(parent_controls.sum())
+
+    sub_penalties = [
+        ControlPenalty(sub_incidence[:, sub_controls],
+                       lp_right_hand_side[z, sub_controls], sub_countrol_importance[sub_controls],
+                       relax_ge_upper_bound[z, sub_controls], hh_constraint_ge_bound[z, sub_controls])
+        for z in range(sub_zone_count)]
+    sub_values = [np.zeros(sub_controls.sum()) for z in range(sub_zone_count)]
+
+    selected = np.zeros((sub_zone_count, sample_count), dtype=bool)
+
+    # - greedy rounding, taking turns (zone with most households left to round up first)
+    # so zones share the parent control shortfall
+    rounded_up = np.zeros(sub_zone_count, dtype=int)
+    while (rounded_up < k).any():
+        z = np.argmax(k - rounded_up)
+        batch_size = max((k[z] - rounded_up[z]) // GREEDY_BATCH_DIVISOR, 1)
+        target_fractions = [(rounded_up[z] + batch_size) / k[z],
+                            (rounded_up.sum() + batch_size) / k.sum()]
+        rounded_up[z] += greedy_batch(log_resid_weights[z], available[z], selected[z], batch_size,
+                                      [sub_penalties[z], parent_penalty], [sub_values[z], parent_values],
+                                      target_fractions)
+
+    # - local search repair within each zone
+    swap_count = 0
+    for z in range(sub_zone_count):
+        swap_count += repair(log_resid_weights[z], available[z], selected[z],
+                             [sub_penalties[z], parent_penalty], [sub_values[z], parent_values],
+                             deadline)
+
+    fit = control_fit(np.concatenate(sub_values + [parent_values]),
+                      np.concatenate([p.lp_right_hand_side for p in sub_penalties + [parent_penalty]]),
+                      np.concatenate([p.control_importance_weights for p in sub_penalties + [parent_penalty]]))
+    logger.debug("np_simul_integerizer_heuristic: %s swaps, %s relaxed controls, relaxation %s" %
+                 (swap_count, fit['relaxed_controls'], fit['relaxation']))
+
+    if parent_penalty.bound_violation(parent_values) > 0 or \
+            any(p.bound_violation(v) > 0 for p, v in zip(sub_penalties, sub_values)):
+        return sub_resid_weights, STATUS_INFEASIBLE
+
+    return selected.astype(np.float64), STATUS_FEASIBLE
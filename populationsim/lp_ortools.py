@@ -8,10 +8,181 @@ import os
 
 import numpy as np
 
+from activitysim.core.config import setting
+
 STATUS_OPTIMAL = 'OPTIMAL'
 STATUS_FEASIBLE = 'FEASIBLE'
 STATUS_SUCCESS = [STATUS_OPTIMAL, STATUS_FEASIBLE]
 
+# default solver time limit if none is specified
+CBC_TIMEOUT_IN_SECONDS = 60
+
+# number of single-integerizer model templates to keep for reuse (0 to always rebuild)
+DEFAULT_INTEGERIZER_MODEL_CACHE_SIZE = 8
+
+
+class IntegerizerModel(object):
+    """
+    ortools single-integerizer model template for a given incidence matrix.
+
+    Building the model (variables, constraint coefficients) is proportional to the size of the
+    incidence matrix and usually costs more than solving it. Zones integerized against the same
+    incidence (e.g. all low zones of a seed zone in repop_balancing) differ only in variable
+    bounds, constraint bounds and objective coefficients, so these are updated in place before
+    each solve instead of rebuilding the model.
+    """
+
+    def __init__(self, incidence, total_hh_control_index):
+
+        from ortools.linear_solver import pywraplp
+
+        self.STATUS_TEXT = {
+            pywraplp.Solver.OPTIMAL: STATUS_OPTIMAL,
+            pywraplp.Solver.FEASIBLE: STATUS_FEASIBLE,
+            pywraplp.Solver.INFEASIBLE: 'INFEASIBLE',
+            pywraplp.Solver.UNBOUNDED: 'UNBOUNDED',
+            pywraplp.Solver.ABNORMAL: 'ABNORMAL',
+            pywraplp.Solver.NOT_SOLVED: 'NOT_SOLVED',
+        }
+
+        self.incidence = incidence.copy()
+        self.total_hh_control_index = total_hh_control_index
+
+        control_count, sample_count = incidence.shape
+
+        # - Instantiate a mixed-integer solver
+        solver = pywraplp.Solver('IntegerizeCbc', pywraplp.Solver.CBC_MIXED_INTEGER_PROGRAMMING)
+
+        # - Create binary integer variables (bounds are set by solve)
+        self.x = [solver.NumVar(0.0, 1.0, 'x_' + str(hh)) for hh in range(sample_count)]
+
+        # - Create positive continuous constraint relaxation variables
+        self.relax_le = {}
+        self.relax_ge = {}
+        for c in range(0, control_count):
+            # no relaxation for total households control
+            if c != total_hh_control_index:
+                self.relax_le[c] = solver.NumVar(0.0, 0.0, 'relax_le_' + str(c))
+                self.relax_ge[c] = solver.NumVar(0.0, 0.0, 'relax_ge_' + str(c))
+
+        # - inequality constraints (bounds are set by solve)
+        self.hh_constraint_le = {}
+        self.hh_constraint_ge = {}
+        for c in range(0, control_count):
+            # don't add inequality constraints for total households control
+            if c == total_hh_control_index:
+                continue
+            # add the lower bound relaxation inequality constraint
+            self.hh_constraint_le[c] = solver.Constraint(0, 0)
+            for hh in range(0, sample_count):
+                self.hh_constraint_le[c].SetCoefficient(self.x[hh], incidence[c, hh])
+            self.hh_constraint_le[c].SetCoefficient(self.relax_le[c], -1.0)
+
+            # add the upper bound relaxation inequality constraint
+            self.hh_constraint_ge[c] = solver.Constraint(0, 0)
+            for hh in range(0, sample_count):
+                self.hh_constraint_ge[c].SetCoefficient(self.x[hh], incidence[c, hh])
+            self.hh_constraint_ge[c].SetCoefficient(self.relax_ge[c], 1.0)
+
+        # - equality constraint for the total households control
+        self.constraint_eq = solver.Constraint(0, 0)
+        for hh in range(0, sample_count):
+            self.constraint_eq.SetCoefficient(self.x[hh], 1.0)
+
+        solver.Objective().SetMaximization()
+
+        solver.EnableOutput()
+
+        self.solver = solver
+
+    def matches(self, incidence, total_hh_control_index):
+
+        return total_hh_control_index == self.total_hh_control_index \
+            and incidence.shape == self.incidence.shape \
+            and np.array_equal(incidence, self.incidence)
+
+    def solve(self,
+              resid_weights,
+              log_resid_weights,
+              control_importance_weights,
+              lp_right_hand_side,
+              relax_ge_upper_bound,
+              hh_constraint_ge_bound,
+              hint=None,
+              time_limit=None):
+
+        x = self.x
+
+        # - variable bounds
+        # max_x == 0.0 if float_weights is an int, otherwise 1.0
+        max_x = 1.0 - (resid_weights == 0.0)
+        for hh in range(len(x)):
+            x[hh].SetUb(max_x[hh])
+        for c in self.relax_le:
+            self.relax_le[c].SetUb(lp_right_hand_side[c])
+            self.relax_ge[c].SetUb(relax_ge_upper_bound[c])
+
+        # - Set objective function coefficients
+        # use positive for objective and negative for relaxation penalties since solver is maximizing
+        objective = self.solver.Objective()
+        for hh in range(len(x)):
+            objective.SetCoefficient(x[hh], log_resid_weights[hh])
+        for c in self.relax_le:
+            objective.SetCoefficient(self.relax_le[c], -control_importance_weights[c])
+            objective.SetCoefficient(self.relax_ge[c], -control_importance_weights[c])
+
+        # - constraint bounds
+        for c in self.hh_constraint_le:
+            self.hh_constraint_le[c].SetBounds(0, lp_right_hand_side[c])
+            self.hh_constraint_ge[c].SetBounds(lp_right_hand_side[c], hh_constraint_ge_bound[c])
+
+        total_hh_constraint = lp_right_hand_side[self.total_hh_control_index]
+        self.constraint_eq.SetBounds(total_hh_constraint, total_hh_constraint)
+
+        # - initial solution hint (clear any hint from previous solve)
+        if hint is not None:
+            self.solver.SetHint(x, hint.tolist())
+        else:
+            self.solver.SetHint([], [])
+
+        self.solver.set_time_limit(int((time_limit or CBC_TIMEOUT_IN_SECONDS) * 1000))
+
+        result_status = self.solver.Solve()
+
+        status_text = self.STATUS_TEXT[result_status]
+
+        if status_text in STATUS_SUCCESS:
+            resid_weights_out = np.asanyarray([x.solution_value() for x in x]).astype(np.float64)
+        else:
+            resid_weights_out = resid_weights
+
+        return resid_weights_out, status_text
+
+
+# most recently used integerizer model templates (most recent last)
+_INTEGERIZER_MODELS = []
+
+
+def get_integerizer_model(incidence, total_hh_control_index, cache_size):
+    """
+    Return IntegerizerModel for incidence, reusing a cached template if one was built
+    for an identical incidence matrix, and caching it (up to cache_size templates) otherwise.
+    """
+
+    for model in _INTEGERIZER_MODELS:
+        if model.matches(incidence, total_hh_control_index):
+            _INTEGERIZER_MODELS.remove(model)
+            _INTEGERIZER_MODELS.append(model)
+            return model
+
+    model = IntegerizerModel(incidence, total_hh_control_index)
+
+    if cache_size > 0:
+        _INTEGERIZER_MODELS.append(model)
+        del _INTEGERIZER_MODELS[:-cache_size]
+
+    return model
+
 
 def np_integerizer_ortools(
         incidence,
@@ -21,12 +192,16 @@ def np_integerizer_ortools(
         total_hh_control_index,
         lp_right_hand_side,
         relax_ge_upper_bound,
-        hh_constraint_ge_bound):
+        hh_constraint_ge_bound,
+        hint=None,
+        time_limit=None):
     """
     ortools single-integerizer function taking numpy data types and conforming to a
     standard function signature that allows it to be swapped interchangeably with alternate
     LP implementations.
 
+    Models are built from (and cached by) incidence, so repeat calls with the same incidence
+    only update bounds and objective coefficients before re-solving.
 
     Parameters
     ----------
@@ -38,6 +213,11 @@ def np_integerizer_ortools(
     lp_right_hand_side : numpy.ndarray(control_count,) float
     relax_ge_upper_bound : numpy.ndarray(control_count,) float
     hh_constraint_ge_bound : numpy.ndarray(control_count,) float
+    hint : numpy.ndarray(sample_count,) float
+        optional initial solution (values in range [0..1]) passed to solver as a hint
+        (CBC only uses hints when branching, so they have no effect on these continuous lps)
+    time_limit : float
+        optional solver time limit in seconds (default CBC_TIMEOUT_IN_SECONDS)
 
     Returns
     -------
@@ -45,110 +225,19 @@ def np_integerizer_ortools(
     status_text : str
     """
 
-    from ortools.linear_solver import pywraplp
-
-    STATUS_TEXT = {
-        pywraplp.Solver.OPTIMAL: 'OPTIMAL',
-        pywraplp.Solver.FEASIBLE: 'FEASIBLE',
-        pywraplp.Solver.INFEASIBLE: 'INFEASIBLE',
-        pywraplp.Solver.UNBOUNDED: 'UNBOUNDED',
-        pywraplp.Solver.ABNORMAL: 'ABNORMAL',
-        pywraplp.Solver.NOT_SOLVED: 'NOT_SOLVED',
-    }
-    CBC_TIMEOUT_IN_SECONDS = 60
-
-    control_count, sample_count = incidence.shape
-
-    # - Instantiate a mixed-integer solver
-    solver = pywraplp.Solver('IntegerizeCbc', pywraplp.Solver.CBC_MIXED_INTEGER_PROGRAMMING)
-
-    # - Create binary integer variables
-    x = [[]] * sample_count
-    for hh in range(0, sample_count):
-        # max_x == 0.0 if float_weights is an int, otherwise 1.0
-        max_x = 1.0 - (resid_weights[hh] == 0.0)
-        x[hh] = solver.NumVar(0.0, max_x, 'x_' + str(hh))
-
-    # - Create positive continuous constraint relaxation variables
-    relax_le = [[]] * control_count
-    relax_ge = [[]] * control_count
-    for c in range(0, control_count):
-        # no relaxation for total households control
-        if c != total_hh_control_index:
-            relax_le[c] = solver.NumVar(0.0, lp_right_hand_side[c], 'relax_le_' + str(c))
-            relax_ge[c] = solver.NumVar(0.0, relax_ge_upper_bound[c], 'relax_ge_' + str(c))
-
-    # - Set objective function coefficients
-    # use negative for objective and positive for relaxation penalties since solver is minimizing
-    # objective = solver.Objective()
-    # for hh in range(sample_count):
-    #     objective.SetCoefficient(x[hh], -1.0 * log_resid_weights[hh])
-    # for c in range(control_count):
-    #     if c != total_hh_control_index:
-    #         objective.SetCoefficient(relax_le[c], control_importance_weights[c])
-    #         objective.SetCoefficient(relax_ge[c], control_importance_weights[c])
-
-    z = solver.Sum(x[hh] * log_resid_weights[hh]
-                   for hh in range(sample_count)) - \
-        solver.Sum(relax_le[c] * control_importance_weights[c]
-                   for c in range(control_count) if c != total_hh_control_index) - \
-        solver.Sum(relax_ge[c] * control_importance_weights[c]
-                   for c in range(control_count) if c != total_hh_control_index)
+    cache_size = setting('INTEGERIZER_MODEL_CACHE_SIZE', DEFAULT_INTEGERIZER_MODEL_CACHE_SIZE)
 
-    objective = solver.Maximize(z)
+    model = get_integerizer_model(incidence, total_hh_control_index, cache_size)
 
-    # - inequality constraints
-    hh_constraint_ge = [[]] * control_count
-    hh_constraint_le = [[]] * control_count
-    for c in range(0, control_count):
-        # don't add inequality constraints for total households control
-        if c == total_hh_control_index:
-            continue
-        # add the lower bound relaxation inequality constraint
-        hh_constraint_le[c] = solver.Constraint(0, lp_right_hand_side[c])
-        for hh in range(0, sample_count):
-            hh_constraint_le[c].SetCoefficient(x[hh], incidence[c, hh])
-            hh_constraint_le[c].SetCoefficient(relax_le[c], -1.0)
-
-        # add the upper bound relaxation inequality constraint
-        hh_constraint_ge[c] = solver.Constraint(lp_right_hand_side[c], hh_constraint_ge_bound[c])
-        for hh in range(0, sample_count):
-            hh_constraint_ge[c].SetCoefficient(x[hh], incidence[c, hh])
-            hh_constraint_ge[c].SetCoefficient(relax_ge[c], 1.0)
-
-    # using Add and Sum is easier to read but a lot slower
-    # for c in range(control_count):
-    #     if c == total_hh_control_index:
-    #         continue
-    #     solver.Add(solver.Sum(x[hh]*incidence[c, hh] for hh in range(sample_count)) - relax_le[c]
-    #                >= 0)
-    #     solver.Add(solver.Sum(x[hh]*incidence[c, hh] for hh in range(sample_count)) - relax_le[c]
-    #                <= lp_right_hand_side[c])
-    #     solver.Add(solver.Sum(x[hh]*incidence[c, hh] for hh in range(sample_count)) + relax_ge[c]
-    #                >= lp_right_hand_side[c])
-    #     solver.Add(solver.Sum(x[hh]*incidence[c, hh] for hh in range(sample_count)) + relax_ge[c]
-    #                <= hh_constraint_ge_bound[c])
-
-    # - equality constraint for the total households control
-    total_hh_constraint = lp_right_hand_side[total_hh_control_index]
-    constraint_eq = solver.Constraint(total_hh_constraint, total_hh_constraint)
-    for hh in range(0, sample_count):
-        constraint_eq.SetCoefficient(x[hh], 1.0)
-
-    solver.set_time_limit(CBC_TIMEOUT_IN_SECONDS * 1000)
-
-    solver.EnableOutput()
-
-    result_status = solver.Solve()
-
-    status_text = STATUS_TEXT[result_status]
-
-    if status_text in STATUS_SUCCESS:
-        resid_weights_out = np.asanyarray([x.solution_value() for x in x]).astype(np.float64)
-    else:
-        resid_weights_out = resid_weights
-
-    return resid_weights_out, status_text
+    return model.solve(
+        resid_weights=resid_weights,
+        log_resid_weights=log_resid_weights,
+        control_importance_weights=control_importance_weights,
+        lp_right_hand_side=lp_right_hand_side,
+        relax_ge_upper_bound=relax_ge_upper_bound,
+        hh_constraint_ge_bound=hh_constraint_ge_bound,
+        hint=hint,
+        time_limit=time_limit)
 
 
 def np_simul_integerizer_ortools(
@@ -168,7 +257,9 @@ def np_simul_integerizer_ortools(
         hh_constraint_ge_bound,
         parent_resid_weights,
         total_hh_sub_control_index,
-        total_hh_parent_control_index):
+        total_hh_parent_control_index,
+        hint=None,
+        time_limit=None):
 
     """
     ortools-based siuml-integerizer function taking numpy data types and conforming to a
@@ -194,6 +285,11 @@ def np_simul_integerizer_ortools(
     parent_resid_weights : numpy.ndarray(sample_count,) float
     total_hh_sub_control_index : int
     total_hh_parent_control_index : int
+    hint : numpy.ndarray(sub_zone_count, sample_count) float
+        optional initial solution (values in range [0..1]) passed to solver as a hint
+        (CBC only uses hints when branching, so they have no effect on these continuous lps)
+    time_limit : float
+        optional solver time limit in seconds (default CBC_TIMEOUT_IN_SECONDS)
 
     Returns
     -------
@@ -214,7 +310,6 @@ def np_simul_integerizer_ortools(
         pywraplp.Solver.ABNORMAL: 'ABNORMAL',
         pywraplp.Solver.NOT_SOLVED: 'NOT_SOLVED',
     }
-    CBC_TIMEOUT_IN_SECONDS = 60
 
     sample_count, sub_control_count = sub_incidence.shape
     _, parent_control_count = parent_incidence.shape
@@ -233,7 +328,7 @@ def np_simul_integerizer_ortools(
     # - Instantiate a mixed-integer solver
     solver = pywraplp.Solver('SimulIntegerizeCbc', pywraplp.Solver.CBC_MIXED_INTEGER_PROGRAMMING)
     solver.EnableOutput()
-    solver.set_time_limit(CBC_TIMEOUT_IN_SECONDS * 1000)
+    solver.set_time_limit(int((time_limit or CBC_TIMEOUT_IN_SECONDS) * 1000))
 
     # constraints = [
     #     x >= 0.0,
@@ -387,6 +482,11 @@ def np_simul_integerizer_ortools(
                 parent_constraint_ge[c].SetCoefficient(x[z, hh], parent_incidence[hh, c])
                 parent_constraint_ge[c].SetCoefficient(parent_relax_ge[c], 1.0)
 
+    # - initial solution hint
+    if hint is not None:
+        solver.SetHint([x[z, hh] for z in range(sub_zone_count) for hh in range(sample_count)],
+                       hint.flatten().tolist())
+
     result_status = solver.Solve()
 
     status_text = STATUS_TEXT[result_status]
@@ -13,10 +13,14 @@ import pandas as pd
 
 from activitysim.core.config import setting
 
+from .performance import set_status
 from .lp import get_simul_integerizer
+from .lp import get_solver_time_budget
 from .lp import STATUS_SUCCESS
 
 from .integerizer import smart_round
+from .integerizer import resid_weights_hint
+from .integerizer import use_integerizer_hints
 from .integerizer import do_integerizing
 
 logger = logging.getLogger(__name__)
@@ -68,7 +72,15 @@ class SimulIntegerizer(object):
 
         self.trace_label = trace_label
 
-    def integerize(self):
+    def lp_inputs(self):
+        """
+        Build the arguments for the simul-integerizer function (see lp.get_simul_integerizer)
+
+        Returns
+        -------
+        lp_inputs : dict
+            simul-integerizer function arguments keyed by argument name
+        """
 
         # - subzone
 
@@ -89,7 +101,6 @@ class SimulIntegerizer(object):
         # print "sub_int_weights\n", sub_int_weights
         # print "sub_resid_weights\n", sub_resid_weights
 
-        sub_control_totals = np.asanyarray(self.sub_controls_df).astype(np.int)
         sub_countrol_importance = np.asanyarray(self.sub_countrol_importance).astype(np.float64)
 
         relaxed_sub_control_totals = np.dot(sub_float_weights, sub_incidence)
@@ -154,26 +165,70 @@ class SimulIntegerizer(object):
             print("\n")
             # assert (parent_hh_constraint_ge_bound == parent_max_possible_control_values).all()
 
+        return {
+            'sub_int_weights': sub_int_weights,
+            'parent_countrol_importance': parent_countrol_importance,
+            'parent_relax_ge_upper_bound': parent_relax_ge_upper_bound,
+            'sub_countrol_importance': sub_countrol_importance,
+            'sub_float_weights': sub_float_weights,
+            'sub_resid_weights': sub_resid_weights,
+            'lp_right_hand_side': lp_right_hand_side,
+            'parent_hh_constraint_ge_bound': parent_hh_constraint_ge_bound,
+            'sub_incidence': sub_incidence,
+            'parent_incidence': parent_incidence,
+            'total_hh_right_hand_side': total_hh_right_hand_side,
+            'relax_ge_upper_bound': relax_ge_upper_bound,
+            'parent_lp_right_hand_side': parent_lp_right_hand_side,
+            'hh_constraint_ge_bound': hh_constraint_ge_bound,
+            'parent_resid_weights': parent_resid_weights,
+            'total_hh_sub_control_index': total_hh_sub_control_index,
+            'total_hh_parent_control_index': total_hh_parent_control_index,
+        }
+
+    def infeasible_sub_zones(self):
+        """
+        Screen for sub zones whose own constraints make the simul-integerizer lp infeasible
+
+        Returns
+        -------
+        infeasible : pandas.Series of bool
+            True for infeasible sub zones, indexed by sub_weights column (sub zone name)
+        """
+
+        lp = self.lp_inputs()
+
+        infeasible = sub_zone_lp_infeasible(
+            sub_incidence=lp['sub_incidence'],
+            x_max=(lp['sub_float_weights'] != lp['sub_int_weights']).astype(float),
+            lp_right_hand_side=lp['lp_right_hand_side'],
+            relax_ge_upper_bound=lp['relax_ge_upper_bound'],
+            hh_constraint_ge_bound=lp['hh_constraint_ge_bound'],
+            total_hh_right_hand_side=lp['total_hh_right_hand_side'],
+            total_hh_sub_control_index=lp['total_hh_sub_control_index'])
+
+        return pd.Series(infeasible, index=self.sub_weights.columns)
+
+    def integerize(self):
+
+        lp = self.lp_inputs()
+
+        sub_int_weights = lp['sub_int_weights']
+        sub_resid_weights = lp['sub_resid_weights']
+        total_hh_right_hand_side = lp['total_hh_right_hand_side']
+
+        sub_control_totals = np.asanyarray(self.sub_controls_df).astype(np.int)
+        total_hh_sub_control_index = lp['total_hh_sub_control_index']
+
+        if use_integerizer_hints():
+            hint = np.array([resid_weights_hint(sub_resid_weights[z], total_hh_right_hand_side[z])
+                             for z in range(sub_resid_weights.shape[0])])
+        else:
+            hint = None
+
         integerizer_func = get_simul_integerizer()
 
-        resid_weights_out, status_text = \
-            integerizer_func(sub_int_weights,
-                             parent_countrol_importance,
-                             parent_relax_ge_upper_bound,
-                             sub_countrol_importance,
-                             sub_float_weights,
-                             sub_resid_weights,
-                             lp_right_hand_side,
-                             parent_hh_constraint_ge_bound,
-                             sub_incidence,
-                             parent_incidence,
-                             total_hh_right_hand_side,
-                             relax_ge_upper_bound,
-                             parent_lp_right_hand_side,
-                             hh_constraint_ge_bound,
-                             parent_resid_weights,
-                             total_hh_sub_control_index,
-                             total_hh_parent_control_index)
+        with get_solver_time_budget().allocate(sub_resid_weights.size, self.trace_label) as time_limit:
+            resid_weights_out, status_text = integerizer_func(hint=hint, time_limit=time_limit, **lp)
 
         # smart round resid_weights_out for each sub_zone
         total_household_controls = sub_control_totals[:, total_hh_sub_control_index].flatten()
@@ -192,6 +247,79 @@ class SimulIntegerizer(object):
         return status_text
 
 
+def sub_zone_lp_infeasible(
+        sub_incidence,
+        x_max,
+        lp_right_hand_side,
+        relax_ge_upper_bound,
+        hh_constraint_ge_bound,
+        total_hh_right_hand_side,
+        total_hh_sub_control_index):
+    """
+    Bound propagation screen for sub zones whose own simul-integerizer lp constraints are
+    infeasible (and hence make the simul-integerizer lp, which adds parent constraints, infeasible)
+
+    The resid weight variables x of a sub zone are bounded by [0, x_max] and must sum to
+    total_hh_right_hand_side (k), so each control's weighted incidence lies between the sum of
+    the k smallest and the k largest incidence values of the unfixed households. The relaxation
+    variable bounds restrict it to [max(0, rhs - relax_ge_upper_bound), min(2 * rhs, ge_bound)]
+    and the sub zone is infeasible if these ranges don't overlap for any control.
+
+    This only considers one control at a time, so sub zones that pass the screen may still be
+    infeasible, but sub zones that fail it are certainly infeasible.
+
+    Parameters
+    ----------
+    sub_incidence : numpy.ndarray(sample_count, sub_control_count) float
+    x_max : numpy.ndarray(sub_zone_count, sample_count) float
+        1.0 unless resid_weights is zero, in which case x is constrained to 0.0
+    lp_right_hand_side : numpy.ndarray(sub_zone_count, sub_control_count) float
+    relax_ge_upper_bound : numpy.ndarray(sub_zone_count, sub_control_count) float
+    hh_constraint_ge_bound : numpy.ndarray(sub_zone_count, sub_control_count) float
+    total_hh_right_hand_side : numpy.ndarray(sub_zone_count,) float
+    total_hh_sub_control_index : int
+
+    Returns
+    -------
+    infeasible : numpy.ndarray(sub_zone_count,) bool
+    """
+
+    # tolerance for floating point comparisons of integer-valued totals
+    EPSILON = 1e-6
+
+    sub_zone_count = x_max.shape[0]
+    infeasible = np.zeros(sub_zone_count, dtype=bool)
+
+    control_lower_bound = np.maximum(lp_right_hand_side - relax_ge_upper_bound, 0)
+    control_upper_bound = np.minimum(2 * lp_right_hand_side, hh_constraint_ge_bound)
+
+    other_controls = np.arange(sub_incidence.shape[1]) != total_hh_sub_control_index
+
+    for z in range(sub_zone_count):
+
+        unfixed = x_max[z] > 0
+        k = int(round(total_hh_right_hand_side[z]))
+
+        # not enough unfixed households to round up
+        if k > unfixed.sum():
+            infeasible[z] = True
+            continue
+
+        if k == 0:
+            min_activity = max_activity = np.zeros(sub_incidence.shape[1])
+        else:
+            # incidence values of unfixed households sorted by control
+            incidence = np.sort(sub_incidence[unfixed], axis=0)
+            min_activity = incidence[:k].sum(axis=0)
+            max_activity = incidence[-k:].sum(axis=0)
+
+        infeasible[z] = \
+            ((min_activity > control_upper_bound[z] + EPSILON) & other_controls).any() or \
+            ((max_activity < control_lower_bound[z] - EPSILON) & other_controls).any()
+
+    return infeasible
+
+
 def try_simul_integerizing(
         trace_label,
         incidence_df,
@@ -240,6 +368,8 @@ def try_simul_integerizing(
 
     status = integerizer.integerize()
 
+    set_status(status)
+
     if status not in STATUS_SUCCESS:
         return status, None
 
@@ -265,16 +395,21 @@ def try_simul_integerizing(
 
 def reshape_result(float_weights, integerized_weights, sub_geography, sub_control_zones):
     """
-    Reshape results into unstacked form - (same as that returned by sequential integerizer)
+    Reshape results into sparse long form - (same as that returned by sequential integerizer)
     with columns for 'balanced_weight', 'integer_weight'
     plus columns for household id, and sub_geography zone ids
 
+    Only (household, sub_zone) rows with a nonzero balanced or integer weight are kept, so the
+    result has one row per household a sub zone actually draws on, rather than one row for every
+    sample household in every sub zone.
+
     Parameters
     ----------
     float_weights : pandas.DataFrame
         dataframe with one row per sample hh and one column per sub_zone
-    integerized_weights : pandas.DataFrame
+    integerized_weights : pandas.DataFrame or None
         dataframe with one row per sample hh and one column per sub_zone
+        (or None if not integerized, in which case there is no 'integer_weight' column)
     sub_geography : str
         name of sub_geography for result column name
     sub_control_zones : pandas.Series
@@ -285,23 +420,25 @@ def reshape_result(float_weights, integerized_weights, sub_geography, sub_contro
     integer_weights_df : pandas.DataFrame
         canonical form weight table, with columns for 'balanced_weight', 'integer_weight'
         plus columns for household id, and sub_geography zone ids
+        (indexed by household position in float_weights)
     """
 
-    # integerize the sub_zone weights
-    integer_weights_list = []
-    for zone_id, zone_name in list(sub_control_zones.items()):
-
-        weights = float_weights[zone_name]
+    # zone-major (one row per zone) so that result rows are grouped by zone
+    balanced_weights = float_weights[sub_control_zones.values].values.transpose()
+    nonzero = balanced_weights != 0
 
-        zone_weights_df = pd.DataFrame(index=list(range(0, len(integerized_weights.index))))
-        zone_weights_df[weights.index.name] = float_weights.index
-        zone_weights_df[sub_geography] = zone_id
-        zone_weights_df['balanced_weight'] = float_weights[zone_name].values
-        zone_weights_df['integer_weight'] = integerized_weights[zone_name].astype(int).values
+    if integerized_weights is not None:
+        integer_weights = integerized_weights[sub_control_zones.values].values.astype(int).transpose()
+        nonzero |= integer_weights != 0
 
-        integer_weights_list.append(zone_weights_df)
+    zone_positions, hh_positions = np.nonzero(nonzero)
 
-    integer_weights_df = pd.concat(integer_weights_list)
+    integer_weights_df = pd.DataFrame(index=hh_positions)
+    integer_weights_df[float_weights.index.name] = float_weights.index.values[hh_positions]
+    integer_weights_df[sub_geography] = sub_control_zones.index.values[zone_positions]
+    integer_weights_df['balanced_weight'] = balanced_weights[zone_positions, hh_positions]
+    if integerized_weights is not None:
+        integer_weights_df['integer_weight'] = integer_weights[zone_positions, hh_positions]
 
     return integer_weights_df
 
@@ -319,8 +456,10 @@ def do_simul_integerizing(
 
     Wrapper around simultaneous integerizer to handle solver failure for infeasible subzones.
 
-    Simultaneous integerize balanced float sub_weights,
-    If simultaneous integerization fails, integerize serially to identify infeasible subzones,
+    Sub zones whose own constraints are infeasible (as identified by sub_zone_lp_infeasible
+    bound propagation) are integerized sequentially, since they would make the simultaneous
+    integerization fail. The remaining sub zones are simultaneously integerized, and
+    if simultaneous integerization fails, integerize serially to identify infeasible subzones,
     remove and smart_round infeasible subzones, and try simultaneous integerization again.
     (That ought to succeed, but if not, then fall back to all sequential integerization)
     Finally combine all results into a single result dataframe.
@@ -350,6 +489,109 @@ def do_simul_integerizing(
         plus columns for household id, and sub_geography zone ids
     """
 
+    # integerize sub zones that would make simul integerization infeasible sequentially
+    # (where they will be smart rounded if they are infeasible on their own as well)
+    infeasible_zone_ids = screen_infeasible_sub_zones(
+        incidence_df,
+        sub_weights, sub_controls_df,
+        control_spec, total_hh_control_col,
+        sub_control_zones)
+
+    screened_weights_df = None
+    if len(infeasible_zone_ids) > 0:
+
+        logger.warning("do_simul_integerizing screened out %s infeasible subzones for %s: %s"
+                       % (len(infeasible_zone_ids), trace_label, infeasible_zone_ids))
+
+        screened_weights_df = do_sequential_integerizing(
+            trace_label,
+            incidence_df,
+            sub_weights, sub_controls_df.loc[infeasible_zone_ids],
+            control_spec, total_hh_control_col,
+            sub_control_zones.loc[infeasible_zone_ids],
+            sub_geography)
+
+        if len(infeasible_zone_ids) == len(sub_control_zones):
+            return screened_weights_df
+
+        sub_controls_df = sub_controls_df.drop(infeasible_zone_ids)
+        sub_control_zones = sub_control_zones.drop(infeasible_zone_ids)
+        sub_weights = sub_weights[sub_control_zones]
+
+    integerized_weights_df = simul_integerize_with_fallback(
+        trace_label,
+        incidence_df,
+        sub_weights, sub_controls_df,
+        control_spec, total_hh_control_col,
+        sub_geography,
+        sub_control_zones)
+
+    # (pd.concat ignores None)
+    return pd.concat([integerized_weights_df, screened_weights_df])
+
+
+def screen_infeasible_sub_zones(
+        incidence_df,
+        sub_weights, sub_controls_df,
+        control_spec, total_hh_control_col,
+        sub_control_zones):
+    """
+    Return ids of sub zones that would make simultaneous integerization infeasible
+
+    Parameters
+    ----------
+    incidence_df : pandas.Dataframe
+        full incidence_df for all hh samples in seed zone
+    sub_weights : pandas.DataFame
+        balanced subzone household sample weights to integerize
+    sub_controls_df : pandas.Dataframe
+        sub_geography controls (one row per zone indexed by sub_zone id)
+    control_spec : pandas.Dataframe
+        full control spec with columns 'target', 'seed_table', 'importance', ...
+    total_hh_control_col : str
+        name of total_hh column
+    sub_control_zones : pandas.Series
+        index is zone id and value is zone label (e.g. TAZ_101)
+
+    Returns
+    -------
+    infeasible_zone_ids : list
+        zone ids of sub zones identified as infeasible by sub_zone_lp_infeasible
+    """
+
+    # as in try_simul_integerizing
+    zero_weight_rows = sub_weights.sum(axis=1) == 0
+
+    integerizer = SimulIntegerizer(
+        incidence_df[~zero_weight_rows],
+        sub_weights[~zero_weight_rows],
+        sub_controls_df,
+        control_spec,
+        total_hh_control_col
+    )
+
+    infeasible = integerizer.infeasible_sub_zones()
+
+    return [zone_id for zone_id, zone_name in sub_control_zones.items() if infeasible[zone_name]]
+
+
+def simul_integerize_with_fallback(
+        trace_label,
+        incidence_df,
+        sub_weights, sub_controls_df,
+        control_spec, total_hh_control_col,
+        sub_geography,
+        sub_control_zones):
+    """
+    Simultaneous integerize balanced float sub_weights,
+    If simultaneous integerization fails, integerize serially to identify infeasible subzones,
+    remove and smart_round infeasible subzones, and try simultaneous integerization again.
+    (That ought to succeed, but if not, then fall back to all sequential integerization)
+    Finally combine all results into a single result dataframe.
+
+    Parameters and result as for do_simul_integerizing
+    """
+
     # try simultaneous integerization of all subzones
     status,  integerized_weights_df = try_simul_integerizing(
         trace_label,
@@ -490,8 +732,7 @@ def do_sequential_integerizing(
     plus columns for household id, and sub_geography zone ids
 
     """
-    integerized_weights_list = []
-    rounded_weights_list = []
+    integer_weights_df = pd.DataFrame(index=sub_weights.index)
     integerized_zone_ids = []
     rounded_zone_ids = []
     for zone_id, zone_name in list(sub_control_zones.items()):
@@ -511,25 +752,22 @@ def do_sequential_integerizing(
             total_hh_control_col=total_hh_control_col
         )
 
-        zone_weights_df = pd.DataFrame(index=list(range(0, len(integer_weights.index))))
-        zone_weights_df[weights.index.name] = weights.index
-        zone_weights_df[sub_geography] = zone_id
-        zone_weights_df['balanced_weight'] = weights.values
-        zone_weights_df['integer_weight'] = integer_weights.astype(int).values
+        integer_weights_df[zone_name] = integer_weights.astype(int).values
 
         if status in STATUS_SUCCESS:
-            integerized_weights_list.append(zone_weights_df)
             integerized_zone_ids.append(zone_id)
         else:
-            rounded_weights_list.append(zone_weights_df)
             rounded_zone_ids.append(zone_id)
 
+    def zone_weights(zone_ids):
+        return reshape_result(sub_weights, integer_weights_df, sub_geography,
+                              sub_control_zones.loc[zone_ids])
+
     if combine_results:
-        integerized_weights_df = pd.concat(integerized_weights_list + rounded_weights_list)
-        return integerized_weights_df
+        return zone_weights(integerized_zone_ids + rounded_zone_ids)
 
-    integerized_weights_df = pd.concat(integerized_weights_list) if integerized_zone_ids else None
-    rounded_weights_df = pd.concat(rounded_weights_list) if rounded_zone_ids else None
+    integerized_weights_df = zone_weights(integerized_zone_ids) if integerized_zone_ids else None
+    rounded_weights_df = zone_weights(rounded_zone_ids) if rounded_zone_ids else None
 
     return integerized_zone_ids, rounded_zone_ids, integerized_weights_df, rounded_weights_df
 
@@ -542,27 +780,11 @@ def do_no_integerizing(
         sub_control_zones,
         sub_geography):
     """
-
+    Balanced weights of sub zones, in canonical form weight table, without integerizing
+    (for NO_INTEGERIZATION_EVER)
     """
-    integerized_weights_list = []
-    rounded_weights_list = []
-    integerized_zone_ids = []
-    for zone_id, zone_name in sub_control_zones.iteritems():
-
-        logger.info("sequential_integerizing zone_id %s zone_name %s" % (zone_id, zone_name))
-
-        weights = sub_weights[zone_name]
-
-        zone_weights_df = pd.DataFrame(index=range(0, len(weights.index)))
-        zone_weights_df[weights.index.name] = weights.index
-        zone_weights_df[sub_geography] = zone_id
-        zone_weights_df['balanced_weight'] = weights.values
-
-        integerized_weights_list.append(zone_weights_df)
-        integerized_zone_ids.append(zone_id)
 
-    integerized_weights_df = pd.concat(integerized_weights_list + rounded_weights_list)
-    return integerized_weights_df
+    return reshape_result(sub_weights, None, sub_geography, sub_control_zones)
 
 
 def multi_integerize(
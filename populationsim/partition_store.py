@@ -0,0 +1,119 @@
+# PopulationSim
+# See full license in LICENSE.txt.
+
+import contextlib
+import logging
+import os
+import warnings
+
+import pandas as pd
+import tables
+
+
+logger = logging.getLogger(__name__)
+
+
+class PartitionStore(object):
+    """
+    HDF5 file of dataframes keyed by partition (e.g. seed zone or parent zone), with one node
+    per partition, so that a single partition can be written or read without reading, or
+    holding in memory, the others.
+
+    Partitions can be tagged with attributes (e.g. a fingerprint of the inputs they were
+    computed from), and are only read back if their attributes match.
+
+    Parameters
+    ----------
+    file_path : str
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+
+    @contextlib.contextmanager
+    def open(self, mode='r'):
+
+        with pd.HDFStore(self.file_path, mode=mode) as store, \
+                warnings.catch_warnings():
+
+            # partition keys (e.g. zone ids) needn't be valid python identifiers
+            warnings.simplefilter('ignore', tables.NaturalNameWarning)
+
+            yield store
+
+    def put_all(self, partitions, **attrs):
+        """
+        Write (or replace) partitions
+
+        Parameters
+        ----------
+        partitions : iterable of (str, pandas.DataFrame)
+            key and dataframe of each partition
+        attrs : dict
+            attributes to tag partitions with
+        """
+
+        with self.open(mode='a') as store:
+            for key, df in partitions:
+                store.put(key, df, format='fixed')
+                for name, value in attrs.items():
+                    setattr(store.get_storer(key).attrs, name, value)
+
+    def put(self, key, df, **attrs):
+        """
+        Write (or replace) partition
+
+        Parameters
+        ----------
+        key : str
+        df : pandas.DataFrame
+        attrs : dict
+            attributes to tag partition with
+        """
+
+        self.put_all([(key, df)], **attrs)
+
+    def get(self, key, **attrs):
+        """
+        Read partition
+
+        Parameters
+        ----------
+        key : str
+        attrs : dict
+            attributes partition must be tagged with
+
+        Returns
+        -------
+        pandas.DataFrame or None
+            partition, or None if there is no partition key (or its attributes don't match)
+        """
+
+        if not os.path.exists(self.file_path):
+            return None
+
+        with self.open(mode='r') as store:
+            if key not in store:
+                return None
+            storer_attrs = store.get_storer(key).attrs
+            for name, value in attrs.items():
+                if getattr(storer_attrs, name, None) != value:
+                    logger.info("ignoring partition %s of %s: %s has changed" % (key, self.file_path, name))
+                    return None
+            return store[key]
+
+    def remove(self, key=None):
+        """
+        Remove partition (or group of partitions) key, or the whole store if key is None
+        """
+
+        if not os.path.exists(self.file_path):
+            return
+
+        if key is None:
+            os.remove(self.file_path)
+            return
+
+        with self.open(mode='a') as store:
+            if key in store:
+                store.remove(key)
@@ -0,0 +1,209 @@
+# PopulationSim
+# See full license in LICENSE.txt.
+
+import contextlib
+import functools
+import inspect
+import logging
+import sys
+import time
+
+import pandas as pd
+import psutil
+
+try:
+    import resource
+except ImportError:
+    # not available on windows
+    resource = None
+
+from activitysim.core import config
+from activitysim.core import inject
+from activitysim.core.config import setting
+
+logger = logging.getLogger(__name__)
+
+PERFORMANCE_FILE_NAME = 'performance'
+
+PERFORMANCE_COLUMNS = ['step', 'geography', 'zone_id', 'phase',
+                       'wall_time', 'cpu_time', 'rss', 'rss_delta', 'peak_rss', 'status']
+
+BYTES_PER_MB = 1024 * 1024
+
+# stack of open performance records (innermost last)
+_ACTIVE_RECORDS = []
+
+
+def performance_log_enabled():
+
+    return setting('performance_log', True)
+
+
+@inject.injectable(cache=True)
+def performance_records():
+    """
+    list of performance records (dicts with PERFORMANCE_COLUMNS keys) for steps run in this run
+    """
+    return []
+
+
+def rss():
+    """
+    current resident set size in bytes
+    """
+    return psutil.Process().memory_info().rss
+
+
+def peak_rss():
+    """
+    process high water mark resident set size in bytes (or None if not available on platform)
+    """
+    if resource is not None:
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on mac and kilobytes on linux
+        return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+    return getattr(psutil.Process().memory_info(), 'peak_wset', None)
+
+
+def to_mb(num_bytes):
+    return None if num_bytes is None else round(num_bytes / BYTES_PER_MB, 1)
+
+
+def format_status(status_counts):
+
+    if not status_counts:
+        return None
+    if len(status_counts) == 1 and list(status_counts.values())[0] == 1:
+        return list(status_counts.keys())[0]
+    return ';'.join('%s:%s' % (status, count) for status, count in status_counts.items())
+
+
+@contextlib.contextmanager
+def profile(step=None, geography=None, zone_id=None, phase=None):
+    """
+    Context manager to record wall time, cpu time, resident set size and (via set_status)
+    solver status for a step, or a zone or phase within a step.
+
+    step, geography and zone_id are inherited from the enclosing profile if not specified,
+    so that nested phases (e.g. 'balance' and 'integerize') are attributed to their zone.
+
+    peak_rss is the process high water mark at the end of the profiled block, not the peak
+    within the block.
+
+    Parameters
+    ----------
+    step : str
+        model step name (including step args, e.g. sub_balancing.geography=TAZ)
+    geography : str
+        zone geography (e.g. PUMA)
+    zone_id : int
+        zone id
+    phase : str
+        'step' for whole steps, 'zone' for whole zones, or a phase within a zone (e.g. 'balance')
+
+    Yields
+    ------
+    record : dict
+        performance record (populated when block exits)
+    """
+
+    if not performance_log_enabled():
+        yield {}
+        return
+
+    if _ACTIVE_RECORDS:
+        enclosing = _ACTIVE_RECORDS[-1]
+        step = step or enclosing['step']
+        geography = geography or enclosing['geography']
+        zone_id = enclosing['zone_id'] if zone_id is None else zone_id
+
+    record = {'step': step, 'geography': geography, 'zone_id': zone_id, 'phase': phase}
+    status_counts = {}
+
+    # records are listed in the order they are started (e.g. steps before their zones)
+    inject.get_injectable('performance_records').append(record)
+    _ACTIVE_RECORDS.append(record)
+    record['_status_counts'] = status_counts
+
+    rss_start = rss()
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+
+    try:
+        yield record
+    finally:
+        record['wall_time'] = round(time.perf_counter() - wall_start, 4)
+        record['cpu_time'] = round(time.process_time() - cpu_start, 4)
+        rss_end = rss()
+        record['rss'] = to_mb(rss_end)
+        record['rss_delta'] = to_mb(rss_end - rss_start)
+        record['peak_rss'] = to_mb(peak_rss())
+
+        _ACTIVE_RECORDS.pop()
+        del record['_status_counts']
+        record['status'] = format_status(status_counts)
+
+
+def set_status(status):
+    """
+    Count status (e.g. balancer convergence or integerizer solver status) in all open
+    performance records (so zone and step records summarize status of their phases)
+    """
+
+    for record in _ACTIVE_RECORDS:
+        status_counts = record['_status_counts']
+        status_counts[status] = status_counts.get(status, 0) + 1
+
+
+def step_label(step_name):
+
+    step_args = inject.get_injectable('step_args', None)
+    if step_args:
+        step_name = '%s.%s' % (step_name, ';'.join('%s=%s' % (k, v) for k, v in step_args.items()))
+    return step_name
+
+
+def write_performance_log():
+    """
+    Write performance records for this run to performance.csv and performance.json in output dir
+    """
+
+    performance_records = inject.get_injectable('performance_records')
+    records = pd.DataFrame(performance_records, columns=PERFORMANCE_COLUMNS)
+
+    # object dtype, so that zone ids are written as they are (rather than e.g. 100.0 if
+    # records without zones made the column float)
+    records['zone_id'] = pd.Series([r['zone_id'] for r in performance_records], index=records.index, dtype=object)
+
+    records.to_csv(config.log_file_path('%s.csv' % PERFORMANCE_FILE_NAME), index=False)
+    records.to_json(config.log_file_path('%s.json' % PERFORMANCE_FILE_NAME), orient='records', indent=2)
+
+
+def profile_step(func):
+    """
+    Decorator for model step functions (below @inject.step()) to profile them and write
+    the performance log when they complete.
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+
+        if not performance_log_enabled():
+            return func(*args, **kwargs)
+
+        with profile(step=step_label(func.__name__), phase='step') as record:
+            result = func(*args, **kwargs)
+
+        logger.info("%s wall_time %ss cpu_time %ss rss %s MB peak_rss %s MB" %
+                    (record['step'], record['wall_time'], record['cpu_time'],
+                     record['rss'], record['peak_rss']))
+
+        write_performance_log()
+
+        return result
+
+    # orca injects step args by name, so wrapper must have the same signature as func
+    wrapper.__signature__ = inspect.signature(func)
+
+    return wrapper
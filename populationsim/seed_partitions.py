@@ -0,0 +1,76 @@
+# PopulationSim
+# See full license in LICENSE.txt.
+
+import itertools
+import logging
+
+from .partition_store import PartitionStore
+
+
+logger = logging.getLogger(__name__)
+
+
+class SeedPartitions(PartitionStore):
+    """
+    Table stored in a PartitionStore partitioned by seed zone (one partition per seed zone)
+    so that the rows of a single seed zone can be read without reading, or holding in memory,
+    the whole table.
+
+    Rows of each seed zone partition are in the same order as in the partitioned table.
+
+    Parameters
+    ----------
+    file_path : str
+        path of HDF5 file (which may hold partitions of several tables)
+    table_name : str
+    """
+
+    def __init__(self, file_path, table_name):
+        super().__init__(file_path)
+        self.table_name = table_name
+
+    def key(self, seed_id):
+        return '/%s/seed_%s' % (self.table_name, seed_id)
+
+    def template_key(self):
+        # zero-row frame with table columns (and dtypes) for seed zones with no rows
+        return '/%s/template' % self.table_name
+
+    def write(self, df, seed_geography):
+        """
+        Write (or replace) partitions of df by seed_geography column
+
+        Parameters
+        ----------
+        df : pandas.DataFrame
+        seed_geography : str
+        """
+
+        logger.info("writing %s partitioned by %s to %s" % (self.table_name, seed_geography, self.file_path))
+
+        self.remove('/%s' % self.table_name)
+
+        # partitions are written as they are sliced, rather than all held in memory
+        partitions = itertools.chain(
+            [(self.template_key(), df.iloc[:0])],
+            ((self.key(seed_id), seed_df) for seed_id, seed_df in df.groupby(seed_geography, sort=False)))
+        self.put_all(partitions)
+
+    def read(self, seed_id):
+        """
+        Read the partition for a seed zone
+
+        Parameters
+        ----------
+        seed_id : seed zone id
+
+        Returns
+        -------
+        pandas.DataFrame
+            rows of partitioned table in seed zone
+        """
+
+        df = self.get(self.key(seed_id))
+        if df is None:
+            df = self.get(self.template_key())
+        return df
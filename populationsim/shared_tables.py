@@ -0,0 +1,113 @@
+# PopulationSim
+# See full license in LICENSE.txt.
+
+import logging
+import os
+
+from .column_store import ColumnStore
+
+
+logger = logging.getLogger(__name__)
+
+
+class SharedTables(object):
+    """
+    Read-only tables stored as ColumnStores (one .npy file per column) so that every process
+    reading a table memory-maps the same files, rather than each loading its own copy. The
+    operating system keeps a single copy of the mapped pages in its page cache, however many
+    multiprocessing subprocesses read the table.
+
+    The pipeline holds a zero-row stub of each shared table (with the table's columns,
+    dtypes and index name) which is cheap to checkpoint, apportion to subprocesses and
+    load, and which is resolved to the shared table by read.
+
+    Numeric and boolean columns are memory-mapped. Object (e.g. string) columns can't be
+    memory-mapped, and are loaded into memory by each reader.
+
+    Parameters
+    ----------
+    dir_path : str
+        directory with a ColumnStore sub directory for each table
+    """
+
+    def __init__(self, dir_path):
+        self.dir_path = dir_path
+
+    def table_store(self, table_name):
+        return ColumnStore(os.path.join(self.dir_path, table_name))
+
+    def write(self, table_name, df):
+        """
+        Write (or replace) shared table
+
+        Parameters
+        ----------
+        table_name : str
+        df : pandas.DataFrame
+
+        Returns
+        -------
+        pandas.DataFrame
+            zero-row stub of df to store in the pipeline in its place
+        """
+
+        store = self.table_store(table_name)
+
+        logger.info("sharing table %s (%s rows) in %s" % (table_name, len(df.index), store.dir_path))
+
+        store.remove()
+        try:
+            store.append(df)
+        except RuntimeError as e:
+            store.remove()
+            raise RuntimeError("can't share table %s: %s" % (table_name, e))
+
+        return df.iloc[:0]
+
+    def is_stub(self, table_name, df):
+        """
+        Whether df is the pipeline stub of a shared table
+
+        Parameters
+        ----------
+        table_name : str
+        df : pandas.DataFrame
+            pipeline table
+
+        Returns
+        -------
+        bool
+        """
+
+        if len(df.index) > 0:
+            return False
+
+        manifest = self.table_store(table_name).manifest()
+        return manifest is not None and manifest['rows'] > 0 and \
+            manifest['columns'] == [str(c) for c in df.columns]
+
+    def read(self, table_name, stub):
+        """
+        Read shared table, memory-mapping its column files
+
+        Each column is a read-only view of its mapped file rather than a copy. Callers must
+        not modify values in place.
+
+        Parameters
+        ----------
+        table_name : str
+        stub : pandas.DataFrame
+            pipeline stub of shared table
+
+        Returns
+        -------
+        pandas.DataFrame
+        """
+
+        df = self.table_store(table_name).read(columns=stub.columns, mmap=True)
+        df.index.name = stub.index.name
+
+        return df
+
+    def remove(self, table_name):
+        self.table_store(table_name).remove()
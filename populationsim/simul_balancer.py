@@ -45,7 +45,9 @@ class SimultaneousListBalancer(object):
                  parent_weights,
                  controls,
                  sub_control_zones,
-                 total_hh_control_col):
+                 total_hh_control_col,
+                 max_zones_per_block=None,
+                 group_by_incidence=False):
         """
 
         Parameters
@@ -63,6 +65,13 @@ class SimultaneousListBalancer(object):
             for use in sub_controls_df column names
         total_hh_control_col : str
             name of the total_hh control column
+        max_zones_per_block : int or None
+            if specified, and there are more sub zones than this, balance sub zones in blocks
+            of at most this many zones (see np_simul_balancer_blocked)
+        group_by_incidence : bool
+            if True, balance a single sample for each group of households with identical
+            incidence (with the group's total parent weight) and disaggregate the balanced
+            weights back to households in proportion to their parent weights
         """
         assert isinstance(incidence_table, pd.DataFrame)
         assert len(parent_weights.index) == len(incidence_table.index)
@@ -80,12 +89,37 @@ class SimultaneousListBalancer(object):
         self.incidence_table = incidence_table[self.positive_weight_rows]
         self.weights = pd.DataFrame({'parent': parent_weights[self.positive_weight_rows]})
 
+        # number of households the balanced samples represent
+        self.household_count = len(self.incidence_table.index)
+
+        # households with identical incidence are balanced identically (every update scales their
+        # sub zone weights by the same factor, so they stay proportional to their parent weights)
+        # remember group of each household and its share of group parent weight to disaggregate
+        self.household_groups = None
+        if group_by_incidence:
+            household_weights = self.weights['parent']
+            group_ids = self.incidence_table.groupby(list(self.incidence_table.columns), sort=False).ngroup()
+            group_weights = household_weights.groupby(group_ids.values).sum()
+            self.household_groups = pd.DataFrame({
+                'group': group_ids.values,
+                'share': household_weights.values / group_weights.values[group_ids.values]},
+                index=household_weights.index)
+
+            # first household of each group (in order of group_id) represents the group
+            self.incidence_table = self.incidence_table[~group_ids.duplicated().values]
+            self.weights = pd.DataFrame({'parent': group_weights.values}, index=self.incidence_table.index)
+
+            logger.debug("%s incidence groups of %s positive weight rows"
+                         % (len(self.incidence_table.index), self.household_count))
+
         self.controls = controls
         self.sub_control_zones = sub_control_zones
 
         self.total_hh_control_col = total_hh_control_col
         self.master_control_index = self.incidence_table.columns.get_loc(total_hh_control_col)
 
+        self.max_zones_per_block = max_zones_per_block
+
     def balance(self):
 
         assert len(self.incidence_table.columns) == len(self.controls.index)
@@ -95,12 +129,17 @@ class SimultaneousListBalancer(object):
         if 'lower_bound' not in self.weights:
             self.weights['lower_bound'] = 0.0
 
+        zone_count = len(self.sub_control_zones)
+        blocked = self.max_zones_per_block and zone_count > self.max_zones_per_block
+
         # set initial sub zone weights proportionate to number of households
+        # (when blocked, np_simul_balancer_blocked sets them a block at a time)
         total_hh_controls = self.controls.iloc[self.master_control_index]
         total_hh = int(total_hh_controls['total'])
         sub_zone_hh_fractions = total_hh_controls[self.sub_control_zones] / total_hh
-        for zone, zone_name in list(self.sub_control_zones.items()):
-            self.weights[zone_name] = self.weights['parent'] * sub_zone_hh_fractions[zone_name]
+        if not blocked:
+            for zone, zone_name in list(self.sub_control_zones.items()):
+                self.weights[zone_name] = self.weights['parent'] * sub_zone_hh_fractions[zone_name]
 
         self.controls['total'] = np.maximum(self.controls['total'], MIN_CONTROL_VALUE)
 
@@ -110,7 +149,6 @@ class SimultaneousListBalancer(object):
         # prepare inputs as numpy  (no pandas)
         sample_count = len(self.incidence_table.index)
         control_count = len(self.incidence_table.columns)
-        zone_count = len(self.sub_control_zones)
 
         master_control_index = self.master_control_index
         incidence = self.incidence_table.values.transpose().astype(np.float64)
@@ -125,28 +163,56 @@ class SimultaneousListBalancer(object):
         controls_importance = np.asanyarray(self.controls['importance']).astype(np.float64)
 
         sub_controls = self.controls[self.sub_control_zones].values.astype('float').transpose()
-        sub_weights = self.weights[self.sub_control_zones].values.astype('float').transpose()
 
         # balance
-        weights_final, relaxation_factors, status = np_simul_balancer(
-            sample_count,
-            control_count,
-            zone_count,
-            master_control_index,
-            incidence,
-            parent_weights,
-            weights_lower_bound,
-            weights_upper_bound,
-            sub_weights,
-            parent_controls,
-            controls_importance,
-            sub_controls)
-
-        # dataframe with sub_zone_weights in columns, and zero weight rows restored
-        self.sub_zone_weights = pd.DataFrame(index=self.positive_weight_rows.index)
-        for i, c in zip(list(range(len(self.sub_control_zones))), self.sub_control_zones):
-            self.sub_zone_weights[c] = pd.Series(weights_final[i], self.weights.index)
-        self.sub_zone_weights.fillna(value=0.0, inplace=True)
+        if blocked:
+            weights_final, relaxation_factors, status = np_simul_balancer_blocked(
+                sample_count,
+                control_count,
+                zone_count,
+                master_control_index,
+                incidence,
+                parent_weights,
+                weights_lower_bound,
+                weights_upper_bound,
+                np.asanyarray(sub_zone_hh_fractions).astype(np.float64),
+                parent_controls,
+                controls_importance,
+                sub_controls,
+                self.max_zones_per_block,
+                household_count=self.household_count)
+        else:
+            sub_weights = self.weights[self.sub_control_zones].values.astype('float').transpose()
+            weights_final, relaxation_factors, status = np_simul_balancer(
+                sample_count,
+                control_count,
+                zone_count,
+                master_control_index,
+                incidence,
+                parent_weights,
+                weights_lower_bound,
+                weights_upper_bound,
+                sub_weights,
+                parent_controls,
+                controls_importance,
+                sub_controls,
+                household_count=self.household_count)
+
+        # dataframe with sub_zone_weights in columns, and zero weight rows restored,
+        # with (group) weights written straight into its rows
+        sub_zone_weights = np.zeros((len(self.positive_weight_rows.index), zone_count))
+        if self.household_groups is not None:
+            # disaggregate group weights to households
+            sub_zone_weights[self.positive_weight_rows.values] = \
+                weights_final.T[self.household_groups['group'].values] * \
+                self.household_groups['share'].values[:, np.newaxis]
+        else:
+            sub_zone_weights[self.positive_weight_rows.values] = weights_final.T
+        del weights_final
+        np.nan_to_num(sub_zone_weights, copy=False)
+
+        self.sub_zone_weights = pd.DataFrame(
+            sub_zone_weights, index=self.positive_weight_rows.index, columns=self.sub_control_zones.values)
 
         # series mapping zone_id to column names
         self.sub_zone_ids = self.sub_control_zones.index.values
@@ -174,11 +240,15 @@ def np_simul_balancer(
         sub_weights,
         parent_controls,
         controls_importance,
-        sub_controls):
+        sub_controls,
+        household_count=None):
     """
         Simultaneous balancer using only numpy (no pandas) data types.
         Separate function to ensure that no pandas data types leak in from object instance variables
         since they are often silently accepted as numpy arguments but slow things down
+
+        household_count is the number of households the samples represent (if samples are
+        household groups) so that the convergence delta is the mean change in household weight
     """
 
     logger.debug("np_simul_balancer sample_count %s control_count %s zone_count %s" %
@@ -259,7 +329,7 @@ def np_simul_balancer(
         assert not np.isnan(max_gamma_dif)
 
         # ensure float division
-        delta = np.absolute(sub_weights - weights_previous).sum() / float(sample_count)
+        delta = np.absolute(sub_weights - weights_previous).sum() / float(household_count or sample_count)
         assert not np.isnan(delta)
 
         # standard convergence criteria
@@ -283,3 +353,185 @@ def np_simul_balancer(
     }
 
     return sub_weights, relaxation_factors, status
+
+
+def np_balance_sub_zone_block(
+        block_weights,
+        relaxation_factors,
+        sub_controls,
+        incidence,
+        incidence2,
+        control_indexes,
+        importances,
+        weights_lower_bound,
+        weights_upper_bound):
+    """
+        One np_simul_balancer iteration (prior to rescaling to parent weights) for a block of
+        sub zones, vectorized across zones. block_weights and relaxation_factors are updated in place.
+
+        Returns gamma for the block zones
+    """
+
+    gamma = np.ones(relaxation_factors.shape)
+
+    for c in control_indexes:
+
+        importance = importances[c]
+
+        xx = block_weights.dot(incidence[c])
+
+        # calculate constraint balancing factors, gamma
+        has_weight = xx > 0
+        yy = block_weights[has_weight].dot(incidence2[c])
+        relaxed_constraint = sub_controls[has_weight, c] * relaxation_factors[has_weight, c]
+        relaxed_constraint = np.maximum(relaxed_constraint, MIN_CONTROL_VALUE)
+        gamma[has_weight, c] = 1.0 - (xx[has_weight] - relaxed_constraint) / (
+            yy + (relaxed_constraint / float(importance)))
+
+        # update HH weights
+        block_weights *= np.power(gamma[:, c][:, np.newaxis], incidence[c])
+
+        # clip weights to upper and lower bounds
+        np.clip(block_weights, weights_lower_bound, weights_upper_bound, out=block_weights)
+
+        relaxation_factors[:, c] *= np.power(1.0 / gamma[:, c], 1.0 / importance)
+
+        # clip relaxation_factors
+        np.minimum(relaxation_factors, MAX_RELAXATION_FACTOR, out=relaxation_factors)
+
+    return gamma
+
+
+def np_simul_balancer_blocked(
+        sample_count,
+        control_count,
+        zone_count,
+        master_control_index,
+        incidence,
+        parent_weights,
+        weights_lower_bound,
+        weights_upper_bound,
+        sub_zone_hh_fractions,
+        parent_controls,
+        controls_importance,
+        sub_controls,
+        max_zones_per_block,
+        household_count=None):
+    """
+        Block-decomposed version of np_simul_balancer for parents with very many sub zones.
+
+        Sub zones only interact through the rescaling of their weights to sum to parent_weights,
+        so each iteration makes two passes over blocks of at most max_zones_per_block sub zones:
+        the first balances a scratch copy of each block to accumulate the per-household weight
+        sums (and hence the rescale factors), the second repeats the (deterministic) balancing
+        step, rescales, and updates the block weights in place. This gives the same result as
+        np_simul_balancer for twice the arithmetic, but temporaries (and vectorization across
+        zones) scale with block size rather than zone_count.
+
+        Rather than initial sub_weights, takes each sub zone's fraction of parent households
+        (sub_zone_hh_fractions) and sets each block's initial weights (parent_weights times its
+        fractions) directly in the returned weights array, which is the only array of
+        zone_count x sample_count weights.
+
+        household_count is as for np_simul_balancer
+    """
+
+    logger.debug("np_simul_balancer_blocked sample_count %s control_count %s zone_count %s "
+                 "max_zones_per_block %s" %
+                 (sample_count, control_count, zone_count, max_zones_per_block))
+
+    # initial relaxation factors
+    relaxation_factors = np.ones((zone_count, control_count))
+
+    # Note: importance_adjustment must always be a float to ensure
+    # correct "true division" in both Python 2 and 3
+    importance_adjustment = 1.0
+
+    # array of control indexes for iterating over controls
+    control_indexes = list(range(control_count))
+    if master_control_index is not None:
+        # reorder indexes so we handle master_control_index last
+        control_indexes.append(control_indexes.pop(master_control_index))
+
+    # precompute incidence squared
+    incidence2 = incidence * incidence
+
+    # slices of contiguous sub zones (so that sub_weights[block] is a view)
+    blocks = [slice(start, min(start + max_zones_per_block, zone_count))
+              for start in range(0, zone_count, max_zones_per_block)]
+
+    # initial sub zone weights proportionate to number of households, set block by block
+    # (blocks of sub_weights are then updated in place)
+    sub_weights = np.empty((zone_count, sample_count))
+    for block in blocks:
+        np.multiply(sub_zone_hh_fractions[block, np.newaxis], parent_weights, out=sub_weights[block])
+
+    max_iterations = setting('MAX_BALANCE_ITERATIONS_SIMULTANEOUS', DEFAULT_MAX_ITERATIONS)
+    for iter in range(max_iterations):
+
+        # importance adjustment as number of iterations progress
+        if iter > 0 and iter % IMPORTANCE_ADJUST_COUNT == 0:
+            importance_adjustment = importance_adjustment / IMPORTANCE_ADJUST
+
+        # adjust importance (unless this is master_control)
+        importances = [max(controls_importance[c] * importance_adjustment, MIN_IMPORTANCE)
+                       for c in range(control_count)]
+        if master_control_index is not None:
+            importances[master_control_index] = controls_importance[master_control_index]
+
+        # first pass - sum balanced weights of each hh across all sub zones
+        weight_sums = np.zeros(sample_count)
+        for block in blocks:
+            block_weights = sub_weights[block].copy()
+            np_balance_sub_zone_block(
+                block_weights, relaxation_factors[block].copy(), sub_controls[block],
+                incidence, incidence2, control_indexes, importances,
+                weights_lower_bound, weights_upper_bound)
+            weight_sums += block_weights.sum(axis=0)
+
+        # rescale sub_weights so weight of each hh across sub zones sums to parent_weight
+        scale = np.nan_to_num(parent_weights / weight_sums)
+
+        # second pass - balance, rescale and update in place
+        delta = 0.0
+        max_gamma_dif = 0.0
+        for block in blocks:
+            block_weights = sub_weights[block].copy()
+            gamma = np_balance_sub_zone_block(
+                block_weights, relaxation_factors[block], sub_controls[block],
+                incidence, incidence2, control_indexes, importances,
+                weights_lower_bound, weights_upper_bound)
+            block_weights *= scale
+
+            delta += np.absolute(block_weights - sub_weights[block]).sum()
+            max_gamma_dif = max(max_gamma_dif, np.absolute(gamma - 1).max())
+
+            sub_weights[block] = block_weights
+
+        assert not np.isnan(max_gamma_dif)
+
+        # ensure float division
+        delta = delta / float(household_count or sample_count)
+        assert not np.isnan(delta)
+
+        # standard convergence criteria
+        converged = delta < MAX_DELTA and max_gamma_dif < MAX_GAMMA
+
+        # even if not converged, no point in further iteration if weights aren't changing
+        no_progress = delta < ALT_MAX_DELTA
+
+        if (iter % 100) == 0:
+            logger.debug("np_simul_balancer_blocked iteration %s delta %s max_gamma_dif %s" %
+                         (iter, delta, max_gamma_dif))
+
+        if converged or no_progress:
+            break
+
+    status = {
+        'converged': converged,
+        'iter': iter,
+        'delta': delta,
+        'max_gamma_dif': max_gamma_dif
+    }
+
+    return sub_weights, relaxation_factors, status
@@ -0,0 +1,122 @@
+# PopulationSim
+# See full license in LICENSE.txt.
+
+import logging
+import tempfile
+
+import pandas as pd
+
+from activitysim.core import inject
+from activitysim.core.config import setting
+
+from .column_store import ColumnStore
+
+
+logger = logging.getLogger(__name__)
+
+
+class FrameBuffer(object):
+    """
+    Accumulate dataframes (with the same columns) in memory, to be concatenated when complete
+    """
+
+    def __init__(self):
+        self.frames = []
+
+    def append(self, df):
+        self.frames.append(df)
+
+    def to_frame(self):
+        df = pd.concat(self.frames)
+        self.frames = []
+        return df
+
+    def cleanup(self):
+        self.frames = []
+
+
+class SpillBuffer(ColumnStore):
+    """
+    Accumulate dataframes (with the same columns) on disk, in a ColumnStore, so that only the
+    final concatenated dataframe, rather than the accumulated frames as well, is ever held in
+    memory.
+
+    to_frame reads the columns back one at a time, so peak memory while assembling the
+    result is the result plus a single column.
+
+    Parameters
+    ----------
+    dir_path : str
+        directory (which should be empty or not yet exist) for column files
+    """
+
+    def to_frame(self):
+        """
+        Concatenated dataframe of all appended frames (in order)
+
+        Column files are deleted as they are read.
+        """
+
+        return self.read(remove_files=True)
+
+    def cleanup(self):
+        self.remove()
+
+
+class CheckpointsBuffer(object):
+    """
+    Accumulate per zone results that are also stored in ZoneCheckpoints, by reading them back
+    from the checkpoints store (see ZoneCheckpoints.results_frame) rather than holding (or
+    spilling) a second copy.
+
+    Frames must be appended as their zones are put to (or read from) checkpoints.
+
+    Parameters
+    ----------
+    checkpoints : ZoneCheckpoints
+    """
+
+    def __init__(self, checkpoints):
+        self.checkpoints = checkpoints
+        self.frame_count = 0
+
+    def append(self, df):
+        # df is already stored in checkpoints
+        self.frame_count += 1
+        assert self.frame_count == len(self.checkpoints.zone_results)
+
+    def to_frame(self):
+        return self.checkpoints.results_frame()
+
+    def cleanup(self):
+        pass
+
+
+def zone_results_buffer(name, checkpoints=None):
+    """
+    Buffer in which to accumulate the per zone results of a step if the SPILL_ZONE_RESULTS
+    setting is enabled: a CheckpointsBuffer if zone checkpoints are also being stored, otherwise
+    a SpillBuffer (in a temporary directory in the output dir). A FrameBuffer otherwise.
+
+    Parameters
+    ----------
+    name : str
+        name of step (e.g. sub_balancing_TAZ)
+    checkpoints : ZoneCheckpoints or None
+        store in which step stores zone results as they complete (if ZONE_CHECKPOINTS is enabled)
+
+    Returns
+    -------
+    SpillBuffer, CheckpointsBuffer or FrameBuffer
+    """
+
+    if not setting('SPILL_ZONE_RESULTS', False):
+        return FrameBuffer()
+
+    if checkpoints is not None:
+        logger.info("reading %s zone results from %s" % (name, checkpoints.file_path))
+        return CheckpointsBuffer(checkpoints)
+
+    dir_path = tempfile.mkdtemp(prefix='%s_spill_' % name, dir=inject.get_injectable('output_dir'))
+    logger.info("spilling %s zone results to %s" % (name, dir_path))
+    return SpillBuffer(dir_path)
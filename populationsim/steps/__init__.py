@@ -15,13 +15,32 @@ from . import expand_households
 from . import summarize
 from . import write_synthetic_population
 from . import repop_balancing
+from . import share_tables
 
+from activitysim.core.steps import output
 from activitysim.core.steps.output import write_data_dictionary
-from activitysim.core.steps.output import write_tables
+
+from .. import checkpoint_store
+from ..performance import profile_step
+from . import helper
+
+# pipeline store is a CheckpointStore if checkpoint_store settings are specified
+checkpoint_store.install()
+
+# cached table frames are dropped when the pipeline is closed
+helper.install()
+
+
+def write_tables(output_dir):
+    output.write_tables(output_dir)
+    # expanded_household_ids are stored as runs, but written with one row per household
+    expand_households.write_expanded_household_ids()
+    # shared tables are stored as stubs in the pipeline
+    share_tables.write_shared_tables()
 
 
 @inject.injectable(cache=True)
 def preload_injectables():
-    inject.add_step('write_data_dictionary', write_data_dictionary)
-    inject.add_step('write_tables', write_tables)
+    inject.add_step('write_data_dictionary', profile_step(write_data_dictionary))
+    inject.add_step('write_tables', profile_step(write_tables))
     return True
@@ -7,27 +7,37 @@ import logging
 import pandas as pd
 import numpy as np
 
+from activitysim.core import config
 from activitysim.core import pipeline
 from activitysim.core import inject
 
 from activitysim.core.config import setting
 from .helper import get_control_table
 from .helper import get_weight_table
-
+from .helper import output_tables_settings
+from .helper import table_frame
 from .helper import weight_table_name
+from ..household_runs import COUNT_COL
+from ..household_runs import household_runs
+from ..household_runs import expand_runs
+from ..household_runs import iter_expanded
+from ..performance import profile_step
 
 logger = logging.getLogger(__name__)
 
 
 @inject.step()
+@profile_step
 def expand_households():
     """
     Create a complete expanded synthetic household list with their assigned geographic zone ids.
 
     This is the skeleton synthetic household id list with no household or person attributes,
-    one row per household, with geography columns and seed household table household_id.
+    with geography columns and seed household table household_id.
 
-    Creates pipeline table expanded_household_ids
+    Creates pipeline table expanded_household_ids, run-length encoded with one row per
+    (zone, household) and a household_count column with the number of synthetic households
+    in that zone drawn from that seed household (see household_runs.expand_runs)
     """
 
     if setting('NO_INTEGERIZATION_EVER', False):
@@ -47,50 +57,52 @@ def expand_households():
     weights = get_weight_table(low_geography, sparse=True)
     weights = weights[geography_cols + [household_id_col, 'integer_weight']]
 
-    # - expand weights table by integer_weight, so there is one row per desired hh
-    weight_cols = weights.columns.values
-    weights_np = np.repeat(weights.values, weights.integer_weight.values, axis=0)
-    expanded_weights = pd.DataFrame(data=weights_np, columns=weight_cols)
+    # - runs of integer_weight synthetic households of each (zone, household)
+    # sorted as the expanded household list will be
+    runs = weights.rename(columns={'integer_weight': COUNT_COL})
+    runs = runs.sort_values(geography_cols + [household_id_col])
 
     if setting('GROUP_BY_INCIDENCE_SIGNATURE'):
 
-        # get these in a repeatable order so np.random.choice behaves the same regardless of weight table order
-        # i.e. which could vary depending on whether we ran single or multi process due to apportioned/coalesce
-        expanded_weights = expanded_weights.sort_values(geography_cols + [household_id_col])
+        # runs are in a repeatable order so np.random.choice behaves the same regardless of weight
+        # table order, i.e. which could vary depending on whether we ran single or multi process
+        # due to apportioned/coalesce
 
         # the household_id_col is really the group_id
-        expanded_weights.rename(columns={household_id_col: 'group_id'}, inplace=True)
+        group_ids = runs[household_id_col].values
+        counts = runs[COUNT_COL].values
 
         # the original incidence table with one row per hh, with index hh_id
-        household_groups = pipeline.get_table('household_groups')
+        household_groups = table_frame('household_groups')
         household_groups = household_groups[[household_id_col, 'group_id', 'sample_weight']]
 
-        # for each group, lists of hh_ids and their sample_weights (as relative probabiliities)
-        # [ [ [<group_0_hh_id_list>], [<group_0_hh_prob_list>] ],
-        #   [ [<group_1_hh_id_list>], [<group_1_hh_prob_list>] ], ... ]
-        HH_IDS = 0
-        HH_PROBS = 1
-        grouper = household_groups.groupby('group_id')
-        group_hh_probs = [0] * len(grouper)
-        for group_id, df in grouper:
-            hh_ids = list(df[household_id_col])
-            probs = list(df.sample_weight / df.sample_weight.sum())
-            group_hh_probs[group_id] = [hh_ids, probs]
-
         # get a repeatable random number sequence generator for consistent choice results
         prng = pipeline.get_rn_generator().get_external_rng('expand_households')
 
-        # now make a hh_id choice for each group_id in expanded_weights
-        def chooser(group_id):
-            hh_ids = group_hh_probs[group_id][HH_IDS]
-            hh_probs = group_hh_probs[group_id][HH_PROBS]
-            return prng.choice(hh_ids, p=hh_probs)
-        expanded_weights[household_id_col] = \
-            expanded_weights.group_id.apply(chooser, convert_dtype=True,)
-
-        # FIXME - omit in production?
-        del expanded_weights['group_id']
-        del expanded_weights['integer_weight']
+        # one random number for each synthetic household (as drawn by successive calls to
+        # prng.choice(hh_ids, p=hh_probs) for each synthetic household in turn)
+        rands = prng.random_sample(counts.sum())
+
+        # choose a hh_id for each synthetic household in each group run,
+        # from the group's hh_ids, with their sample_weights as relative probabilities
+        run_positions = np.repeat(np.arange(len(runs.index)), counts)
+        hh_ids = np.zeros(len(rands), dtype=household_groups[household_id_col].dtype)
+        row_groups = group_ids[run_positions]
+        rows_by_group = pd.Series(np.arange(len(rands))).groupby(row_groups).indices
+        for group_id, df in household_groups.groupby('group_id'):
+            rows = rows_by_group.get(group_id)
+            if rows is None:
+                continue
+            # as in numpy.random.RandomState.choice
+            cdf = (df.sample_weight / df.sample_weight.sum()).values.cumsum()
+            cdf /= cdf[-1]
+            hh_ids[rows] = df[household_id_col].values[cdf.searchsorted(rands[rows], side='right')]
+
+        runs = runs[geography_cols].iloc[run_positions].reset_index(drop=True)
+        runs[household_id_col] = hh_ids
+        runs[COUNT_COL] = 1
+
+    runs = household_runs(runs, geography_cols + [household_id_col])
 
     append = inject.get_step_arg('append', False)
     replace = inject.get_step_arg('replace', False)
@@ -98,24 +110,51 @@ def expand_households():
 
     if append or replace:
         t = inject.get_table('expanded_household_ids').to_frame()
-        prev_hhs = len(t.index)
-        added_hhs = len(expanded_weights.index)
+        prev_hhs = t[COUNT_COL].sum()
+        added_hhs = runs[COUNT_COL].sum()
 
         if replace:
             # FIXME - should really get from crosswalk table?
-            low_ids_to_replace = expanded_weights[low_geography].unique()
+            low_ids_to_replace = runs[low_geography].unique()
             t = t[~t[low_geography].isin(low_ids_to_replace)]
 
-        expanded_weights = pd.concat([t, expanded_weights], ignore_index=True)
+        dropped_hhs = prev_hhs - t[COUNT_COL].sum()
+
+        # sort this so results will be consistent whether single or multiprocessing,
+        # GROUP_BY_INCIDENCE_SIGNATURE, etc...
+        runs = household_runs(pd.concat([t, runs], ignore_index=True), geography_cols + [household_id_col])
 
-        dropped_hhs = prev_hhs - len(t.index)
-        final_hhs = len(expanded_weights.index)
+        final_hhs = runs[COUNT_COL].sum()
         op = 'append' if append else 'replace'
         logger.info("expand_households op: %s prev hh count %s dropped %s added %s final %s" %
                     (op, prev_hhs, dropped_hhs, added_hhs, final_hhs))
 
-    # sort this so results will be consistent whether single or multiprocessing, GROUP_BY_INCIDENCE_SIGNATURE, etc...
-    expanded_weights = expanded_weights.sort_values(geography_cols + [household_id_col])
-
     repop = inject.get_step_arg('repop', default=False)
-    inject.add_table('expanded_household_ids', expanded_weights, replace=repop)
+    inject.add_table('expanded_household_ids', runs, replace=repop)
+
+
+def write_expanded_household_ids():
+    """
+    Write expanded_household_ids output table csv file (if output_tables settings include it)
+    with one row per synthetic household, expanding the pipeline table's runs a chunk at a time.
+
+    Called after write_tables (which writes the runs as they are stored) to replace its file.
+    """
+
+    table_name = 'expanded_household_ids'
+    output_settings = output_tables_settings(table_name)
+    if output_settings is None or output_settings.get('h5_store', False):
+        return
+
+    runs = pipeline.get_table(table_name)
+    if COUNT_COL not in runs.columns:
+        # e.g. empty table for NO_INTEGERIZATION_EVER
+        return
+
+    prefix = output_settings.get('prefix', 'final_')
+    file_path = config.output_file_path('%s%s.csv' % (prefix, table_name))
+    logger.info("writing %s synthetic households to %s" % (runs[COUNT_COL].sum(), file_path))
+
+    expand_runs(runs.iloc[:0]).to_csv(file_path, index=False)
+    for expanded_df in iter_expanded(runs):
+        expanded_df.to_csv(file_path, index=False, header=False, mode='a')
@@ -14,12 +14,18 @@ from ..balancer import do_balancing
 from .helper import get_control_table
 from .helper import weight_table_name
 from .helper import get_weight_table
+from .helper import table_frame
+from .helper import get_seed_incidence
+from .helper import get_geography_hierarchy
+from ..performance import profile
+from ..performance import profile_step
 
 
 logger = logging.getLogger(__name__)
 
 
 @inject.step()
+@profile_step
 def final_seed_balancing(settings, crosswalk, control_spec, incidence_table):
     """
     Balance the household weights for each of the seed geographies (independently)
@@ -42,9 +48,9 @@ def final_seed_balancing(settings, crosswalk, control_spec, incidence_table):
 
     """
 
-    crosswalk_df = crosswalk.to_frame()
-    incidence_df = incidence_table.to_frame()
-    control_spec = control_spec.to_frame()
+    hierarchy = get_geography_hierarchy()
+    incidence_df = table_frame(incidence_table)
+    control_spec = table_frame(control_spec)
 
     seed_geography = settings.get('seed_geography')
     seed_weight_table_name = weight_table_name(seed_geography)
@@ -76,23 +82,24 @@ def final_seed_balancing(settings, crosswalk, control_spec, incidence_table):
     # run balancer for each seed geography
     weight_list = []
 
-    seed_ids = crosswalk_df[seed_geography].unique()
+    seed_ids = hierarchy.zone_ids[seed_geography]
     for seed_id in seed_ids:
 
         logger.info("final_seed_balancing seed id %s" % seed_id)
 
-        seed_incidence_df = incidence_df[incidence_df[seed_geography] == seed_id]
-
-        status, weights_df, controls_df = do_balancing(
-            control_spec=control_spec,
-            total_hh_control_col=total_hh_control_col,
-            max_expansion_factor=max_expansion_factor,
-            min_expansion_factor=min_expansion_factor,
-            absolute_lower_bound=absolute_lower_bound,
-            absolute_upper_bound=absolute_upper_bound,
-            incidence_df=seed_incidence_df,
-            control_totals=seed_controls_df.loc[seed_id],
-            initial_weights=seed_incidence_df['sample_weight'])
+        seed_incidence_df = get_seed_incidence(incidence_df, seed_id)
+
+        with profile(geography=seed_geography, zone_id=seed_id, phase='balance'):
+            status, weights_df, controls_df = do_balancing(
+                control_spec=control_spec,
+                total_hh_control_col=total_hh_control_col,
+                max_expansion_factor=max_expansion_factor,
+                min_expansion_factor=min_expansion_factor,
+                absolute_lower_bound=absolute_lower_bound,
+                absolute_upper_bound=absolute_upper_bound,
+                incidence_df=seed_incidence_df,
+                control_totals=seed_controls_df.loc[seed_id],
+                initial_weights=seed_incidence_df['sample_weight'])
 
         logger.info("seed_balancer status: %s" % status)
         if not status['converged']:
@@ -3,8 +3,175 @@
 
 import logging
 
-from activitysim.core import pipeline
+import numpy as np
+import orca
+import pandas as pd
+
+from activitysim.core import config
 from activitysim.core import inject
+from activitysim.core import pipeline
+from activitysim.core.config import setting
+
+from ..compaction import compact_incidence_table
+from ..geography_hierarchy import GeographyHierarchy
+from ..seed_partitions import SeedPartitions
+from ..shared_tables import SharedTables
+
+
+# cached frames of pipeline tables: {table_name: (table_key, frame)}
+_FRAMES = {}
+
+# cached geography hierarchy: (crosswalk table_key, GeographyHierarchy)
+_HIERARCHY = [None, None]
+
+
+def table_key(table_name):
+    """
+    Identify the current contents of an orca dataframe table: the wrapped dataframe and the
+    series registered as extra columns. inject.add_table, pipeline.replace_table and
+    inject.add_column all register new objects, so the key changes whenever the table does.
+
+    Returns None for tables whose frames can't be cached (function tables or computed columns)
+    """
+
+    table = orca.get_table(table_name)
+    if not isinstance(table, orca.DataFrameWrapper):
+        return None
+
+    columns = [orca.get_raw_column(table_name, c) for c in orca.list_columns_for_table(table_name)]
+    if not all(isinstance(c, orca.orca._SeriesWrapper) for c in columns):
+        return None
+
+    return (table.local, ) + tuple(columns)
+
+
+def same_table_key(key, other_key):
+    return key is not None and other_key is not None and len(key) == len(other_key) and \
+        all(a is b for a, b in zip(key, other_key))
+
+
+def read_only_frame(df):
+    """
+    Frame with df's columns as views of its column arrays (one block per column, like the
+    memory-mapped shared tables), so writing values in place raises ValueError rather than
+    modifying df
+
+    As for shared tables, only numeric and boolean columns are read-only, as some pandas
+    operations (e.g. comparisons) can't read read-only object arrays
+    """
+
+    columns = {}
+    for i in range(len(df.columns)):
+        values = df.iloc[:, i].values
+        if isinstance(values, np.ndarray) and values.dtype != object:
+            values = values.view()
+            values.flags.writeable = False
+        columns[i] = values
+
+    # copy=False leaves each column in its own block
+    frame = pd.DataFrame(columns, index=df.index, copy=False)
+    frame.columns = df.columns
+
+    return frame
+
+
+def table_frame(table):
+    """
+    Read-only dataframe of a pipeline table, cached until the table is replaced or columns
+    are added to it, so that repeated reads within and across steps don't copy the table.
+
+    Unlike orca's to_frame, the returned frame shares its data with the pipeline table:
+    callers may add or replace columns (which only affects their shallow copy), but its
+    numeric columns are read-only, so modifying their values in place raises ValueError.
+
+    Pipeline stubs of tables shared by the share_tables step are resolved to the
+    (memory-mapped) shared table.
+
+    Parameters
+    ----------
+    table : str or orca table wrapper
+
+    Returns
+    -------
+    pandas.DataFrame
+    """
+
+    table_name = table if isinstance(table, str) else table.name
+
+    # don't hold on to frames of tables that have since been replaced
+    for name, (cached_key, _) in list(_FRAMES.items()):
+        if not orca.is_table(name) or not same_table_key(cached_key, table_key(name)):
+            del _FRAMES[name]
+
+    key = table_key(table_name)
+    if key is None:
+        return orca.get_table(table_name).to_frame()
+
+    if table_name not in _FRAMES:
+
+        frame = key[0]
+        if shared_tables().is_stub(table_name, frame):
+            frame = shared_tables().read(table_name, frame)
+
+        extra_columns = key[1:]
+        if extra_columns:
+            frame = frame.copy(deep=False)
+            for name in orca.list_columns_for_table(table_name):
+                frame[name] = orca.get_raw_column(table_name, name)()
+
+        _FRAMES[table_name] = (key, read_only_frame(frame))
+
+    return _FRAMES[table_name][1].copy(deep=False)
+
+
+def clear_table_frames():
+    """
+    Drop cached table frames and geography hierarchy
+    """
+
+    _FRAMES.clear()
+    _HIERARCHY[:] = [None, None]
+
+
+activitysim_close_pipeline = pipeline.close_pipeline
+
+
+def close_pipeline():
+    """
+    Close pipeline as activitysim does, and drop cached frames of its tables
+    """
+
+    activitysim_close_pipeline()
+    clear_table_frames()
+
+
+def install():
+    """
+    Have activitysim pipeline drop cached table frames when it is closed
+    (activitysim has no extension point for closing the pipeline)
+    """
+
+    pipeline.close_pipeline = close_pipeline
+
+
+def get_geography_hierarchy():
+    """
+    GeographyHierarchy index of the crosswalk table, cached until the crosswalk is replaced
+
+    Returns
+    -------
+    GeographyHierarchy
+    """
+
+    geographies = setting('geographies')
+
+    key = table_key('crosswalk')
+    cached_key, hierarchy = _HIERARCHY
+    if not same_table_key(cached_key, key) or hierarchy.geographies != geographies:
+        hierarchy = GeographyHierarchy(table_frame('crosswalk'), geographies)
+        _HIERARCHY[:] = [key, hierarchy]
+
+    return hierarchy
 
 
 def control_table_name(geography):
@@ -12,12 +179,12 @@ def control_table_name(geography):
 
 
 def get_control_table(geography):
-    return pipeline.get_table(control_table_name(geography))
+    return table_frame(control_table_name(geography))
 
 
 def get_control_data_table(geography):
     control_data_table_name = '%s_control_data' % geography
-    return pipeline.get_table(control_data_table_name)
+    return table_frame(control_data_table_name)
 
 
 def weight_table_name(geography, sparse=False):
@@ -29,7 +196,105 @@ def weight_table_name(geography, sparse=False):
 
 def get_weight_table(geography, sparse=False):
     name = weight_table_name(geography, sparse)
-    weight_table = inject.get_table(name, default=None)
-    if weight_table is not None:
-        weight_table = weight_table.to_frame()
-    return weight_table
+    if not orca.is_table(name):
+        return None
+    return table_frame(name)
+
+
+def seed_partitions(table_name):
+    """
+    SeedPartitions of a table if PARTITION_SEED_DATA setting is enabled, otherwise None
+    """
+
+    if not setting('PARTITION_SEED_DATA', False):
+        return None
+
+    file_name = setting('seed_partitions_file_name', 'seed_partitions.h5')
+    return SeedPartitions(config.output_file_path(file_name), table_name)
+
+
+def add_incidence_table(incidence_df, control_spec, replace=False):
+    """
+    Add (or replace) incidence_table pipeline table
+
+    If PARTITION_SEED_DATA setting is enabled, the full incidence table is stored partitioned
+    by seed zone, and the pipeline table only has the non-control columns (seed and meta
+    geography and sample_weight) of its rows, so that steps need only read the control
+    columns of one seed zone at a time (see get_seed_incidence). This reduces the size of
+    incidence_table checkpoints and of the incidence steps hold in memory, but not peak
+    memory, as the caller has already built the whole incidence table (and households and
+    persons remain whole pipeline tables).
+
+    If COMPACT_DTYPES setting is enabled, control columns are downcast (usually to int8)
+    """
+
+    if setting('COMPACT_DTYPES', False):
+        incidence_df = compact_incidence_table(incidence_df, control_spec)
+
+    partitions = seed_partitions('incidence_table')
+    if partitions is not None:
+        partitions.write(incidence_df, setting('seed_geography'))
+        incidence_df = incidence_df.drop(columns=control_spec.target)
+
+    if replace:
+        pipeline.replace_table('incidence_table', incidence_df)
+    else:
+        inject.add_table('incidence_table', incidence_df)
+
+
+def shared_tables():
+    """
+    SharedTables store (in the output dir) of tables shared by the share_tables step
+    """
+
+    dir_name = setting('shared_tables_dir_name', 'shared_tables')
+    return SharedTables(config.output_file_path(dir_name))
+
+
+def output_tables_settings(table_name):
+    """
+    output_tables settings if write_tables writes table_name (as for activitysim write_tables,
+    a missing tables list means include all tables), otherwise None
+    """
+
+    output_tables_settings = setting('output_tables')
+    if output_tables_settings is None:
+        return None
+
+    action = output_tables_settings.get('action')
+    tables = output_tables_settings.get('tables')
+    if tables is not None:
+        tables = [t if isinstance(t, str) else t['tablename'] for t in tables]
+
+    if action == 'include':
+        include = tables is None or table_name in tables
+    else:
+        include = table_name not in tables
+
+    if not include or table_name not in pipeline.registered_tables():
+        return None
+
+    return output_tables_settings
+
+
+def get_seed_incidence(incidence_df, seed_id):
+    """
+    Incidence table rows (with all columns) for a seed zone
+
+    Parameters
+    ----------
+    incidence_df : pandas.DataFrame
+        incidence_table pipeline table frame
+    seed_id : seed zone id
+
+    Returns
+    -------
+    pandas.DataFrame
+    """
+
+    partitions = seed_partitions('incidence_table')
+    if partitions is not None:
+        return partitions.read(seed_id)
+
+    seed_geography = setting('seed_geography')
+    return incidence_df[incidence_df[seed_geography] == seed_id]
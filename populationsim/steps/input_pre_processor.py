@@ -10,11 +10,15 @@ import numpy as np
 from activitysim.core import inject
 from activitysim.core import config
 from activitysim.core import input
+from activitysim.core.config import setting
+from ..compaction import compact_table
+from ..performance import profile_step
 
 logger = logging.getLogger(__name__)
 
 
 @inject.step()
+@profile_step
 def input_pre_processor():
     """
     Read input text files and save them as pipeline tables for use in subsequent steps.
@@ -46,6 +50,13 @@ def input_pre_processor():
     +--------------+----------------------------------------------------------+
     | drop_columns | list of column names of columns to drop                  |
     +--------------+----------------------------------------------------------+
+    | compact      | False to not downcast integer columns (COMPACT_DTYPES)   |
+    +--------------+----------------------------------------------------------+
+
+    If COMPACT_DTYPES setting is enabled, zone id columns of tables are downcast to int32 (if
+    their ids fit), as are integer columns listed in a table's compact_columns to the smallest
+    dtype that holds their values, so that tables take less memory and are faster to checkpoint
+    (see compaction.compact_table).
 
     """
 
@@ -61,6 +72,10 @@ def input_pre_processor():
 
         tablename = table_info.get('tablename')
         df = input.read_from_table_info(table_info)
+
+        if setting('COMPACT_DTYPES', False) and table_info.get('compact', True):
+            df = compact_table(df, tablename, table_info.get('compact_columns'))
+
         logger.info('registering table %s' % tablename)
 
         # add (or replace) pipeline table
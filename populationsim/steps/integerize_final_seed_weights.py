@@ -13,12 +13,18 @@ from ..integerizer import do_integerizing
 from .helper import get_control_table
 from .helper import weight_table_name
 from .helper import get_weight_table
+from .helper import table_frame
+from .helper import get_seed_incidence
+from .helper import get_geography_hierarchy
+from ..performance import profile
+from ..performance import profile_step
 from activitysim.core.config import setting
 
 logger = logging.getLogger(__name__)
 
 
 @inject.step()
+@profile_step
 def integerize_final_seed_weights(settings, crosswalk, control_spec, incidence_table):
     """
     Final balancing for each seed (puma) zone with aggregated low and mid-level controls and
@@ -42,9 +48,9 @@ def integerize_final_seed_weights(settings, crosswalk, control_spec, incidence_t
         logger.warning("skipping integerize_final_seed_weights: NO_INTEGERIZATION_EVER")
         return
 
-    crosswalk_df = crosswalk.to_frame()
-    incidence_df = incidence_table.to_frame()
-    control_spec = control_spec.to_frame()
+    hierarchy = get_geography_hierarchy()
+    incidence_df = table_frame(incidence_table)
+    control_spec = table_frame(control_spec)
 
     seed_geography = settings.get('seed_geography')
     seed_controls_df = get_control_table(seed_geography)
@@ -61,27 +67,28 @@ def integerize_final_seed_weights(settings, crosswalk, control_spec, incidence_t
     # run balancer for each seed geography
     weight_list = []
 
-    seed_ids = crosswalk_df[seed_geography].unique()
+    seed_ids = hierarchy.zone_ids[seed_geography]
     for seed_id in seed_ids:
 
         logger.info("integerize_final_seed_weights seed id %s" % seed_id)
 
         # slice incidence rows for this seed geography
-        seed_incidence = incidence_df[incidence_df[seed_geography] == seed_id]
+        seed_incidence = get_seed_incidence(incidence_df, seed_id)
 
         balanced_seed_weights = \
             seed_weights_df.loc[seed_weights_df[seed_geography] == seed_id, 'balanced_weight']
 
         trace_label = "%s_%s" % (seed_geography, seed_id)
 
-        integer_weights, status = do_integerizing(
-            trace_label=trace_label,
-            control_spec=control_spec,
-            control_totals=seed_controls_df.loc[seed_id],
-            incidence_table=seed_incidence[control_cols],
-            float_weights=balanced_seed_weights,
-            total_hh_control_col=total_hh_control_col
-        )
+        with profile(geography=seed_geography, zone_id=seed_id, phase='integerize'):
+            integer_weights, status = do_integerizing(
+                trace_label=trace_label,
+                control_spec=control_spec,
+                control_totals=seed_controls_df.loc[seed_id],
+                incidence_table=seed_incidence[control_cols],
+                float_weights=balanced_seed_weights,
+                total_hh_control_col=total_hh_control_col
+            )
 
         weight_list.append(integer_weights)
 
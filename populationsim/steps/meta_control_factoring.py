@@ -13,6 +13,10 @@ from activitysim.core import inject
 from .helper import get_control_table
 from .helper import control_table_name
 from .helper import get_weight_table
+from .helper import table_frame
+from .helper import get_seed_incidence
+from .helper import get_geography_hierarchy
+from ..performance import profile_step
 
 logger = logging.getLogger(__name__)
 
@@ -25,6 +29,7 @@ def dump_table(table_name, table):
 
 
 @inject.step()
+@profile_step
 def meta_control_factoring(settings, control_spec, incidence_table):
     """
     Apply simple factoring to summed household fractional weights based on original
@@ -46,8 +51,9 @@ def meta_control_factoring(settings, control_spec, incidence_table):
 
     # FIXME - if there is only one seed zone in the meta zone, just copy meta control values?
 
-    incidence_df = incidence_table.to_frame()
-    control_spec = control_spec.to_frame()
+    hierarchy = get_geography_hierarchy()
+    incidence_df = table_frame(incidence_table)
+    control_spec = table_frame(control_spec)
 
     geographies = settings.get('geographies')
     seed_geography = settings.get('seed_geography')
@@ -74,17 +80,23 @@ def meta_control_factoring(settings, control_spec, incidence_table):
     seed_weights_df = get_weight_table(seed_geography)
     assert len(incidence_df.index) == len(seed_weights_df.index)
 
-    # expand person weights by incidence (incidnece will simply be 1 for household targets)
-    hh_level_weights = incidence_df[[seed_geography, meta_geography]].copy()
-    for target in meta_control_targets:
-        hh_level_weights[target] = \
-            incidence_df[target] * seed_weights_df['preliminary_balanced_weight']
+    # weights of meta targets at seed level (summed one seed zone at a time)
+    factored_seed_weights = []
+    for seed_id in hierarchy.zone_ids[seed_geography]:
+
+        seed_incidence_df = get_seed_incidence(incidence_df, seed_id)
+        seed_weights = seed_weights_df['preliminary_balanced_weight'].reindex(seed_incidence_df.index)
+
+        # expand person weights by incidence (incidnece will simply be 1 for household targets)
+        hh_level_weights = seed_incidence_df[[seed_geography, meta_geography]].copy()
+        for target in meta_control_targets:
+            hh_level_weights[target] = seed_incidence_df[target] * seed_weights
 
-    dump_table("hh_level_weights", hh_level_weights)
+        factored_seed_weights.append(
+            hh_level_weights.groupby([seed_geography, meta_geography], as_index=False).sum())
 
-    # weights of meta targets at seed level
-    factored_seed_weights = \
-        hh_level_weights.groupby([seed_geography, meta_geography], as_index=False).sum()
+    factored_seed_weights = pd.concat(factored_seed_weights)\
+        .sort_values([seed_geography, meta_geography], kind='stable')
     factored_seed_weights.set_index(seed_geography, inplace=True)
     dump_table("factored_seed_weights", factored_seed_weights)
 
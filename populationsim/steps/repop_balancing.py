@@ -12,20 +12,30 @@ from activitysim.core.config import setting
 from .helper import get_control_table
 from .helper import weight_table_name
 from .helper import get_weight_table
+from .helper import table_frame
+from .helper import get_seed_incidence
+from .helper import get_geography_hierarchy
 
-from ..balancer import do_balancing
+from ..balancer import do_multi_balancing
 from ..integerizer import do_integerizing
+from ..performance import profile
+from ..performance import profile_step
 
 
 logger = logging.getLogger(__name__)
 
 
 @inject.step()
+@profile_step
 def repop_balancing(settings, crosswalk, control_spec, incidence_table):
     """
 
     Balance and integerize all zones at a lowest geographic level.
 
+    The low zones of each seed zone share the seed zone's incidence table,
+    so they are balanced together (see balancer.do_multi_balancing) and then
+    integerized one by one.
+
 
     Creates a weight table for the repop zones target geography
     with float 'balanced_weight' and 'integer_weight' columns.
@@ -38,9 +48,9 @@ def repop_balancing(settings, crosswalk, control_spec, incidence_table):
     incidence_table : pipeline table
     """
 
-    crosswalk_df = crosswalk.to_frame()
-    incidence_df = incidence_table.to_frame()
-    control_spec = control_spec.to_frame()
+    hierarchy = get_geography_hierarchy()
+    incidence_df = table_frame(incidence_table)
+    control_spec = table_frame(control_spec)
 
     geographies = settings['geographies']
     low_geography = geographies[-1]
@@ -66,13 +76,12 @@ def repop_balancing(settings, crosswalk, control_spec, incidence_table):
     # run balancer for each low geography
     low_weight_list = []
 
-    seed_ids = crosswalk_df[seed_geography].unique()
+    seed_ids = hierarchy.zone_ids[seed_geography]
     for seed_id in seed_ids:
 
         logger.info("initial_seed_balancing seed id %s" % seed_id)
 
-        seed_incidence_df = incidence_df[incidence_df[seed_geography] == seed_id]
-        seed_crosswalk_df = crosswalk_df[crosswalk_df[seed_geography] == seed_id]
+        seed_incidence_df = get_seed_incidence(incidence_df, seed_id)
 
         # initial seed weights in series indexed by hh id
         seed_weights_df = all_seed_weights_df[all_seed_weights_df[seed_geography] == seed_id]
@@ -81,24 +90,19 @@ def repop_balancing(settings, crosswalk, control_spec, incidence_table):
         # number of hh in seed zone (for scaling low zone weights)
         seed_zone_hh_count = seed_controls_df[total_hh_control_col].loc[seed_id]
 
-        low_ids = seed_crosswalk_df[low_geography].unique()
-        for low_id in low_ids:
-
-            trace_label = "%s_%s_%s_%s" % (seed_geography, seed_id, low_geography, low_id)
-            logger.info("balance and integerize %s" % trace_label)
-
-            # weights table for this zone with household_id index and low_geography column
-            zone_weights_df = pd.DataFrame(index=seed_weights_df.index)
-            zone_weights_df[low_geography] = low_id
+        low_ids = hierarchy.sub_zone_ids(seed_geography, seed_id, low_geography)
 
-            # scale seed weights by relative hh counts
-            # it doesn't makes sense to repop balance with integer weights
-            low_zone_hh_count = low_controls_df[total_hh_control_col].loc[low_id]
-            scaling_factor = float(low_zone_hh_count)/seed_zone_hh_count
-            initial_weights = seed_weights_df['balanced_weight'] * scaling_factor
+        # scale seed weights by relative hh counts
+        # it doesn't makes sense to repop balance with integer weights
+        low_zone_hh_counts = low_controls_df[total_hh_control_col].loc[low_ids]
+        scaling_factors = low_zone_hh_counts.astype(float) / seed_zone_hh_count
+        initial_weights = pd.DataFrame(
+            seed_weights_df['balanced_weight'].values[:, None] * scaling_factors.values,
+            index=seed_weights_df.index, columns=low_ids)
 
-            # - balance
-            status, weights_df, controls_df = do_balancing(
+        # - balance all low zones in seed zone together (they share seed_incidence_df)
+        with profile(geography=seed_geography, zone_id=seed_id, phase='balance'):
+            status_df, balanced_weights_df = do_multi_balancing(
                 control_spec=low_control_spec,
                 total_hh_control_col=total_hh_control_col,
                 max_expansion_factor=max_expansion_factor,
@@ -106,23 +110,33 @@ def repop_balancing(settings, crosswalk, control_spec, incidence_table):
                 absolute_upper_bound=absolute_upper_bound,
                 absolute_lower_bound=absolute_lower_bound,
                 incidence_df=seed_incidence_df,
-                control_totals=low_controls_df.loc[low_id],
+                control_totals=low_controls_df.loc[low_ids, low_control_spec.target],
                 initial_weights=initial_weights)
 
+        for low_id in low_ids:
+
+            trace_label = "%s_%s_%s_%s" % (seed_geography, seed_id, low_geography, low_id)
+            logger.info("integerize %s" % trace_label)
+
+            status = status_df.loc[low_id].to_dict()
             logger.info("repop_balancing balancing %s status: %s" % (trace_label, status))
             if not status['converged']:
                 raise RuntimeError("repop_balancing for %s did not converge" % trace_label)
 
-            zone_weights_df['balanced_weight'] = weights_df['final']
+            # weights table for this zone with household_id index and low_geography column
+            zone_weights_df = pd.DataFrame(index=seed_weights_df.index)
+            zone_weights_df[low_geography] = low_id
+            zone_weights_df['balanced_weight'] = balanced_weights_df[low_id]
 
             # - integerize
-            integer_weights, status = do_integerizing(
-                trace_label=trace_label,
-                control_spec=control_spec,
-                control_totals=low_controls_df.loc[low_id],
-                incidence_table=seed_incidence_df,
-                float_weights=weights_df['final'],
-                total_hh_control_col=total_hh_control_col)
+            with profile(geography=low_geography, zone_id=low_id, phase='integerize'):
+                integer_weights, status = do_integerizing(
+                    trace_label=trace_label,
+                    control_spec=control_spec,
+                    control_totals=low_controls_df.loc[low_id],
+                    incidence_table=seed_incidence_df,
+                    float_weights=balanced_weights_df[low_id],
+                    total_hh_control_col=total_hh_control_col)
 
             logger.info("repop_balancing integerizing status: %s" % status)
 
@@ -133,16 +147,18 @@ def repop_balancing(settings, crosswalk, control_spec, incidence_table):
             logger.info("Total integerized weights for %s = %s" %
                         (trace_label, zone_weights_df['integer_weight'].sum()))
 
-            low_weight_list.append(zone_weights_df)
+            # only keep households with nonzero weights (as for sub_balancing weight tables)
+            nonzero = (zone_weights_df['balanced_weight'] != 0) | (zone_weights_df['integer_weight'] != 0)
+            low_weight_list.append(zone_weights_df[nonzero])
 
     # concat all low geography zone level results
     low_weights_df = pd.concat(low_weight_list).reset_index()
 
     # add higher level geography id columns to facilitate summaries
-    crosswalk_df = crosswalk_df.set_index(low_geography)\
+    ancestors_df = hierarchy.ancestors(low_geography)\
         .loc[low_weights_df[low_geography]]\
         .reset_index(drop=True)
-    low_weights_df = pd.concat([low_weights_df, crosswalk_df], axis=1)
+    low_weights_df = pd.concat([low_weights_df, ancestors_df], axis=1)
 
     inject.add_table(weight_table_name(low_geography),
                      low_weights_df, replace=True)
@@ -18,6 +18,10 @@ from ..assign import assign_variable
 from .helper import control_table_name
 from .helper import get_control_table
 from .helper import get_control_data_table
+from .helper import get_geography_hierarchy
+from .helper import add_incidence_table
+from .helper import table_frame
+from ..performance import profile_step
 
 from activitysim.core.config import setting
 
@@ -89,7 +93,7 @@ def build_incidence_table(control_spec, households_df, persons_df, crosswalk_df)
     return incidence_table
 
 
-def add_geography_columns(incidence_table, households_df, crosswalk_df):
+def add_geography_columns(incidence_table, households_df, hierarchy):
     """
     Add seed and meta geography columns to incidence_table
 
@@ -97,7 +101,7 @@ def add_geography_columns(incidence_table, households_df, crosswalk_df):
     ----------
     incidence_table
     households_df
-    crosswalk_df
+    hierarchy : GeographyHierarchy
 
     Returns
     -------
@@ -113,14 +117,13 @@ def add_geography_columns(incidence_table, households_df, crosswalk_df):
 
     # add meta column to incidence table (unless it's already there)
     if seed_geography != meta_geography:
-        tmp = crosswalk_df[list({seed_geography, meta_geography})]
-        seed_to_meta = tmp.groupby(seed_geography, as_index=True).min()[meta_geography]
+        seed_to_meta = hierarchy.ancestor_map(seed_geography, meta_geography)
         incidence_table[meta_geography] = incidence_table[seed_geography].map(seed_to_meta)
 
     return incidence_table
 
 
-def build_control_table(geo, control_spec, crosswalk_df):
+def build_control_table(geo, control_spec, hierarchy):
 
     # control_geographies is list with target geography and the geographies beneath it
     control_geographies = setting('geographies')
@@ -157,7 +160,7 @@ def build_control_table(geo, control_spec, crosswalk_df):
             # add geo_col to control_data table
             if geo not in control_data_df.columns:
                 # create series mapping sub_geo id to geo id
-                sub_to_geog = crosswalk_df[[g, geo]].groupby(g, as_index=True).min()[geo]
+                sub_to_geog = hierarchy.ancestor_map(g, geo)
 
                 control_data_df[geo] = control_data_df[g].map(sub_to_geog)
 
@@ -244,7 +247,7 @@ def build_grouped_incidence_table(incidence_table, control_spec, seed_geography)
     return group_incidence_table, household_groups
 
 
-def filter_households(households_df, persons_df, crosswalk_df):
+def filter_households(households_df, persons_df, hierarchy):
     """
     Filter households and persons tables, removing zero weight households
     and any households not in seed zones.
@@ -258,7 +261,7 @@ def filter_households(households_df, persons_df, crosswalk_df):
 
     # remove any households not in seed zones
     seed_geography = setting('seed_geography')
-    seed_ids = crosswalk_df[seed_geography].unique()
+    seed_ids = hierarchy.zone_ids[seed_geography]
 
     rows_in_seed_zones = households_df[seed_geography].isin(seed_ids)
     if rows_in_seed_zones.any():
@@ -270,6 +273,7 @@ def filter_households(households_df, persons_df, crosswalk_df):
 
 
 @inject.step()
+@profile_step
 def setup_data_structures(settings, households, persons):
     """
     Setup geographic correspondence (crosswalk), control sets, and incidence tables.
@@ -286,6 +290,10 @@ def setup_data_structures(settings, households, persons):
     household group ids and and additional household_groups table is created mapping hh group ids
     to actual hh_ids.
 
+    If PARTITION_SEED_DATA setting is enabled, the incidence table control columns are stored
+    partitioned by seed zone outside the pipeline (see helper.add_incidence_table). The whole
+    incidence table is still built here first.
+
     Parameters
     ----------
     settings: dict
@@ -314,6 +322,7 @@ def setup_data_structures(settings, households, persons):
 
     crosswalk_df = build_crosswalk_table()
     inject.add_table('crosswalk', crosswalk_df)
+    hierarchy = get_geography_hierarchy()
 
     slice_geography = settings.get('slice_geography', None)
     if slice_geography:
@@ -321,8 +330,7 @@ def setup_data_structures(settings, households, persons):
         assert slice_geography in crosswalk_df.columns
 
         # only want rows for slice_geography and higher
-        slice_geographies = geographies[:geographies.index(slice_geography) + 1]
-        slice_table = crosswalk_df[slice_geographies].groupby(slice_geography).max()
+        slice_table = hierarchy.ancestors(slice_geography).sort_index()
         # it is convenient to have slice_geography column in table as well as index
         slice_table[slice_geography] = slice_table.index
         inject.add_table(f"slice_crosswalk", slice_table)
@@ -331,17 +339,17 @@ def setup_data_structures(settings, households, persons):
     inject.add_table('control_spec', control_spec)
 
     for g in geographies:
-        controls = build_control_table(g, control_spec, crosswalk_df)
+        controls = build_control_table(g, control_spec, hierarchy)
         inject.add_table(control_table_name(g), controls)
 
-    households_df, persons_df = filter_households(households_df, persons_df, crosswalk_df)
+    households_df, persons_df = filter_households(households_df, persons_df, hierarchy)
     pipeline.replace_table('households', households_df)
     pipeline.replace_table('persons', persons_df)
 
     incidence_table = \
         build_incidence_table(control_spec, households_df, persons_df, crosswalk_df)
 
-    incidence_table = add_geography_columns(incidence_table, households_df, crosswalk_df)
+    incidence_table = add_geography_columns(incidence_table, households_df, hierarchy)
 
     # add sample_weight col to incidence table
     hh_weight_col = setting('household_weight_col')
@@ -352,12 +360,39 @@ def setup_data_structures(settings, households, persons):
             = build_grouped_incidence_table(incidence_table, control_spec, seed_geography)
 
         inject.add_table('household_groups', household_groups)
-        inject.add_table('incidence_table', group_incidence_table)
+        add_incidence_table(group_incidence_table, control_spec)
     else:
-        inject.add_table('incidence_table', incidence_table)
+        add_incidence_table(incidence_table, control_spec)
 
 
 @inject.step()
+@profile_step
+def setup_control_tables(settings, control_spec):
+    """
+    Rebuild the control tables of all geographies from the control data tables, without
+    rebuilding the incidence table.
+
+    Used by batch scenario runs (see batch.run_batch), which resume from a pipeline with seed
+    data and incidence_table built once by setup_data_structures, after rerunning
+    input_pre_processor to replace the control data tables with the scenario's.
+
+    Parameters
+    ----------
+    settings: dict
+        contents of settings.yaml as dict
+    control_spec: pipeline table
+    """
+
+    hierarchy = get_geography_hierarchy()
+    control_spec = table_frame(control_spec)
+
+    for g in settings['geographies']:
+        controls = build_control_table(g, control_spec, hierarchy)
+        pipeline.replace_table(control_table_name(g), controls)
+
+
+@inject.step()
+@profile_step
 def repop_setup_data_structures(households, persons):
     """
     Setup geographic correspondence (crosswalk), control sets, and incidence tables for repop run.
@@ -387,6 +422,7 @@ def repop_setup_data_structures(households, persons):
     # replace crosswalk table
     crosswalk_df = build_crosswalk_table()
     pipeline.replace_table('crosswalk', crosswalk_df)
+    hierarchy = get_geography_hierarchy()
 
     # replace control_spec
     control_file_name = setting('repop_control_file_name', 'repop_controls.csv')
@@ -404,18 +440,18 @@ def repop_setup_data_structures(households, persons):
     # because the expand_households step has ALREADY created the expanded_household_ids table
     # for the original simulated population. )
 
-    households_df = households.to_frame()
-    persons_df = persons.to_frame()
-    households_df, persons_df = filter_households(households_df, persons_df, crosswalk_df)
+    households_df = table_frame(households)
+    persons_df = table_frame(persons)
+    households_df, persons_df = filter_households(households_df, persons_df, hierarchy)
     incidence_table = build_incidence_table(control_spec, households_df, persons_df, crosswalk_df)
-    incidence_table = add_geography_columns(incidence_table, households_df, crosswalk_df)
+    incidence_table = add_geography_columns(incidence_table, households_df, hierarchy)
     # add sample_weight col to incidence table
     hh_weight_col = setting('household_weight_col')
     incidence_table['sample_weight'] = households_df[hh_weight_col]
 
     # rebuild control tables with only the low level controls (aggregated at higher levels)
     for g in geographies:
-        controls = build_control_table(g, control_spec, crosswalk_df)
+        controls = build_control_table(g, control_spec, hierarchy)
         pipeline.replace_table(control_table_name(g), controls)
 
     if setting('GROUP_BY_INCIDENCE_SIGNATURE') and not setting('NO_INTEGERIZATION_EVER', False):
@@ -423,6 +459,6 @@ def repop_setup_data_structures(households, persons):
             = build_grouped_incidence_table(incidence_table, control_spec, seed_geography)
 
         pipeline.replace_table('household_groups', household_groups)
-        pipeline.replace_table('incidence_table', group_incidence_table)
+        add_incidence_table(group_incidence_table, control_spec, replace=True)
     else:
-        pipeline.replace_table('incidence_table', incidence_table)
+        add_incidence_table(incidence_table, control_spec, replace=True)
@@ -0,0 +1,80 @@
+# PopulationSim
+# See full license in LICENSE.txt.
+
+import logging
+
+from activitysim.core import config
+from activitysim.core import inject
+from activitysim.core import pipeline
+
+from activitysim.core.config import setting
+from .helper import output_tables_settings
+from .helper import shared_tables
+from .helper import table_frame
+from ..performance import profile_step
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SHARED_TABLES = ['incidence_table', 'household_groups', 'households', 'persons']
+
+
+@inject.step()
+@profile_step
+def share_tables():
+    """
+    Move read-only pipeline tables into memory-mapped shared table files in the output dir,
+    leaving a zero-row stub of each table in the pipeline.
+
+    When multiprocessing, tables that aren't sliced are copied into every subprocess's pipeline,
+    and each subprocess loads its own copy of them. Running this step before the first
+    multiprocessed step instead apportions only the stubs, and each subprocess maps the same
+    shared files (which the operating system holds in memory once, however many subprocesses
+    read them), so that the number of subprocesses isn't limited by memory.
+
+    Tables are read through helper.table_frame, which resolves the stubs. Tables replaced by a
+    later step (e.g. by repop_setup_data_structures) are stored in the pipeline as usual.
+
+    The shared_tables setting lists the tables to share (defaults to incidence_table,
+    household_groups, households and persons). Tables that aren't in the pipeline are ignored.
+    """
+
+    store = shared_tables()
+
+    for table_name in setting('shared_tables', DEFAULT_SHARED_TABLES):
+
+        if table_name not in pipeline.registered_tables():
+            logger.info("share_tables: no table %s in pipeline" % table_name)
+            continue
+
+        df = pipeline.get_table(table_name)
+        if store.is_stub(table_name, df):
+            # already shared (e.g. when resuming)
+            continue
+
+        pipeline.replace_table(table_name, store.write(table_name, df))
+
+
+def write_shared_tables():
+    """
+    Write shared tables included in output_tables settings (replacing the empty stubs
+    written by write_tables)
+    """
+
+    store = shared_tables()
+
+    for table_name in setting('shared_tables', DEFAULT_SHARED_TABLES):
+
+        output_settings = output_tables_settings(table_name)
+        if output_settings is None or not store.is_stub(table_name, pipeline.get_table(table_name)):
+            continue
+
+        df = table_frame(table_name)
+        prefix = output_settings.get('prefix', 'final_')
+
+        # as in write_tables
+        if output_settings.get('h5_store', False):
+            file_path = config.output_file_path('%soutput_tables.h5' % prefix)
+            df.to_hdf(file_path, key=table_name, mode='a', format='fixed')
+        else:
+            file_path = config.output_file_path('%s%s.csv' % (prefix, table_name))
+            df.to_csv(file_path, index=df.index.name is not None)
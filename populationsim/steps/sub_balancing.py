@@ -18,8 +18,18 @@ from .helper import control_table_name
 from .helper import get_control_table
 from .helper import weight_table_name
 from .helper import get_weight_table
+from .helper import table_frame
+from .helper import get_seed_incidence
+from .helper import get_geography_hierarchy
 
 from ..multi_integerizer import multi_integerize
+from ..zone_checkpoints import zone_checkpoints
+from ..zone_checkpoints import fingerprint
+from ..zone_checkpoints import results_settings
+from ..spill_buffer import zone_results_buffer
+from ..performance import profile
+from ..performance import set_status
+from ..performance import profile_step
 
 
 logger = logging.getLogger(__name__)
@@ -85,11 +95,15 @@ def balance(
         parent_weights=parent_weights,
         controls=controls,
         sub_control_zones=sub_control_zones,
-        total_hh_control_col=total_hh_control_col
+        total_hh_control_col=total_hh_control_col,
+        max_zones_per_block=setting('MAX_SUB_ZONES_PER_BLOCK', None),
+        group_by_incidence=setting('GROUP_BY_SUB_INCIDENCE_SIGNATURE', True)
     )
 
     status = balancer.balance()
 
+    set_status('converged' if status['converged'] else 'not_converged')
+
     logger.debug("%s %s converged %s iter %s"
                  % (parent_geography, parent_id, status['converged'], status['iter']))
 
@@ -105,7 +119,7 @@ def balance_and_integerize(
         parent_geography,
         parent_id,
         sub_geographies,
-        crosswalk_df,
+        hierarchy,
         ):
     """
 
@@ -127,8 +141,8 @@ def balance_and_integerize(
         parent geography zone id
     sub_geographies : list(str)
         list of subgeographies in descending order
-    crosswalk_df : pandas.Dataframe
-        geo crosswork table sliced to current seed geography
+    hierarchy : GeographyHierarchy
+        geography hierarchy index of crosswalk
 
     Returns
     -------
@@ -139,7 +153,7 @@ def balance_and_integerize(
     sub_geography = sub_geographies[0]
 
     # only want subcontrol rows for current geography geo_id
-    sub_ids = crosswalk_df.loc[crosswalk_df[parent_geography] == parent_id, sub_geography].unique()
+    sub_ids = hierarchy.sub_zone_ids(parent_geography, parent_id, sub_geography)
     # only want sub-control rows for this parent geography
     sub_controls_df = sub_controls_df[sub_controls_df.index.isin(sub_ids)]
 
@@ -157,28 +171,30 @@ def balance_and_integerize(
     sub_control_zone_names = ['%s_%s' % (sub_geography, z) for z in sub_controls_df.index]
     sub_control_zones = pd.Series(sub_control_zone_names, index=sub_controls_df.index)
 
-    balanced_sub_zone_weights = balance(
-        incidence_df=incidence_df,
-        parent_weights=parent_weights,
-        sub_controls_df=sub_controls_df,
-        control_spec=control_spec,
-        total_hh_control_col=total_hh_control_col,
-        parent_geography=parent_geography,
-        parent_id=parent_id,
-        sub_geographies=sub_geographies,
-        sub_control_zones=sub_control_zones
-        )
-
-    integerized_sub_zone_weights_df = multi_integerize(
-        incidence_df=incidence_df,
-        sub_zone_weights=balanced_sub_zone_weights,
-        sub_controls_df=sub_controls_df,
-        control_spec=control_spec,
-        total_hh_control_col=total_hh_control_col,
-        parent_geography=parent_geography,
-        parent_id=parent_id,
-        sub_geography=sub_geography,
-        sub_control_zones=sub_control_zones)
+    with profile(phase='balance'):
+        balanced_sub_zone_weights = balance(
+            incidence_df=incidence_df,
+            parent_weights=parent_weights,
+            sub_controls_df=sub_controls_df,
+            control_spec=control_spec,
+            total_hh_control_col=total_hh_control_col,
+            parent_geography=parent_geography,
+            parent_id=parent_id,
+            sub_geographies=sub_geographies,
+            sub_control_zones=sub_control_zones
+            )
+
+    with profile(phase='integerize'):
+        integerized_sub_zone_weights_df = multi_integerize(
+            incidence_df=incidence_df,
+            sub_zone_weights=balanced_sub_zone_weights,
+            sub_controls_df=sub_controls_df,
+            control_spec=control_spec,
+            total_hh_control_col=total_hh_control_col,
+            parent_geography=parent_geography,
+            parent_id=parent_id,
+            sub_geography=sub_geography,
+            sub_control_zones=sub_control_zones)
 
     integerized_sub_zone_weights_df[parent_geography] = parent_id
 
@@ -186,6 +202,7 @@ def balance_and_integerize(
 
 
 @inject.step()
+@profile_step
 def sub_balancing(settings, crosswalk, control_spec, incidence_table):
     """
     Simul-balance and integerize all zones at a specified geographic level
@@ -215,9 +232,9 @@ def sub_balancing(settings, crosswalk, control_spec, incidence_table):
     # geography is an injected model step arg
     geography = inject.get_step_arg('geography')
 
-    crosswalk_df = crosswalk.to_frame()
-    incidence_df = incidence_table.to_frame()
-    control_spec = control_spec.to_frame()
+    hierarchy = get_geography_hierarchy()
+    incidence_df = table_frame(incidence_table)
+    control_spec = table_frame(control_spec)
 
     geographies = settings.get('geographies')
     seed_geography = settings.get('seed_geography')
@@ -235,67 +252,97 @@ def sub_balancing(settings, crosswalk, control_spec, incidence_table):
     weights_df = get_weight_table(parent_geography)
     assert weights_df is not None
 
-    integer_weights_list = []
-
-    # the incidence table is siloed by seed geography, se we handle each seed zone in turn
-    seed_ids = crosswalk_df[seed_geography].unique()
-    for seed_id in seed_ids:
-
-        # slice incidence and crosswalk tables for this seed zone
-        seed_incidence_df = incidence_df[incidence_df[seed_geography] == seed_id]
-        seed_crosswalk_df = crosswalk_df[crosswalk_df[seed_geography] == seed_id]
-
-        # expects seed geography is siloed by meta_geography
-        # (no seed_id is in more than one meta_geography zone)
-        assert len(seed_crosswalk_df[meta_geography].unique()) == 1
+    # higher level geography ids of each parent zone
+    parent_ancestors_df = hierarchy.ancestors(parent_geography)
 
-        # list of unique parent zone ids in this seed zone
-        # (there will be just one if parent geography is seed)
-        parent_ids = seed_crosswalk_df[parent_geography].unique()
+    # per parent zone results saved as they complete (if ZONE_CHECKPOINTS setting is enabled)
+    # so a rerun after a crash only needs to balance the remaining parent zones
+    checkpoints = zone_checkpoints('sub_balancing_%s' % geography)
+    if checkpoints is not None:
+        inputs_fingerprint = fingerprint(
+            sub_controls_df, control_spec, table_frame(crosswalk), results_settings(settings))
 
-        # only want ones for which there are (non-zero) controls
-        parent_ids = parent_controls_df.index.intersection(parent_ids)
+    # per parent zone results (spilled to disk, or read back from checkpoints, if SPILL_ZONE_RESULTS
+    # setting is enabled)
+    integer_weights_buffer = zone_results_buffer('sub_balancing_%s' % geography, checkpoints)
 
-        num_parent_ids = len(parent_ids)
-        for idx, parent_id in enumerate(parent_ids, start=1):
+    # expects seed geography is siloed by meta_geography
+    # (no seed_id is in more than one meta_geography zone)
+    assert hierarchy.is_nested(seed_geography, meta_geography)
 
-            logger.info(f"balancing {idx}/{num_parent_ids} seed {seed_id}, "
-                        f"{parent_geography} {parent_id}")
-
-            initial_weights = weights_df[weights_df[parent_geography] == parent_id]
-            initial_weights = initial_weights.set_index(settings.get('household_id_col'))
-
-            # using balanced_weight slows down simul and doesn't improve results
-            # (float seeds means no zero-weight households to drop)
-            if NO_INTEGERIZATION_EVER or SUB_BALANCE_WITH_FLOAT_SEED_WEIGHTS:
-                initial_weights = initial_weights['balanced_weight']
-            else:
-                initial_weights = initial_weights['integer_weight']
-
-            assert len(initial_weights.index) == len(seed_incidence_df.index)
-
-            zone_weights_df = balance_and_integerize(
-                incidence_df=seed_incidence_df,
-                parent_weights=initial_weights,
-                sub_controls_df=sub_controls_df,
-                control_spec=control_spec,
-                total_hh_control_col=total_hh_control_col,
-                parent_geography=parent_geography,
-                parent_id=parent_id,
-                sub_geographies=sub_geographies,
-                crosswalk_df=seed_crosswalk_df
-                )
-
-            # add higher level geography id columns to facilitate summaries
-            parent_geography_ids = \
-                crosswalk_df.loc[crosswalk_df[parent_geography] == parent_id, parent_geographies]\
-                .max(axis=0)
-            for z in parent_geography_ids.index:
-                zone_weights_df[z] = parent_geography_ids[z]
-
-            integer_weights_list.append(zone_weights_df)
-
-    integer_weights_df = pd.concat(integer_weights_list)
+    # the incidence table is siloed by seed geography, se we handle each seed zone in turn
+    seed_ids = hierarchy.zone_ids[seed_geography]
+    try:
+        for seed_id in seed_ids:
+
+            # slice incidence table for this seed zone
+            seed_incidence_df = get_seed_incidence(incidence_df, seed_id)
+            if checkpoints is not None:
+                seed_fingerprint = fingerprint(inputs_fingerprint, seed_incidence_df)
+
+            # list of unique parent zone ids in this seed zone
+            # (there will be just one if parent geography is seed)
+            parent_ids = hierarchy.sub_zone_ids(seed_geography, seed_id, parent_geography)
+
+            # only want ones for which there are (non-zero) controls
+            parent_ids = parent_controls_df.index.intersection(parent_ids)
+
+            num_parent_ids = len(parent_ids)
+            for idx, parent_id in enumerate(parent_ids, start=1):
+
+                logger.info(f"balancing {idx}/{num_parent_ids} seed {seed_id}, "
+                            f"{parent_geography} {parent_id}")
+
+                initial_weights = weights_df[weights_df[parent_geography] == parent_id]
+                initial_weights = initial_weights.set_index(settings.get('household_id_col'))
+
+                # using balanced_weight slows down simul and doesn't improve results
+                # (float seeds means no zero-weight households to drop)
+                if NO_INTEGERIZATION_EVER or SUB_BALANCE_WITH_FLOAT_SEED_WEIGHTS:
+                    initial_weights = initial_weights['balanced_weight']
+                else:
+                    initial_weights = initial_weights['integer_weight']
+
+                # sub zone weight tables are sparse (only households with nonzero weights)
+                initial_weights = initial_weights.reindex(seed_incidence_df.index, fill_value=0)
+
+                assert len(initial_weights.index) == len(seed_incidence_df.index)
+
+                if checkpoints is not None:
+                    zone_fingerprint = fingerprint(seed_fingerprint, parent_id, initial_weights)
+                    zone_weights_df = checkpoints.get_zone(parent_id, zone_fingerprint)
+                    if zone_weights_df is not None:
+                        logger.info(f"using checkpointed results for {parent_geography} {parent_id}")
+                        integer_weights_buffer.append(zone_weights_df)
+                        continue
+
+                with profile(geography=parent_geography, zone_id=parent_id, phase='zone'):
+                    zone_weights_df = balance_and_integerize(
+                        incidence_df=seed_incidence_df,
+                        parent_weights=initial_weights,
+                        sub_controls_df=sub_controls_df,
+                        control_spec=control_spec,
+                        total_hh_control_col=total_hh_control_col,
+                        parent_geography=parent_geography,
+                        parent_id=parent_id,
+                        sub_geographies=sub_geographies,
+                        hierarchy=hierarchy
+                        )
+
+                # add higher level geography id columns to facilitate summaries
+                for z in parent_geographies:
+                    zone_weights_df[z] = \
+                        parent_id if z == parent_geography else parent_ancestors_df.at[parent_id, z]
+
+                if checkpoints is not None:
+                    checkpoints.put_zone(parent_id, zone_fingerprint, zone_weights_df)
+
+                integer_weights_buffer.append(zone_weights_df)
+
+        integer_weights_df = integer_weights_buffer.to_frame()
+    finally:
+        # e.g. delete spill files if balancing fails
+        integer_weights_buffer.cleanup()
 
     logger.info(f"adding table {weight_table_name(geography)}")
     inject.add_table(weight_table_name(geography),
@@ -310,3 +357,6 @@ def sub_balancing(settings, crosswalk, control_spec, incidence_table):
         trace_geography_id = settings.get('trace_geography')[geography]
         df = integer_weights_df[integer_weights_df[geography] == trace_geography_id]
         inject.add_table('trace_%s' % weight_table_name(geography), df)
+
+    if checkpoints is not None:
+        checkpoints.remove()
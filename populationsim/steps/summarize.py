@@ -12,6 +12,10 @@ from activitysim.core import inject
 
 from .helper import get_control_table
 from .helper import get_weight_table
+from .helper import table_frame
+from .helper import get_seed_incidence
+from .helper import get_geography_hierarchy
+from ..performance import profile_step
 from activitysim.core.config import setting
 
 logger = logging.getLogger(__name__)
@@ -37,31 +41,39 @@ def out_table(table_name, df):
 
 
 def summarize_geography(geography, weight_col, hh_id_col,
-                        crosswalk_df, results_df, incidence_df):
+                        hierarchy, results_df, incidence_df):
 
     # controls_table for current geography level
     controls_df = get_control_table(geography)
     control_names = controls_df.columns.tolist()
 
     # only want zones from crosswalk for which non-zero control rows exist
-    zone_ids = crosswalk_df[geography].unique()
+    zone_ids = hierarchy.zone_ids[geography]
     zone_ids = controls_df.index.intersection(zone_ids)
 
-    results = []
-    controls = []
-    for zone_id in zone_ids:
+    # zones are nested in seed zones, so we only need one seed zone's incidence at a time
+    seed_geography = setting('seed_geography')
+    zone_results = {}
+    for seed_id in hierarchy.zone_ids[seed_geography]:
+
+        seed_zone_ids = zone_ids.intersection(hierarchy.sub_zone_ids(seed_geography, seed_id, geography))
+        if len(seed_zone_ids) == 0:
+            continue
 
-        zone_controls = controls_df.loc[zone_id].tolist()
-        controls.append(zone_controls)
+        seed_incidence_df = get_seed_incidence(incidence_df, seed_id)
 
-        zone_row_map = results_df[geography] == zone_id
-        zone_weights = results_df[zone_row_map]
+        for zone_id in seed_zone_ids:
 
-        incidence = incidence_df.loc[zone_weights[hh_id_col]]
+            zone_row_map = results_df[geography] == zone_id
+            zone_weights = results_df[zone_row_map]
 
-        weights = zone_weights[weight_col].tolist()
-        x = [(incidence[c] * weights).sum() for c in control_names]
-        results.append(x)
+            incidence = seed_incidence_df.loc[zone_weights[hh_id_col]]
+
+            weights = zone_weights[weight_col].tolist()
+            zone_results[zone_id] = [(incidence[c] * weights).sum() for c in control_names]
+
+    results = [zone_results[zone_id] for zone_id in zone_ids]
+    controls = [controls_df.loc[zone_id].tolist() for zone_id in zone_ids]
 
     controls_df = pd.DataFrame(
         data=np.asanyarray(controls),
@@ -93,7 +105,7 @@ def summarize_geography(geography, weight_col, hh_id_col,
     return summary_df
 
 
-def meta_summary(incidence_df, control_spec, top_geography, top_id, sub_geographies, hh_id_col):
+def meta_summary(incidence_df, control_spec, top_geography, top_id, sub_geographies, hh_id_col, hierarchy):
 
     if setting('NO_INTEGERIZATION_EVER', False):
         seed_weight_cols = ['preliminary_balanced_weight', 'balanced_weight']
@@ -102,7 +114,13 @@ def meta_summary(incidence_df, control_spec, top_geography, top_id, sub_geograph
         seed_weight_cols = ['preliminary_balanced_weight', 'balanced_weight', 'integer_weight']
         sub_weight_cols = ['balanced_weight', 'integer_weight']
 
-    incidence_df = incidence_df[incidence_df[top_geography] == top_id]
+    # incidence of seed zones in top zone
+    seed_geography = setting('seed_geography')
+    seed_ids = hierarchy.sub_zone_ids(top_geography, top_id, seed_geography)
+    if setting('PARTITION_SEED_DATA', False):
+        incidence_df = pd.concat([get_seed_incidence(incidence_df, seed_id) for seed_id in seed_ids])
+    else:
+        incidence_df = incidence_df[incidence_df[top_geography] == top_id]
 
     control_cols = control_spec.target.values
 
@@ -119,7 +137,6 @@ def meta_summary(incidence_df, control_spec, top_geography, top_id, sub_geograph
 
     summary['control_value'] = controls
 
-    seed_geography = setting('seed_geography')
     seed_weights_df = get_weight_table(seed_geography)
 
     for c in seed_weight_cols:
@@ -147,6 +164,7 @@ def meta_summary(incidence_df, control_spec, top_geography, top_id, sub_geograph
 
 
 @inject.step()
+@profile_step
 def summarize(crosswalk, incidence_table, control_spec):
     """
     Write aggregate summary files of controls and weights for all geographic levels to output dir
@@ -164,8 +182,8 @@ def summarize(crosswalk, incidence_table, control_spec):
 
     include_integer_colums = not setting('NO_INTEGERIZATION_EVER', False)
 
-    crosswalk_df = crosswalk.to_frame()
-    incidence_df = incidence_table.to_frame()
+    hierarchy = get_geography_hierarchy()
+    incidence_df = table_frame(incidence_table)
 
     geographies = setting('geographies')
     seed_geography = setting('seed_geography')
@@ -173,11 +191,11 @@ def summarize(crosswalk, incidence_table, control_spec):
     sub_geographies = geographies[geographies.index(seed_geography) + 1:]
     hh_id_col = setting('household_id_col')
 
-    meta_ids = crosswalk_df[meta_geography].unique()
+    meta_ids = hierarchy.zone_ids[meta_geography]
     for meta_id in meta_ids:
         meta_summary_df = \
             meta_summary(incidence_df, control_spec, meta_geography,
-                         meta_id, sub_geographies, hh_id_col)
+                         meta_id, sub_geographies, hh_id_col, hierarchy)
         out_table('%s_%s' % (meta_geography, meta_id), meta_summary_df)
 
     hh_weights_summary = pd.DataFrame(index=incidence_df.index)
@@ -200,21 +218,17 @@ def summarize(crosswalk, incidence_table, control_spec):
         else:
             hh_weight_cols = [hh_id_col, 'balanced_weight']
 
-        hh_weights = weights_df[hh_weight_cols].groupby([hh_id_col]).sum()
+        # weight tables are sparse, so households with no weight in any zone are missing
+        hh_weights = weights_df[hh_weight_cols].groupby([hh_id_col]).sum()\
+            .reindex(incidence_df.index, fill_value=0)
         hh_weights_summary['%s_balanced_weight' % geography] = hh_weights['balanced_weight']
         if include_integer_colums:
             hh_weights_summary['%s_integer_weight' % geography] = hh_weights['integer_weight']
 
         # aggregate to seed level
-        aggegrate_weights = weights_df.groupby([seed_geography, hh_id_col], as_index=False).sum()
-        aggegrate_weights.set_index(hh_id_col, inplace=True)
-
-        if include_integer_colums:
-            aggegrate_weight_cols = [seed_geography, 'balanced_weight', 'integer_weight']
-        else:
-            aggegrate_weight_cols = [seed_geography, 'balanced_weight']
-
-        aggegrate_weights = aggegrate_weights[aggegrate_weight_cols]
+        aggegrate_weights = hh_weights.copy()
+        aggegrate_weights.insert(0, seed_geography, incidence_df[seed_geography])
+        aggegrate_weights = aggegrate_weights.sort_index().sort_values(seed_geography, kind='stable')
         aggegrate_weights['sample_weight'] = incidence_df['sample_weight']
         aggegrate_weights['%s_preliminary_balanced_weight' % seed_geography] = \
             seed_weights_df['preliminary_balanced_weight']
@@ -228,11 +242,11 @@ def summarize(crosswalk, incidence_table, control_spec):
 
         summary_col = 'integer_weight' if include_integer_colums else 'balanced_weight'
         df = summarize_geography(seed_geography, summary_col, hh_id_col,
-                                 crosswalk_df, weights_df, incidence_df)
+                                 hierarchy, weights_df, incidence_df)
         out_table('%s_%s' % (geography, seed_geography,), df)
 
         df = summarize_geography(geography, summary_col, hh_id_col,
-                                 crosswalk_df, weights_df, incidence_df)
+                                 hierarchy, weights_df, incidence_df)
         out_table('%s' % (geography,), df)
 
     out_table('hh_weights', hh_weights_summary)
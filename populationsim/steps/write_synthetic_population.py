@@ -3,17 +3,27 @@
 
 import logging
 import os
+
+import numpy as np
 import pandas as pd
 
 from activitysim.core import pipeline
 from activitysim.core import inject
 
 from activitysim.core.config import setting
+from ..household_runs import COUNT_COL
+from ..household_runs import iter_run_chunks
+from ..household_runs import expand_runs
+from ..performance import profile_step
+from .helper import table_frame
 
 logger = logging.getLogger(__name__)
 
 
-def merge_seed_data(expanded_household_ids, seed_data_df, seed_columns, trace_label):
+def seed_data_columns(seed_data_df, seed_columns, trace_label):
+    """
+    seed_columns in seed_data_df, without the (redundant) seed_geography column
+    """
 
     seed_geography = setting('seed_geography')
     hh_col = setting('household_id_col')
@@ -32,6 +42,15 @@ def merge_seed_data(expanded_household_ids, seed_data_df, seed_columns, trace_la
     if seed_geography in df_columns:
         df_columns.remove(seed_geography)
 
+    return df_columns
+
+
+def merge_seed_data(expanded_household_ids, seed_data_df, seed_columns, trace_label):
+
+    hh_col = setting('household_id_col')
+
+    df_columns = seed_data_columns(seed_data_df, seed_columns, trace_label)
+
     # join to seed_data on either index or hh_col (for persons)
     right_index = (seed_data_df.index.name == hh_col)
     right_on = hh_col if hh_col in seed_data_df.columns and not right_index else None
@@ -55,7 +74,100 @@ def merge_seed_data(expanded_household_ids, seed_data_df, seed_columns, trace_la
     return merged_df
 
 
+def seed_person_index(persons, hh_col):
+    """
+    CSR index of seed persons by household: the positions in persons of the persons of the
+    i-th household in hh_ids are rows[offsets[i]:offsets[i + 1]] (in persons table order)
+
+    Parameters
+    ----------
+    persons : pandas.DataFrame
+        seed persons table with hh_col column
+    hh_col : str
+
+    Returns
+    -------
+    hh_ids : pandas.Index
+        distinct household ids of persons
+    offsets : numpy.ndarray
+    rows : numpy.ndarray
+    """
+
+    hh_ids = pd.Index(pd.unique(persons[hh_col].values))
+    codes = hh_ids.get_indexer(persons[hh_col].values)
+
+    rows = np.argsort(codes, kind='stable')
+    offsets = np.zeros(len(hh_ids) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(codes, minlength=len(hh_ids)))
+
+    return hh_ids, offsets, rows
+
+
+def gather_seed_persons(expanded_household_ids, person_index, persons, seed_columns, trace_label):
+    """
+    Same result as merge_seed_data(expanded_household_ids, persons, ...) but, rather than
+    joining on household_id_col, gathers the seed persons of each synthetic household with
+    a precomputed seed_person_index.
+
+    Parameters
+    ----------
+    expanded_household_ids : pandas.DataFrame
+        one row per synthetic household
+    person_index : tuple
+        seed_person_index of persons
+    persons : pandas.DataFrame
+        seed persons table
+    seed_columns : list of str
+    trace_label : str
+
+    Returns
+    -------
+    pandas.DataFrame
+        one row per synthetic person (in synthetic household order)
+    """
+
+    hh_col = setting('household_id_col')
+
+    df_columns = [c for c in seed_data_columns(persons, seed_columns, trace_label) if c != hh_col]
+
+    hh_ids, offsets, rows = person_index
+
+    # position of each synthetic household's seed household in person_index (-1 if no persons)
+    positions = hh_ids.get_indexer(expanded_household_ids[hh_col].values)
+    person_counts = np.where(positions >= 0, offsets[positions + 1] - offsets[positions], 0)
+
+    # as with a left join, a household without persons gets a single row with missing person data
+    row_counts = np.maximum(person_counts, 1)
+    household_rows = np.repeat(np.arange(len(positions)), row_counts)
+    person_num = np.arange(len(household_rows)) - np.repeat(np.cumsum(row_counts) - row_counts, row_counts)
+
+    person_rows = np.full(len(household_rows), -1, dtype=np.int64)
+    has_persons = person_counts[household_rows] > 0
+    person_rows[has_persons] = \
+        rows[offsets[positions[household_rows[has_persons]]] + person_num[has_persons]]
+
+    # column names in both tables get the same suffixes as they would from pandas.merge
+    left_columns = list(expanded_household_ids.columns)
+    overlap = [c for c in df_columns if c in left_columns and c != hh_col]
+
+    data = {}
+    for c in left_columns:
+        name = '%s_x' % c if c in overlap else c
+        data[name] = expanded_household_ids[c].values[household_rows]
+    for c in df_columns:
+        name = '%s_y' % c if c in overlap else c
+        data[name] = pd.api.extensions.take(persons[c].values, person_rows, allow_fill=True)
+
+    gathered_df = pd.DataFrame(data, columns=list(data.keys()))
+
+    if hh_col not in seed_columns:
+        del gathered_df[hh_col]
+
+    return gathered_df
+
+
 @inject.step()
+@profile_step
 def write_synthetic_population(expanded_household_ids, households, persons, output_dir):
     """
     Write synthetic households and persons tables to output dir as csv files.
@@ -79,8 +191,8 @@ def write_synthetic_population(expanded_household_ids, households, persons, outp
         return
 
     expanded_household_ids = expanded_household_ids.to_frame()
-    households = households.to_frame()
-    persons = persons.to_frame()
+    households = table_frame(households)
+    persons = table_frame(persons)
 
     SETTINGS_NAME = 'output_synthetic_population'
     synthetic_tables_settings = setting(SETTINGS_NAME)
@@ -90,9 +202,22 @@ def write_synthetic_population(expanded_household_ids, households, persons, outp
     hh_col = setting('household_id_col')
     synthetic_hh_col = synthetic_tables_settings.get('household_id', 'HH_ID')
 
-    # - assign household_ids to synthetic population
+    # expanded_household_ids are runs of household_count synthetic households,
+    # which are expanded (and assigned consecutive synthetic_hh_ids) a chunk at a time
     expanded_household_ids.reset_index(drop=True, inplace=True)
-    expanded_household_ids['synthetic_hh_id'] = expanded_household_ids.index + 1
+
+    def write_chunks(runs_df, file_path, index, merge_data=None):
+        # (an empty runs_df still writes a header)
+        chunks = list(iter_run_chunks(runs_df)) or [(0, runs_df)]
+        for i, (first_household, chunk_df) in enumerate(chunks):
+            df = expand_runs(chunk_df)
+            df['synthetic_hh_id'] = np.arange(len(df.index)) + first_household + 1
+            if merge_data is not None:
+                df = merge_data(df)
+            df.rename(columns={'synthetic_hh_id': synthetic_hh_col}, inplace=True)
+            if index:
+                df.set_index(synthetic_hh_col, inplace=True)
+            df.to_csv(file_path, index=index, header=(i == 0), mode='w' if i == 0 else 'a')
 
     # - households
 
@@ -108,6 +233,7 @@ def write_synthetic_population(expanded_household_ids, households, persons, outp
         raise RuntimeError("synthetic household_id column '%s' also appears in seed column list" %
                            synthetic_hh_col)
 
+    # household attributes are the same for every household in a run, so merge before expanding
     df = merge_seed_data(
         expanded_household_ids,
         households,
@@ -115,12 +241,9 @@ def write_synthetic_population(expanded_household_ids, households, persons, outp
         trace_label=TABLE_NAME)
 
     # synthetic_hh_id is index
-    df.rename(columns={'synthetic_hh_id': synthetic_hh_col}, inplace=True)
-    df.set_index(synthetic_hh_col, inplace=True)
-
     filename = options.get('filename', '%s.csv' % TABLE_NAME)
     file_path = os.path.join(output_dir, filename)
-    df.to_csv(file_path, index=True)
+    write_chunks(df, file_path, index=True)
 
     # - persons
 
@@ -135,15 +258,17 @@ def write_synthetic_population(expanded_household_ids, households, persons, outp
         raise RuntimeError("synthetic household_id column '%s' also appears in seed column list" %
                            synthetic_hh_col)
 
-    df = merge_seed_data(
-        expanded_household_ids,
-        persons,
-        seed_columns=seed_columns,
-        trace_label=TABLE_NAME)
+    person_index = seed_person_index(persons, hh_col)
 
-    # FIXME drop or rename old seed hh_id column?
-    df.rename(columns={'synthetic_hh_id': synthetic_hh_col}, inplace=True)
+    def merge_persons(df):
+        return gather_seed_persons(
+            df,
+            person_index,
+            persons,
+            seed_columns=seed_columns,
+            trace_label=TABLE_NAME)
 
+    # FIXME drop or rename old seed hh_id column?
     filename = options.get('filename', '%s.csv' % TABLE_NAME)
     file_path = os.path.join(output_dir, filename)
-    df.to_csv(file_path, index=False)
+    write_chunks(expanded_household_ids, file_path, index=False, merge_data=merge_persons)
@@ -38,7 +38,7 @@ def regress():
 
     expanded_household_ids = pipeline.get_table("expanded_household_ids")
     assert isinstance(expanded_household_ids, pd.DataFrame)
-    taz_hh_counts = expanded_household_ids.groupby("TAZ").size()
+    taz_hh_counts = expanded_household_ids.groupby("TAZ")["household_count"].sum()
     assert len(taz_hh_counts) == TAZ_COUNT
     assert taz_hh_counts.loc[100] == TAZ_100_HH_COUNT
 
@@ -8,6 +8,8 @@ import numpy.testing as npt
 import pytest
 
 from ..balancer import ListBalancer
+from ..balancer import np_balancer
+from ..balancer import np_multi_balancer
 from ..balancer import DEFAULT_MAX_ITERATIONS
 
 
@@ -58,3 +60,43 @@ def test_Konduri():
 
     npt.assert_almost_equal(weighted_sum, controls['control'], decimal=1)
     assert status['converged']
+
+
+def test_multi_balancer():
+
+    # balancing zones together should give the same results as balancing them one by one
+    incidence = np.asanyarray([
+        [1, 1, 1, 0, 0, 0, 0, 0],
+        [0, 0, 0, 1, 1, 1, 1, 1],
+        [1, 1, 2, 1, 0, 1, 2, 1],
+        [1, 0, 1, 0, 2, 1, 1, 1],
+        [1, 1, 0, 2, 1, 0, 2, 0],
+    ], dtype=np.float64)
+    control_count, sample_count = incidence.shape
+
+    initial_weights = np.asanyarray([
+        [1, 1, 1, 1, 1, 1, 1, 1],
+        [2, 1, 3, 1, 2, 1, 1, 2],
+        [5, 5, 5, 5, 5, 5, 5, 5],
+    ], dtype=np.float64)
+    control_totals = np.asanyarray([
+        [35, 65, 91, 65, 104],
+        [10, 20, 30, 25, 30],
+        [50, 50, 90, 80, 100],
+    ], dtype=np.float64)
+    control_importance_weights = np.asanyarray([100000] * control_count, dtype=np.float64)
+    ub_weights = np.asanyarray([30, 30, 100], dtype=np.float64)[:, None] * np.ones(sample_count)
+
+    weights, relaxation_factors, status = np_multi_balancer(
+        sample_count, control_count, None, incidence, initial_weights, 0.0, ub_weights,
+        control_totals, control_importance_weights, DEFAULT_MAX_ITERATIONS)
+
+    for z in range(len(initial_weights)):
+        zone_weights, zone_relaxation_factors, zone_status = np_balancer(
+            sample_count, control_count, None, incidence, initial_weights[z], 0.0, ub_weights[z],
+            control_totals[z], control_importance_weights, DEFAULT_MAX_ITERATIONS)
+
+        npt.assert_array_equal(weights[z], zone_weights)
+        npt.assert_array_equal(relaxation_factors[z], zone_relaxation_factors)
+        assert status['converged'][z] == zone_status['converged']
+        assert status['iter'][z] == zone_status['iter']
@@ -0,0 +1,77 @@
+# PopulationSim
+# See full license in LICENSE.txt.
+
+import os
+
+import pandas as pd
+
+from activitysim.core import inject
+
+from populationsim import batch
+
+from .test_steps import TAZ_COUNT
+from .test_steps import TAZ_100_HH_COUNT
+
+
+def teardown_function(func):
+    inject.clear_cache()
+    inject.reinject_decorated_tables()
+
+
+def test_split_models():
+
+    base_models, scenario_models = batch.split_models(
+        ['input_pre_processor', 'setup_data_structures', 'initial_seed_balancing', 'share_tables', 'write_tables'])
+
+    assert base_models == ['input_pre_processor', 'setup_data_structures', 'share_tables']
+    assert scenario_models == ['input_pre_processor.table_list=batch_input_table_list;repop',
+                               'setup_control_tables', 'initial_seed_balancing', 'write_tables']
+
+
+def test_run_batch(tmp_path):
+
+    test_dir = os.path.dirname(__file__)
+    data_dir = os.path.join(test_dir, 'data')
+    output_dir = str(tmp_path)
+
+    batch.setup_injectables(os.path.join(test_dir, 'configs'), data_dir, output_dir)
+
+    # scenario with no data files of its own uses base data
+    base_scenario_dir = os.path.join(output_dir, 'base_data')
+    os.makedirs(base_scenario_dir)
+
+    # scenario with more households in every TAZ
+    growth_scenario_dir = os.path.join(output_dir, 'growth_data')
+    os.makedirs(growth_scenario_dir)
+    taz_controls = pd.read_csv(os.path.join(data_dir, 'taz_controls.csv'))
+    taz_controls['HHBASE'] *= 2
+    taz_controls.to_csv(os.path.join(growth_scenario_dir, 'taz_controls.csv'), index=False)
+
+    models = [
+        'input_pre_processor',
+        'setup_data_structures',
+        'initial_seed_balancing',
+        'meta_control_factoring',
+        'final_seed_balancing',
+        'integerize_final_seed_weights',
+        'sub_balancing.geography=TRACT',
+        'sub_balancing.geography=TAZ',
+        'expand_households',
+        'summarize',
+        'write_tables',
+        'write_synthetic_population',
+    ]
+
+    batch.run_batch([{'name': 'base', 'data_dir': base_scenario_dir},
+                     {'name': 'growth', 'data_dir': growth_scenario_dir}],
+                    models=models)
+
+    def taz_hh_counts(name):
+        households = pd.read_csv(os.path.join(output_dir, name, 'synthetic_households.csv'))
+        return households.groupby('TAZ').size()
+
+    base_counts = taz_hh_counts('base')
+    assert len(base_counts) == TAZ_COUNT
+    assert base_counts.loc[100] == TAZ_100_HH_COUNT
+
+    assert taz_hh_counts('growth').sum() > base_counts.sum()
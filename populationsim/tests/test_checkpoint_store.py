@@ -0,0 +1,38 @@
+# PopulationSim
+# See full license in LICENSE.txt.
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from ..checkpoint_store import CheckpointStore
+
+
+def test_checkpoint_store(tmp_path):
+
+    file_path = os.path.join(str(tmp_path), 'pipeline.h5')
+
+    df = pd.DataFrame({'PUMA': np.arange(1000000) % 7, 'sample_weight': np.arange(1000000) * 0.5},
+                      index=pd.Index(np.arange(1000000), name='hh_id'))
+
+    with CheckpointStore(file_path, mode='w', complevel=1, complib='blosc:lz4') as store:
+        store['persons/input_pre_processor'] = df
+        store.flush()
+        size = os.path.getsize(file_path)
+
+        # unchanged table is linked rather than written again
+        store['persons/setup_data_structures'] = df.copy()
+        store.flush()
+        assert os.path.getsize(file_path) < size * 1.1
+
+        # changed (even if only dtype) table is written
+        store['persons/compact'] = df.astype({'PUMA': np.int8})
+        store['checkpoints'] = pd.DataFrame({'checkpoint_name': ['init']})
+
+    # readable as an ordinary pipeline store
+    with pd.HDFStore(file_path, mode='r') as store:
+        assert sorted(store.keys()) == \
+            ['/checkpoints', '/persons/compact', '/persons/input_pre_processor', '/persons/setup_data_structures']
+        pd.testing.assert_frame_equal(store['persons/setup_data_structures'], df)
+        assert store['persons/compact'].PUMA.dtype == np.int8
@@ -0,0 +1,67 @@
+# PopulationSim
+# See full license in LICENSE.txt.
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from activitysim.core import inject
+
+from ..compaction import smallest_int_dtype
+from ..compaction import compact_integer_columns
+from ..compaction import compact_table
+
+
+def teardown_function(func):
+    inject.clear_cache()
+    inject.reinject_decorated_tables()
+
+
+def test_smallest_int_dtype():
+
+    assert smallest_int_dtype(np.array([0, 1, 127])) == np.int8
+    assert smallest_int_dtype(np.array([-1, 128])) == np.int16
+    assert smallest_int_dtype(np.array([0, 2 ** 40])) == np.int64
+
+    # signed, even for non-negative values
+    assert smallest_int_dtype(np.array([0, 255])) == np.int16
+
+    assert smallest_int_dtype(np.array([1, 2]), min_dtype=np.int32) == np.int32
+
+    # never upcast (e.g. to signed dtype of unsigned values)
+    assert smallest_int_dtype(np.array([0, 200], dtype=np.uint8)) == np.uint8
+    assert smallest_int_dtype(np.array([1, 2], dtype=np.int8), min_dtype=np.int32) == np.int8
+
+
+def test_compact_integer_columns():
+
+    df = pd.DataFrame({'TAZ': [100, 200000], 'NP': [1, 3], 'WGTP': [0.5, 1.5], 'SERIALNO': ['a', 'b']})
+
+    compacted_df = compact_integer_columns(df, ['TAZ', 'NP', 'WGTP', 'SERIALNO'])
+    assert compacted_df.dtypes.tolist() == [np.int32, np.int8, np.float64, object]
+    pd.testing.assert_frame_equal(compacted_df, df, check_dtype=False)
+
+    # df is unchanged
+    assert df.NP.dtype == np.int64
+
+    assert compact_integer_columns(df, ['WGTP']) is df
+
+
+def test_compact_table():
+
+    inject.add_injectable('settings', {'geographies': ['PUMA', 'TAZ']})
+
+    df = pd.DataFrame({'PUMA': [600, 601], 'NP': [1, 3], 'AGEP': [70, 35]})
+
+    compacted_df = compact_table(df, 'persons')
+    assert compacted_df.dtypes.tolist() == [np.int32, np.int64, np.int64]
+
+    # arithmetic in expressions on attribute columns doesn't overflow
+    assert (compacted_df.AGEP * 2).tolist() == [140, 70]
+
+    # unless they are listed
+    compacted_df = compact_table(df, 'persons', ['NP'])
+    assert compacted_df.dtypes.tolist() == [np.int32, np.int8, np.int64]
+
+    with pytest.raises(RuntimeError):
+        compact_table(df, 'persons', ['HINCP'])
@@ -0,0 +1,40 @@
+# PopulationSim
+# See full license in LICENSE.txt.
+
+import pandas as pd
+
+from ..geography_hierarchy import GeographyHierarchy
+
+
+def test_geography_hierarchy():
+
+    crosswalk_df = pd.DataFrame({
+        'REGION': [1, 1, 1, 1, 1, 1],
+        'PUMA': [200, 100, 200, 100, 200, 100],
+        'TRACT': [21, 11, 22, 12, 21, 11],
+        'TAZ': [6, 1, 5, 2, 4, 3],
+    })
+
+    hierarchy = GeographyHierarchy(crosswalk_df, ['REGION', 'PUMA', 'TRACT', 'TAZ'])
+
+    # zones in crosswalk order
+    assert hierarchy.zone_ids['PUMA'].tolist() == [200, 100]
+    assert hierarchy.zone_ids['TRACT'].tolist() == [21, 11, 22, 12]
+
+    assert hierarchy.sub_zone_ids('PUMA', 100, 'TRACT').tolist() == [11, 12]
+    assert hierarchy.sub_zone_ids('PUMA', 200, 'TAZ').tolist() == [6, 5, 4]
+    assert hierarchy.sub_zone_ids('TRACT', 11, 'TAZ').tolist() == [1, 3]
+    assert hierarchy.sub_zone_ids('PUMA', 100, 'PUMA').tolist() == [100]
+
+    ancestors = hierarchy.ancestors('TAZ')
+    assert ancestors.columns.tolist() == ['REGION', 'PUMA', 'TRACT']
+    assert ancestors.loc[[1, 4], 'TRACT'].tolist() == [11, 21]
+
+    assert hierarchy.ancestor_map('TRACT', 'PUMA').loc[22] == 200
+    assert hierarchy.is_nested('TAZ', 'PUMA')
+
+    # TAZ 1 split across tracts (but not pumas)
+    crosswalk_df = pd.concat([crosswalk_df, pd.DataFrame({'REGION': [1], 'PUMA': [100], 'TRACT': [12], 'TAZ': [1]})])
+    hierarchy = GeographyHierarchy(crosswalk_df, ['REGION', 'PUMA', 'TRACT', 'TAZ'])
+    assert not hierarchy.is_nested('TAZ', 'TRACT')
+    assert hierarchy.is_nested('TAZ', 'PUMA')
@@ -0,0 +1,33 @@
+# PopulationSim
+# See full license in LICENSE.txt.
+
+import pandas as pd
+
+from ..household_runs import household_runs
+from ..household_runs import expand_runs
+from ..household_runs import iter_expanded
+
+
+def test_household_runs():
+
+    runs_df = pd.DataFrame({
+        'TAZ': [2, 1, 2, 1, 1],
+        'hh_id': [7, 9, 7, 8, 3],
+        'household_count': [1, 2, 3, 0, 1],
+    })
+
+    runs_df = household_runs(runs_df, ['TAZ', 'hh_id'])
+
+    assert runs_df.TAZ.tolist() == [1, 1, 2]
+    assert runs_df.hh_id.tolist() == [3, 9, 7]
+    assert runs_df.household_count.tolist() == [1, 2, 4]
+
+    expanded_df = expand_runs(runs_df)
+    assert expanded_df.columns.tolist() == ['TAZ', 'hh_id']
+    assert expanded_df.hh_id.tolist() == [3, 9, 9, 7, 7, 7, 7]
+    assert expanded_df.hh_id.dtype == runs_df.hh_id.dtype
+
+    # chunks hold whole runs, indexed by position in expanded list
+    chunks = list(iter_expanded(runs_df, chunk_size=2))
+    assert [chunk.index.tolist() for chunk in chunks] == [[0], [1, 2], [3, 4, 5, 6]]
+    pd.testing.assert_frame_equal(pd.concat(chunks), expanded_df)
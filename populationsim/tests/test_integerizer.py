@@ -5,10 +5,16 @@
 import os
 import numpy as np
 import pandas as pd
+import pytest
 
 from activitysim.core import inject
 
 from populationsim import integerizer
+from populationsim import lp
+from populationsim import lp_cvx
+from populationsim import lp_enumerate
+from populationsim import lp_heuristic
+from populationsim import lp_ortools
 
 
 def test_integerizer():
@@ -68,3 +74,323 @@ def test_integerizer():
     # assert (integerized_weights.values == [
     #      1, 26, 8, 28, 18, 8, 2, 9,
     # ]).all()
+
+
+def test_integerizer_model_reuse():
+
+    configs_dir = os.path.join(os.path.dirname(__file__), 'configs')
+    inject.add_injectable("configs_dir", configs_dir)
+
+    incidence_table = pd.DataFrame({
+        'num_hh': [1, 1, 1, 1, 1, 1, 1, 1],
+        'hh_1': [1, 1, 1, 0, 0, 0, 0, 0],
+        'hh_2': [0, 0, 0, 1, 1, 1, 1, 1],
+        'p1': [1, 1, 2, 1, 0, 1, 2, 1],
+        'p2': [1, 0, 1, 0, 2, 1, 1, 1],
+    })
+
+    control_spec = pd.DataFrame(
+        {
+            'seed_table': ['households', 'households', 'households', 'persons', 'persons'],
+            'target': incidence_table.columns,
+            'importance': [10000000, 1000, 1000, 1000, 1000]
+        }
+    )
+
+    zone_weights = [
+        [1.362893, 25.658290, 7.978812, 27.789651, 18.451021, 8.641589, 1.476104, 8.641589],
+        [2.718281, 12.345678, 3.141592, 10.500000, 9.999999, 4.750000, 7.250000, 3.333333],
+        [0.500000, 6.660000, 11.110000, 2.220000, 8.880000, 1.110000, 3.330000, 4.440000],
+    ]
+
+    def integerize_zones():
+        results = []
+        for float_weights in zone_weights:
+            float_weights = pd.Series(float_weights, index=incidence_table.index)
+            control_totals = pd.Series(
+                np.round(np.dot(float_weights, incidence_table.values)), index=incidence_table.columns)
+            integerized_weights, status = integerizer.do_integerizing(
+                trace_label='label',
+                control_spec=control_spec,
+                control_totals=control_totals,
+                incidence_table=incidence_table,
+                float_weights=float_weights,
+                total_hh_control_col='num_hh'
+            )
+            assert status in lp_ortools.STATUS_SUCCESS
+            assert integerized_weights.sum() == control_totals['num_hh']
+            results.append(integerized_weights.values)
+        return results
+
+    # zones share incidence, so all but the first reuse the cached model template
+    inject.add_injectable('settings', {'INTEGERIZER_MAX_ENUMERATIONS': 0})
+    del lp_ortools._INTEGERIZER_MODELS[:]
+    reused_model_results = integerize_zones()
+    assert len(lp_ortools._INTEGERIZER_MODELS) == 1
+
+    # rebuilding the model for every zone gives the same result
+    inject.add_injectable('settings', {'INTEGERIZER_MODEL_CACHE_SIZE': 0, 'INTEGERIZER_MAX_ENUMERATIONS': 0})
+    del lp_ortools._INTEGERIZER_MODELS[:]
+    rebuilt_model_results = integerize_zones()
+    assert len(lp_ortools._INTEGERIZER_MODELS) == 0
+
+    inject.reinject_decorated_tables()
+
+    for reused, rebuilt in zip(reused_model_results, rebuilt_model_results):
+        assert (reused == rebuilt).all()
+
+
+def test_integerizer_cvx():
+
+    pytest.importorskip('cvxpy')
+
+    configs_dir = os.path.join(os.path.dirname(__file__), 'configs')
+    inject.add_injectable("configs_dir", configs_dir)
+
+    inject.add_injectable('settings', {'USE_CVXPY': True, 'INTEGERIZER_MAX_ENUMERATIONS': 0})
+
+    incidence_table = pd.DataFrame({
+        'num_hh': [1, 1, 1, 1, 1, 1, 1, 1],
+        'hh_1': [1, 1, 1, 0, 0, 0, 0, 0],
+        'hh_2': [0, 0, 0, 1, 1, 1, 1, 1],
+        'p1': [1, 1, 2, 1, 0, 1, 2, 1],
+        'p2': [1, 0, 1, 0, 2, 1, 1, 1],
+        'p3': [1, 1, 0, 2, 1, 0, 2, 0],
+    })
+
+    control_spec = pd.DataFrame(
+        {
+            'seed_table':
+                ['households', 'households', 'households', 'persons', 'persons', 'persons'],
+            'target': incidence_table.columns,
+            'importance': [10000000, 1000, 1000, 1000, 1000, 1000]
+        }
+    )
+
+    control_totals = pd.Series([100, 35, 65, 91, 65, 104], index=control_spec.target.values)
+
+    # second zone of the same shape reuses the compiled cvxpy problem
+    for float_weights in [
+            [1.362893, 25.658290, 7.978812, 27.789651, 18.451021, 8.641589, 1.476104, 8.641589],
+            [8.641589, 1.476104, 25.658290, 7.978812, 27.789651, 1.362893, 8.641589, 18.451021]]:
+
+        integerized_weights, status = integerizer.do_integerizing(
+            trace_label='label',
+            control_spec=control_spec,
+            control_totals=control_totals,
+            incidence_table=incidence_table,
+            float_weights=pd.Series(float_weights),
+            total_hh_control_col='num_hh'
+        )
+
+        assert status in lp_cvx.STATUS_SUCCESS
+        assert integerized_weights.sum() == 100
+
+    inject.reinject_decorated_tables()
+
+
+def test_resid_weights_hint():
+
+    resid_weights = np.array([0.2, 0.0, 0.9, 0.5, 0.7, 0.0])
+
+    hint = integerizer.resid_weights_hint(resid_weights, 3)
+    assert (hint == [0, 0, 1, 1, 1, 0]).all()
+
+    # integer weights (zero resid_weights) are never rounded up, even if shortfall is not met
+    hint = integerizer.resid_weights_hint(resid_weights, 6)
+    assert (hint == [1, 0, 1, 1, 1, 0]).all()
+
+
+def test_integerizer_hints_off_by_default(monkeypatch):
+
+    inject.add_injectable('settings', {})
+    assert not integerizer.use_integerizer_hints()
+
+    # hints are only built (and passed to the solver) when asked for
+    def no_hint(*args, **kwargs):
+        raise AssertionError("hint built with USE_INTEGERIZER_HINTS off")
+    monkeypatch.setattr(integerizer, 'resid_weights_hint', no_hint)
+
+    incidence_table = pd.DataFrame({
+        'num_hh': [1] * 8,
+        'hh_1': [1, 1, 1, 0, 0, 0, 0, 0],
+        'hh_2': [0, 0, 0, 1, 1, 1, 1, 1],
+    })
+    float_weights = pd.Series([1.36, 25.66, 7.98, 27.79, 18.45, 8.64, 1.48, 8.64])
+    control_totals = pd.Series([100, 35, 65], index=incidence_table.columns)
+
+    inject.add_injectable('settings', {'INTEGERIZER_MAX_ENUMERATIONS': 0})
+    integerized_weights, status = integerizer.do_integerizing(
+        trace_label='label',
+        control_spec=pd.DataFrame({'seed_table': ['households'] * 3,
+                                   'target': incidence_table.columns,
+                                   'importance': [100000000, 1000, 1000]}),
+        control_totals=control_totals,
+        incidence_table=incidence_table,
+        float_weights=float_weights,
+        total_hh_control_col='num_hh'
+    )
+    assert integerized_weights.sum() == 100
+
+    inject.reinject_decorated_tables()
+
+
+def test_solver_time_budget():
+
+    # without a budget, time limits are scaled by problem size between min and max limits
+    budget = lp.SolverTimeBudget(max_time_limit=60, min_time_limit=1, seconds_per_variable=0.01)
+    assert budget.time_limit(100) == 1
+    assert budget.time_limit(1000) == 10
+    assert budget.time_limit(100000) == 60
+
+    # time limits are capped by what is left of the budget
+    budget = lp.SolverTimeBudget(budget=100, max_time_limit=60, min_time_limit=1)
+    assert budget.time_limit(1000) == 60
+
+    with budget.allocate(1000, 'label') as time_limit:
+        assert time_limit == 60
+    budget.charge(elapsed=70, time_limit=60, trace_label='label')
+
+    assert budget.solve_count == 2
+    assert budget.time_limit_count == 1
+    assert 70 <= budget.used < 71
+    assert 29 < budget.time_limit(1000) <= 30
+
+    # but never less than min_time_limit once budget is exhausted
+    budget.charge(elapsed=40, time_limit=30, trace_label='label')
+    assert budget.remaining() == 0
+    assert budget.time_limit(1000) == 1
+
+
+def test_integerizer_enumerate():
+
+    configs_dir = os.path.join(os.path.dirname(__file__), 'configs')
+    inject.add_injectable("configs_dir", configs_dir)
+
+    # last two households have identical incidence
+    incidence = np.array([
+        [1, 1, 1, 1, 1, 1],
+        [1, 1, 0, 0, 0, 0],
+        [0, 0, 1, 1, 1, 1],
+        [1, 2, 1, 0, 2, 2],
+    ], dtype=np.float64)
+    resid_weights = np.array([0.4, 0.3, 0.8, 0.0, 0.6, 0.9])
+    lp_right_hand_side = np.array([3, 1, 2, 4], dtype=np.float64)
+
+    kwargs = dict(
+        incidence=incidence,
+        resid_weights=resid_weights,
+        log_resid_weights=np.log(np.maximum(resid_weights, np.exp(-725))),
+        control_importance_weights=np.array([0, 1000, 1000, 1000], dtype=np.float64),
+        total_hh_control_index=0,
+        lp_right_hand_side=lp_right_hand_side,
+        relax_ge_upper_bound=np.maximum(2 * 3 - lp_right_hand_side, 0),
+        hh_constraint_ge_bound=np.maximum(2 * 3, lp_right_hand_side),
+    )
+
+    # integer solution meeting all controls with the largest resid weights
+    resid_weights_out, status = lp_enumerate.np_integerizer_enumerate(**kwargs)
+    assert status == lp_enumerate.STATUS_OPTIMAL
+    assert (resid_weights_out == [1, 0, 1, 0, 0, 1]).all()
+
+    # the lp finds the same (integer) solution
+    resid_weights_out, status = lp_ortools.np_integerizer_ortools(**kwargs)
+    assert status in lp_ortools.STATUS_SUCCESS
+    assert np.allclose(resid_weights_out, [1, 0, 1, 0, 0, 1])
+
+    # 4 groups of households choose 3 (with repetition) is 20 candidate solutions
+    resid_weights_out, status = lp_enumerate.np_integerizer_enumerate(max_enumerations=19, **kwargs)
+    assert status == lp_enumerate.STATUS_NOT_SOLVED
+    assert (resid_weights_out == resid_weights).all()
+
+
+def test_integerizer_enumerate_many_groups(monkeypatch):
+
+    import tracemalloc
+
+    # 9000 households, each with its own incidence (and so its own group), and a shortfall of 1
+    sample_count = 9000
+    control_count = 15
+    bits = (np.arange(sample_count)[:, None] >> np.arange(control_count - 1)) & 1
+    incidence = np.vstack([np.ones(sample_count), bits.T]).astype(np.float64)
+    resid_weights = np.linspace(0.01, 0.5, sample_count)
+    lp_right_hand_side = np.zeros(control_count)
+    lp_right_hand_side[[0, 1]] = 1
+
+    kwargs = dict(
+        incidence=incidence,
+        resid_weights=resid_weights,
+        log_resid_weights=np.log(resid_weights),
+        control_importance_weights=np.full(control_count, 1.0),
+        total_hh_control_index=0,
+        lp_right_hand_side=lp_right_hand_side,
+        relax_ge_upper_bound=np.full(control_count, 2.0),
+        hh_constraint_ge_bound=np.full(control_count, 2.0),
+    )
+
+    tracemalloc.start()
+    resid_weights_out, status = lp_enumerate.np_integerizer_enumerate(**kwargs)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    # rounds up the only household whose incidence matches the controls
+    assert status == lp_enumerate.STATUS_OPTIMAL
+    assert resid_weights_out.sum() == 1
+    assert resid_weights_out[1] == 1
+
+    # memory grows with candidates times controls, not candidates times groups
+    assert peak < 20 * 1024 * 1024
+
+    # too many candidates times groups to enumerate
+    monkeypatch.setattr(lp_enumerate, 'MAX_ENUMERATION_CELLS', sample_count * sample_count - 1)
+    resid_weights_out, status = lp_enumerate.np_integerizer_enumerate(**kwargs)
+    assert status == lp_enumerate.STATUS_NOT_SOLVED
+    assert (resid_weights_out == resid_weights).all()
+
+
+def test_integerizer_heuristic():
+
+    configs_dir = os.path.join(os.path.dirname(__file__), 'configs')
+    inject.add_injectable("configs_dir", configs_dir)
+
+    inject.add_injectable('settings', {'USE_HEURISTIC_INTEGERIZER': True, 'INTEGERIZER_MAX_ENUMERATIONS': 0})
+
+    incidence_table = pd.DataFrame({
+        'num_hh': [1, 1, 1, 1, 1, 1, 1, 1],
+        'hh_1': [1, 1, 1, 0, 0, 0, 0, 0],
+        'hh_2': [0, 0, 0, 1, 1, 1, 1, 1],
+        'p1': [1, 1, 2, 1, 0, 1, 2, 1],
+        'p2': [1, 0, 1, 0, 2, 1, 1, 1],
+        'p3': [1, 1, 0, 2, 1, 0, 2, 0],
+    })
+
+    control_spec = pd.DataFrame(
+        {
+            'seed_table':
+                ['households', 'households', 'households', 'persons', 'persons', 'persons'],
+            'target': incidence_table.columns,
+            'importance': [10000000, 1000, 1000, 1000, 1000, 1000]
+        }
+    )
+
+    control_totals = pd.Series([100, 35, 65, 91, 65, 104], index=control_spec.target.values)
+
+    float_weights = pd.Series([1.362893, 25.658290, 7.978812, 27.789651, 18.451021, 8.641589, 1.476104, 8.641589])
+
+    integerized_weights, status = integerizer.do_integerizing(
+        trace_label='label',
+        control_spec=control_spec,
+        control_totals=control_totals,
+        incidence_table=incidence_table,
+        float_weights=float_weights,
+        total_hh_control_col='num_hh'
+    )
+
+    inject.reinject_decorated_tables()
+
+    assert status == lp_heuristic.STATUS_FEASIBLE
+    assert integerized_weights.sum() == 100
+
+    # integerized weights round float weights up or down
+    assert (integerized_weights >= np.floor(float_weights)).all()
+    assert (integerized_weights <= np.ceil(float_weights)).all()
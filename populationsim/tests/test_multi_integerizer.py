@@ -10,6 +10,8 @@ from activitysim.core import inject
 
 from populationsim.multi_integerizer import do_simul_integerizing
 from populationsim.multi_integerizer import do_sequential_integerizing
+from populationsim.multi_integerizer import screen_infeasible_sub_zones
+from populationsim.multi_integerizer import sub_zone_lp_infeasible
 
 incidence_df = pd.DataFrame({
     'hh_id': [0, 6, 12, 18, 24, 30],
@@ -85,8 +87,9 @@ def test_simul_integerizer():
         sub_control_zones=sub_control_zones
     )
 
+    # hh 0 has zero weight in both zones, so it is omitted from the (sparse) result
+    assert (integer_weights_df.hh_id.values == [6, 12, 18, 24, 30, 6, 12, 18, 24, 30]).all()
     assert (integer_weights_df.integer_weight.values == [
-        0,
         14,
         10,
         49,
@@ -95,7 +98,6 @@ def test_simul_integerizer():
         0,
         0,
         0,
-        0,
         46,
         29
     ]).all()
@@ -126,8 +128,9 @@ def test_sequential_integerizer():
 
     print("\ntest_sequential_integerizer integer_weights_df\n", integer_weights_df)
 
+    # hh 0 has zero weight in both zones, so it is omitted from the (sparse) result
+    assert (integer_weights_df.hh_id.values == [6, 12, 18, 24, 30, 6, 12, 18, 24, 30]).all()
     assert (integer_weights_df.integer_weight.values == [
-        0,
         14,
         10,
         49,
@@ -136,6 +139,95 @@ def test_sequential_integerizer():
         0,
         0,
         0,
+        46,
+        29
+    ]).all()
+
+
+def test_sub_zone_lp_infeasible():
+
+    # households (rows) by controls (num_hh, hh_size_4_plus, persons)
+    sub_incidence = np.array([
+        [1, 1, 4],
+        [1, 1, 3],
+        [1, 0, 1],
+        [1, 0, 2],
+    ], dtype=float)
+
+    # zone 0 can round up any household
+    # zone 1 can only round up hh_size_4_plus households (households 2 and 3 have integer weights)
+    # zone 2 has to round up two households but only has one with a fractional weight
+    x_max = np.array([
+        [1, 1, 1, 1],
+        [1, 1, 0, 0],
+        [0, 0, 1, 0],
+    ], dtype=float)
+    total_hh_right_hand_side = np.array([2, 1, 2], dtype=float)
+
+    lp_right_hand_side = np.array([
+        [2, 1, 4],
+        [1, 0, 2],
+        [2, 0, 2],
+    ], dtype=float)
+    relax_ge_upper_bound = np.full(lp_right_hand_side.shape, 100.0)
+    hh_constraint_ge_bound = np.full(lp_right_hand_side.shape, 100.0)
+
+    infeasible = sub_zone_lp_infeasible(
+        sub_incidence=sub_incidence,
+        x_max=x_max,
+        lp_right_hand_side=lp_right_hand_side,
+        relax_ge_upper_bound=relax_ge_upper_bound,
+        hh_constraint_ge_bound=hh_constraint_ge_bound,
+        total_hh_right_hand_side=total_hh_right_hand_side,
+        total_hh_sub_control_index=0)
+
+    assert list(infeasible) == [False, True, True]
+
+    # screen finds no infeasible sub zones in the test problem
+    infeasible_zone_ids = screen_infeasible_sub_zones(
+        incidence_df=incidence_df,
+        sub_weights=sub_zone_weights,
+        sub_controls_df=sub_controls_df,
+        control_spec=control_spec,
+        total_hh_control_col='num_hh',
+        sub_control_zones=sub_control_zones)
+
+    assert infeasible_zone_ids == []
+
+
+def test_simul_integerizer_heuristic():
+
+    configs_dir = os.path.join(os.path.dirname(__file__), 'configs')
+    inject.add_injectable("configs_dir", configs_dir)
+
+    inject.add_injectable('settings', {'USE_HEURISTIC_INTEGERIZER': True})
+
+    integer_weights_df = do_simul_integerizing(
+        trace_label="label",
+        incidence_df=incidence_df,
+        sub_weights=sub_zone_weights,
+        sub_controls_df=sub_controls_df,
+        control_spec=control_spec,
+        total_hh_control_col='num_hh',
+        sub_geography='TRACT',
+        sub_control_zones=sub_control_zones
+    )
+
+    inject.reinject_decorated_tables()
+
+    print("\ntest_simul_integerizer_heuristic integer_weights_df\n", integer_weights_df)
+
+    # same result as the lp integerizer
+    # hh 0 has zero weight in both zones, so it is omitted from the (sparse) result
+    assert (integer_weights_df.hh_id.values == [6, 12, 18, 24, 30, 6, 12, 18, 24, 30]).all()
+    assert (integer_weights_df.integer_weight.values == [
+        14,
+        10,
+        49,
+        1,
+        1,
+        0,
+        0,
         0,
         46,
         29
@@ -0,0 +1,32 @@
+# PopulationSim
+# See full license in LICENSE.txt.
+
+import os
+
+import pandas as pd
+
+from ..seed_partitions import SeedPartitions
+
+
+def test_seed_partitions(tmp_path):
+
+    df = pd.DataFrame({
+        'PUMA': [600, 601, 600, 602, 601],
+        'num_hh': [1, 1, 1, 1, 1],
+        'workers': [0, 2, 1, 1, 0],
+    }, index=pd.Index([10, 11, 12, 13, 14], name='hh_id'))
+
+    partitions = SeedPartitions(os.path.join(str(tmp_path), 'seed_partitions.h5'), 'incidence_table')
+    partitions.write(df, 'PUMA')
+
+    # rows in table order
+    pd.testing.assert_frame_equal(partitions.read(600), df[df.PUMA == 600])
+    pd.testing.assert_frame_equal(partitions.read(602), df[df.PUMA == 602])
+
+    # zone without rows
+    pd.testing.assert_frame_equal(partitions.read(603), df.iloc[:0])
+
+    # rewriting replaces all partitions
+    partitions.write(df[df.PUMA == 601], 'PUMA')
+    assert len(partitions.read(600).index) == 0
+    assert partitions.read(601).index.tolist() == [11, 14]
@@ -0,0 +1,46 @@
+# PopulationSim
+# See full license in LICENSE.txt.
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ..shared_tables import SharedTables
+
+
+def test_shared_tables(tmp_path):
+
+    df = pd.DataFrame({'PUMA': [100, 100, 101], 'sample_weight': [1.5, 2.0, 0.5],
+                       'SERIALNO': ['a', 'b', 'c'], 'vacant': [False, True, False]},
+                      index=pd.Index([3, 7, 9], name='hh_id'))
+
+    store = SharedTables(os.path.join(str(tmp_path), 'shared'))
+
+    assert not store.is_stub('households', df.iloc[:0])
+
+    stub = store.write('households', df)
+    assert len(stub.index) == 0
+    assert store.is_stub('households', stub)
+    assert not store.is_stub('households', df)
+    assert not store.is_stub('households', stub[['PUMA']])
+
+    shared_df = store.read('households', stub)
+    pd.testing.assert_frame_equal(shared_df, df)
+
+    # numeric columns are read-only views of the mapped column files
+    assert isinstance(shared_df['sample_weight'].values, np.memmap)
+    with pytest.raises(ValueError):
+        shared_df['sample_weight'].values[0] = 0
+
+    # replacing columns of a shallow copy doesn't affect the shared table
+    copy_df = shared_df.copy(deep=False)
+    copy_df['sample_weight'] = 0.0
+    pd.testing.assert_frame_equal(store.read('households', stub), df)
+
+    store.remove('households')
+    assert not store.is_stub('households', stub)
+
+    with pytest.raises(RuntimeError):
+        store.write('households', df.set_index('PUMA', append=True))
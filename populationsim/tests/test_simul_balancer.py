@@ -0,0 +1,108 @@
+# PopulationSim
+# See full license in LICENSE.txt.
+
+import os
+import numpy as np
+import pandas as pd
+
+import numpy.testing as npt
+
+from activitysim.core import inject
+
+from ..simul_balancer import SimultaneousListBalancer
+
+
+def sub_balancing_problem(zone_count=7):
+
+    prng = np.random.RandomState(0)
+
+    sample_count = 40
+
+    incidence_table = pd.DataFrame({
+        'num_hh': np.ones(sample_count, dtype=int),
+        'hh_size_1': prng.randint(0, 2, sample_count),
+        'workers': prng.randint(0, 3, sample_count),
+    })
+
+    parent_weights = pd.Series(prng.uniform(5, 15, sample_count))
+
+    # consistent sub zone controls from a random allocation of parent weights
+    allocation = prng.dirichlet(np.ones(zone_count), sample_count) * parent_weights.values[:, None]
+    sub_controls = incidence_table.values.T.dot(allocation)
+
+    sub_control_zones = pd.Series(['zone_%s' % z for z in range(zone_count)], index=range(zone_count))
+
+    controls = pd.DataFrame({'name': incidence_table.columns})
+    controls['importance'] = 1000
+    controls['total'] = sub_controls.sum(axis=1)
+    for zone, zone_name in sub_control_zones.items():
+        controls[zone_name] = sub_controls[:, zone]
+
+    return incidence_table, parent_weights, controls, sub_control_zones
+
+
+def test_blocked_sub_balancing():
+
+    configs_dir = os.path.join(os.path.dirname(__file__), 'configs')
+    inject.add_injectable("configs_dir", configs_dir)
+
+    incidence_table, parent_weights, controls, sub_control_zones = sub_balancing_problem()
+
+    def balance(max_zones_per_block):
+        balancer = SimultaneousListBalancer(
+            incidence_table=incidence_table,
+            parent_weights=parent_weights,
+            controls=controls,
+            sub_control_zones=sub_control_zones,
+            total_hh_control_col='num_hh',
+            max_zones_per_block=max_zones_per_block)
+        status = balancer.balance()
+        return status, balancer.sub_zone_weights, balancer.weights
+
+    status, weights, _ = balance(max_zones_per_block=None)
+    blocked_status, blocked_weights, blocked_balancer_weights = balance(max_zones_per_block=3)
+
+    # initial sub zone weights are set block by block, not held for all sub zones
+    assert not set(sub_control_zones).intersection(blocked_balancer_weights.columns)
+
+    assert blocked_status['iter'] == status['iter']
+
+    # blocked balancing gives the same result as balancing all sub zones at once
+    npt.assert_almost_equal(blocked_weights.values, weights.values)
+
+    # weights still sum to parent weights
+    npt.assert_almost_equal(blocked_weights.sum(axis=1).values, parent_weights.values)
+
+
+def test_grouped_sub_balancing():
+
+    configs_dir = os.path.join(os.path.dirname(__file__), 'configs')
+    inject.add_injectable("configs_dir", configs_dir)
+
+    incidence_table, parent_weights, controls, sub_control_zones = sub_balancing_problem()
+
+    # a zero weight household
+    parent_weights[5] = 0
+
+    def balance(group_by_incidence):
+        balancer = SimultaneousListBalancer(
+            incidence_table=incidence_table,
+            parent_weights=parent_weights,
+            controls=controls.copy(),
+            sub_control_zones=sub_control_zones,
+            total_hh_control_col='num_hh',
+            group_by_incidence=group_by_incidence)
+        status = balancer.balance()
+        return balancer, status
+
+    balancer, status = balance(group_by_incidence=False)
+    grouped_balancer, grouped_status = balance(group_by_incidence=True)
+
+    # households are balanced as one sample per distinct incidence row
+    assert len(grouped_balancer.incidence_table.index) == len(incidence_table.drop_duplicates().index)
+
+    assert grouped_status['iter'] == status['iter']
+
+    # grouped balancing gives the same household weights
+    npt.assert_almost_equal(grouped_balancer.sub_zone_weights.values, balancer.sub_zone_weights.values)
+    assert (grouped_balancer.sub_zone_weights.loc[5] == 0).all()
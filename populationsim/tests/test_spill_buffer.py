@@ -0,0 +1,53 @@
+# PopulationSim
+# See full license in LICENSE.txt.
+
+import os
+
+import pandas as pd
+import pytest
+
+from ..spill_buffer import SpillBuffer
+from ..spill_buffer import FrameBuffer
+from ..spill_buffer import CheckpointsBuffer
+from ..zone_checkpoints import ZoneCheckpoints
+
+
+def test_spill_buffer(tmp_path):
+
+    frames = [
+        pd.DataFrame({'TAZ': [100, 100], 'balanced_weight': [1.5, 2.0], 'integer_weight': [1, 2]},
+                     index=pd.Index([3, 7], name='hh_id')),
+        pd.DataFrame({'TAZ': [101], 'balanced_weight': [0.5], 'integer_weight': [1]},
+                     index=pd.Index([4], name='hh_id')),
+        # integer_weight float in this frame
+        pd.DataFrame({'TAZ': [102, 102], 'balanced_weight': [2.5, 0.0], 'integer_weight': [2.0, 0.0]},
+                     index=pd.Index([3, 9], name='hh_id')),
+    ]
+
+    dir_path = os.path.join(str(tmp_path), 'spill')
+
+    checkpoints = ZoneCheckpoints(os.path.join(str(tmp_path), 'checkpoints.h5'))
+    checkpoints_buffer = CheckpointsBuffer(checkpoints)
+
+    for buffer in [SpillBuffer(dir_path), FrameBuffer(), checkpoints_buffer]:
+        for zone_id, df in enumerate(frames):
+            if buffer is checkpoints_buffer:
+                checkpoints.put_zone(zone_id, 'fingerprint', df)
+            buffer.append(df)
+        pd.testing.assert_frame_equal(buffer.to_frame(), pd.concat(frames))
+        buffer.cleanup()
+
+    assert not os.path.exists(dir_path)
+
+    # object columns are pickled
+    buffer = SpillBuffer(dir_path)
+    buffer.append(pd.DataFrame({'zone': ['a', 'b']}))
+    buffer.append(pd.DataFrame({'zone': ['c']}))
+    assert buffer.to_frame().zone.tolist() == ['a', 'b', 'c']
+    buffer.cleanup()
+
+    # extension arrays can't be stored
+    buffer = SpillBuffer(dir_path)
+    with pytest.raises(RuntimeError):
+        buffer.append(pd.DataFrame({'zone': pd.Categorical(['a', 'b'])}))
+    buffer.cleanup()
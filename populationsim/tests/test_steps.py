@@ -1,6 +1,10 @@
+import json
 import os
+import shutil
 
+import numpy as np
 import pandas as pd
+import pytest
 
 from activitysim.core import config
 from activitysim.core import tracing
@@ -8,6 +12,9 @@ from activitysim.core import pipeline
 from activitysim.core import inject
 
 from populationsim import steps
+from populationsim.steps import sub_balancing
+from populationsim.steps import helper
+from populationsim.steps.helper import table_frame
 
 
 def setup_function():
@@ -37,6 +44,50 @@ def teardown_function(func):
     inject.reinject_decorated_tables()
 
 
+def test_table_frame():
+
+    df = pd.DataFrame({'a': [1, 2, 3]}, index=[10, 20, 30])
+    inject.add_table('frame_table', df)
+
+    # repeated reads share data with the table
+    frame = table_frame('frame_table')
+    assert np.shares_memory(frame['a'].values, df['a'].values)
+    assert np.shares_memory(table_frame('frame_table')['a'].values, df['a'].values)
+
+    # adding columns to a read doesn't change the table
+    frame['b'] = 0
+    assert list(table_frame('frame_table').columns) == ['a']
+
+    # but modifying values in place does, so isn't allowed
+    frame = table_frame('frame_table')
+    with pytest.raises(ValueError):
+        frame['a'] *= 2
+    with pytest.raises(ValueError):
+        frame.loc[frame.a > 1, 'a'] = 0
+    assert df['a'].tolist() == [1, 2, 3]
+    assert table_frame('frame_table')['a'].tolist() == [1, 2, 3]
+
+    # add_column and add_table invalidate cached frame
+    inject.add_column('frame_table', 'b', pd.Series([4, 5, 6], index=[10, 20, 30]))
+    assert table_frame('frame_table').b.tolist() == [4, 5, 6]
+
+    inject.add_table('frame_table', pd.DataFrame({'c': [7, 8, 9]}, index=[10, 20, 30]), replace=True)
+    frame_table = inject.get_table('frame_table')
+    pd.testing.assert_frame_equal(table_frame(frame_table), frame_table.to_frame())
+    assert table_frame(frame_table).c.tolist() == [7, 8, 9]
+
+    # frames of replaced tables aren't held until the table is read again
+    inject.add_table('frame_table', pd.DataFrame({'d': [1, 2, 3]}), replace=True)
+    inject.add_table('other_frame_table', df)
+    table_frame('other_frame_table')
+    assert 'frame_table' not in helper._FRAMES
+
+    # nor once the pipeline is closed
+    pipeline.open_pipeline()
+    pipeline.close_pipeline()
+    assert not helper._FRAMES
+
+
 TAZ_COUNT = 36
 TAZ_100_HH_COUNT = 33
 TAZ_100_HH_REPOP_COUNT = 26
@@ -63,7 +114,7 @@ def test_full_run1():
 
     expanded_household_ids = pipeline.get_table('expanded_household_ids')
     assert isinstance(expanded_household_ids, pd.DataFrame)
-    taz_hh_counts = expanded_household_ids.groupby('TAZ').size()
+    taz_hh_counts = expanded_household_ids.groupby('TAZ')['household_count'].sum()
     assert len(taz_hh_counts) == TAZ_COUNT
     assert taz_hh_counts.loc[100] == TAZ_100_HH_COUNT
 
@@ -72,6 +123,19 @@ def test_full_run1():
     assert not os.path.exists(os.path.join(output_dir, 'households.csv'))
     assert os.path.exists(os.path.join(output_dir, 'summary_DISTRICT_1.csv'))
 
+    performance_df = pd.read_csv(os.path.join(output_dir, 'performance.csv'))
+    step_records = performance_df[performance_df.phase == 'step']
+    assert list(step_records.step) == _MODELS
+    assert performance_df[performance_df.phase.isin(['balance', 'integerize'])].status.notnull().all()
+
+    # zone ids are written as they are (not as floats, although step records have no zone)
+    zone_ids = pd.read_csv(os.path.join(output_dir, 'performance.csv'), dtype={'zone_id': str}).zone_id.dropna()
+    assert len(zone_ids) > 0
+    assert zone_ids.str.isdigit().all()
+    with open(os.path.join(output_dir, 'performance.json')) as f:
+        json_zone_ids = [r['zone_id'] for r in json.load(f) if r['zone_id'] is not None]
+    assert json_zone_ids and all(isinstance(zone_id, int) for zone_id in json_zone_ids)
+
     # tables will no longer be available after pipeline is closed
     pipeline.close_pipeline()
 
@@ -98,7 +162,7 @@ def test_full_run2_repop_replace():
 
     expanded_household_ids = pipeline.get_table('expanded_household_ids')
     assert isinstance(expanded_household_ids, pd.DataFrame)
-    taz_hh_counts = expanded_household_ids.groupby('TAZ').size()
+    taz_hh_counts = expanded_household_ids.groupby('TAZ')['household_count'].sum()
     assert len(taz_hh_counts) == TAZ_COUNT
     assert taz_hh_counts.loc[100] == TAZ_100_HH_REPOP_COUNT
 
@@ -124,7 +188,7 @@ def test_full_run2_repop_append():
 
     expanded_household_ids = pipeline.get_table('expanded_household_ids')
     assert isinstance(expanded_household_ids, pd.DataFrame)
-    taz_hh_counts = expanded_household_ids.groupby('TAZ').size()
+    taz_hh_counts = expanded_household_ids.groupby('TAZ')['household_count'].sum()
     assert len(taz_hh_counts) == TAZ_COUNT
     assert taz_hh_counts.loc[100] == TAZ_100_HH_COUNT + TAZ_100_HH_REPOP_COUNT
 
@@ -132,3 +196,196 @@ def test_full_run2_repop_append():
     pipeline.close_pipeline()
 
     inject.clear_cache()
+
+
+def test_full_run1_shared_tables():
+
+    _MODELS = [
+        'input_pre_processor',
+        'setup_data_structures',
+        'initial_seed_balancing',
+        'meta_control_factoring',
+        'final_seed_balancing',
+        'integerize_final_seed_weights',
+        'share_tables',
+        'sub_balancing.geography=TRACT',
+        'sub_balancing.geography=TAZ',
+        'expand_households',
+        'summarize',
+        'write_tables',
+        'write_synthetic_population',
+    ]
+
+    pipeline.run(models=_MODELS, resume_after=None)
+
+    # pipeline holds stubs, which table_frame resolves to the shared tables
+    assert len(pipeline.get_table('households').index) == 0
+    assert len(table_frame('households').index) > 0
+
+    expanded_household_ids = pipeline.get_table('expanded_household_ids')
+    taz_hh_counts = expanded_household_ids.groupby('TAZ')['household_count'].sum()
+    assert len(taz_hh_counts) == TAZ_COUNT
+    assert taz_hh_counts.loc[100] == TAZ_100_HH_COUNT
+
+    output_dir = inject.get_injectable('output_dir')
+    synthetic_households = pd.read_csv(os.path.join(output_dir, 'synthetic_households.csv'))
+    assert len(synthetic_households.index) == expanded_household_ids['household_count'].sum()
+
+    # tables will no longer be available after pipeline is closed
+    pipeline.close_pipeline()
+
+    inject.clear_cache()
+
+    shutil.rmtree(os.path.join(output_dir, 'shared_tables'))
+
+
+FULL_RUN_MODELS = [
+    'input_pre_processor',
+    'setup_data_structures',
+    'initial_seed_balancing',
+    'meta_control_factoring',
+    'final_seed_balancing',
+    'integerize_final_seed_weights',
+    'sub_balancing.geography=TRACT',
+    'sub_balancing.geography=TAZ',
+    'expand_households',
+    'summarize',
+    'write_tables',
+    'write_synthetic_population',
+]
+
+FULL_RUN_TABLES = ['TRACT_weights', 'TAZ_weights', 'expanded_household_ids', 'summary_hh_weights']
+
+
+def run_full(settings=None, models=FULL_RUN_MODELS, resume_after=None):
+    """
+    Run models with settings overridden, and return FULL_RUN_TABLES
+    """
+
+    for key, value in (settings or {}).items():
+        config.override_setting(key, value)
+
+    pipeline.run(models=models, resume_after=resume_after)
+
+    tables = {table_name: pipeline.get_table(table_name) for table_name in FULL_RUN_TABLES}
+
+    pipeline.close_pipeline()
+
+    # reset for next run
+    setup_function()
+
+    return tables
+
+
+def assert_same_tables(tables, expected_tables, check_dtype=True):
+    for table_name, df in expected_tables.items():
+        pd.testing.assert_frame_equal(tables[table_name], df, check_dtype=check_dtype, obj=table_name)
+
+
+def test_full_run1_partition_seed_data():
+
+    expected_tables = run_full()
+
+    tables = run_full({'PARTITION_SEED_DATA': True})
+
+    assert_same_tables(tables, expected_tables)
+
+    output_dir = inject.get_injectable('output_dir')
+    assert os.path.exists(os.path.join(output_dir, 'seed_partitions.h5'))
+    os.remove(os.path.join(output_dir, 'seed_partitions.h5'))
+
+
+def test_full_run1_zone_checkpoints(monkeypatch):
+
+    balance_and_integerize = sub_balancing.balance_and_integerize
+    tract_zones_balanced = []
+
+    def counting_balance_and_integerize(parent_geography, parent_id, **kwargs):
+        if parent_geography == 'TRACT':
+            tract_zones_balanced.append(parent_id)
+        return balance_and_integerize(parent_geography=parent_geography, parent_id=parent_id, **kwargs)
+
+    monkeypatch.setattr(sub_balancing, 'balance_and_integerize', counting_balance_and_integerize)
+
+    expected_tables = run_full()
+    tract_count = len(tract_zones_balanced)
+    assert tract_count > 2
+
+    # crash part way through sub_balancing.geography=TAZ
+    def crashing_balance_and_integerize(parent_geography, parent_id, **kwargs):
+        if parent_geography == 'TRACT' and len(tract_zones_balanced) == tract_count + 2:
+            raise RuntimeError("crash")
+        return counting_balance_and_integerize(parent_geography=parent_geography, parent_id=parent_id, **kwargs)
+
+    monkeypatch.setattr(sub_balancing, 'balance_and_integerize', crashing_balance_and_integerize)
+
+    config.override_setting('ZONE_CHECKPOINTS', True)
+    with pytest.raises(RuntimeError, match='crash'):
+        pipeline.run(models=FULL_RUN_MODELS, resume_after=None)
+    pipeline.close_pipeline()
+    setup_function()
+
+    # resume (as activitysim --resume does, setting resume_after) balances only the remaining zones
+    monkeypatch.setattr(sub_balancing, 'balance_and_integerize', counting_balance_and_integerize)
+    del tract_zones_balanced[:]
+
+    resume_after = 'sub_balancing.geography=TRACT'
+    tables = run_full({'ZONE_CHECKPOINTS': True, 'resume_after': resume_after}, resume_after=resume_after)
+
+    assert len(tract_zones_balanced) == tract_count - 2
+    assert_same_tables(tables, expected_tables)
+
+    output_dir = inject.get_injectable('output_dir')
+    assert not os.path.exists(os.path.join(output_dir, 'sub_balancing_TAZ_checkpoints.h5'))
+
+
+def test_full_run1_spill_zone_results(monkeypatch):
+
+    output_dir = inject.get_injectable('output_dir')
+
+    def spill_dirs():
+        return [d for d in os.listdir(output_dir) if '_spill_' in d]
+
+    expected_tables = run_full()
+
+    assert_same_tables(run_full({'SPILL_ZONE_RESULTS': True}), expected_tables)
+
+    # with ZONE_CHECKPOINTS, zone results are read back from checkpoints rather than spilled
+    assert_same_tables(run_full({'SPILL_ZONE_RESULTS': True, 'ZONE_CHECKPOINTS': True}), expected_tables)
+
+    assert not spill_dirs()
+
+    # spill files are deleted if balancing fails
+    def failing_balance_and_integerize(parent_geography, **kwargs):
+        raise RuntimeError("crash")
+
+    monkeypatch.setattr(sub_balancing, 'balance_and_integerize', failing_balance_and_integerize)
+
+    config.override_setting('SPILL_ZONE_RESULTS', True)
+    with pytest.raises(RuntimeError, match='crash'):
+        pipeline.run(models=FULL_RUN_MODELS, resume_after=None)
+    pipeline.close_pipeline()
+
+    assert not spill_dirs()
+
+
+def test_full_run1_compact_dtypes(tmp_path):
+
+    expected_tables = run_full()
+
+    # equivalent controls expressions doing arithmetic that would overflow int8
+    configs_dir = os.path.join(os.path.dirname(__file__), 'configs')
+    control_spec = pd.read_csv(os.path.join(configs_dir, 'controls.csv'))
+    arithmetic_expressions = {
+        'hh_size_4_plus': 'households.NP * 64 >= 256',
+        'persons_occ_1': 'persons.OCCP * 100 - 50 == 50',
+    }
+    for target, expression in arithmetic_expressions.items():
+        control_spec.loc[control_spec.target == target, 'expression'] = expression
+    control_spec.to_csv(os.path.join(str(tmp_path), 'controls.csv'), index=False)
+    inject.add_injectable('configs_dir', [str(tmp_path), configs_dir])
+
+    tables = run_full({'COMPACT_DTYPES': True})
+
+    # zone ids are int32
+    assert_same_tables(tables, expected_tables, check_dtype=False)
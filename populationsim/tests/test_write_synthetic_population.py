@@ -0,0 +1,53 @@
+import os
+
+import pandas as pd
+
+from activitysim.core import inject
+
+from populationsim.steps.write_synthetic_population import merge_seed_data
+from populationsim.steps.write_synthetic_population import seed_person_index
+from populationsim.steps.write_synthetic_population import gather_seed_persons
+
+
+def teardown_function(func):
+    inject.clear_cache()
+
+
+def test_gather_seed_persons():
+
+    configs_dir = os.path.join(os.path.dirname(__file__), 'configs')
+    inject.add_injectable("configs_dir", configs_dir)
+
+    # settings household_id_col: hh_id, seed_geography: PUMA
+    persons = pd.DataFrame({
+        'hh_id': [2, 1, 2, 3, 2],
+        'PUMA': [600, 600, 600, 600, 600],
+        'TAZ': [9, 9, 9, 9, 9],
+        'per_num': [1, 1, 2, 1, 3],
+        'age': [30, 40, 5, 60, 7],
+    })
+
+    # household 4 has no persons
+    expanded_household_ids = pd.DataFrame({
+        'PUMA': [600] * 5,
+        'TAZ': [100, 100, 101, 101, 102],
+        'hh_id': [2, 4, 1, 2, 3],
+        'synthetic_hh_id': [1, 2, 3, 4, 5],
+    })
+
+    for seed_columns in [['per_num', 'age'], ['hh_id', 'per_num', 'TAZ', 'PUMA']]:
+
+        merged_df = merge_seed_data(expanded_household_ids, persons, seed_columns, 'persons')
+
+        person_index = seed_person_index(persons, 'hh_id')
+        gathered_df = gather_seed_persons(expanded_household_ids, person_index, persons, seed_columns, 'persons')
+
+        pd.testing.assert_frame_equal(gathered_df, merged_df)
+
+    # all households with persons (so no missing values to promote int columns to float)
+    expanded_household_ids = expanded_household_ids[expanded_household_ids.hh_id != 4].reset_index(drop=True)
+
+    gathered_df = gather_seed_persons(expanded_household_ids, person_index, persons, ['per_num'], 'persons')
+    assert gathered_df.per_num.tolist() == [1, 2, 3, 1, 1, 2, 3, 1]
+    pd.testing.assert_frame_equal(gathered_df,
+                                  merge_seed_data(expanded_household_ids, persons, ['per_num'], 'persons'))
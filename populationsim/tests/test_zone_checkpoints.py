@@ -0,0 +1,43 @@
+# PopulationSim
+# See full license in LICENSE.txt.
+
+import os
+
+import pandas as pd
+
+from ..zone_checkpoints import ZoneCheckpoints
+from ..zone_checkpoints import fingerprint
+
+
+def test_zone_checkpoints(tmp_path):
+
+    file_path = os.path.join(str(tmp_path), 'sub_balancing_TAZ_checkpoints.h5')
+
+    weights = pd.Series([1.5, 2.0, 0.0], index=[10, 11, 12], name='balanced_weight')
+    zone_fingerprint = fingerprint('inputs', 100, weights)
+
+    # fingerprint depends on values (and index)
+    assert fingerprint('inputs', 100, weights) == zone_fingerprint
+    assert fingerprint('inputs', 100, weights * 2) != zone_fingerprint
+    assert fingerprint('inputs', 100, weights.reset_index(drop=True)) != zone_fingerprint
+
+    zone_df = pd.DataFrame({'TAZ': [100, 100], 'balanced_weight': [1.5, 2.0], 'integer_weight': [1, 2]})
+
+    checkpoints = ZoneCheckpoints(file_path)
+    assert checkpoints.get_zone(100, zone_fingerprint) is None
+    checkpoints.put_zone(100, zone_fingerprint, zone_df)
+
+    # rerun finds results for zones with unchanged inputs
+    checkpoints = ZoneCheckpoints(file_path)
+    pd.testing.assert_frame_equal(checkpoints.get_zone(100, zone_fingerprint), zone_df)
+    assert checkpoints.get_zone(100, fingerprint('inputs', 100, weights * 2)) is None
+    assert checkpoints.get_zone(101, zone_fingerprint) is None
+
+    checkpoints.remove()
+    assert not os.path.exists(file_path)
+
+    # unreadable store is discarded
+    with open(file_path, 'w') as f:
+        f.write('partial')
+    checkpoints = ZoneCheckpoints(file_path)
+    assert checkpoints.get_zone(100, zone_fingerprint) is None
@@ -0,0 +1,209 @@
+# PopulationSim
+# See full license in LICENSE.txt.
+
+import hashlib
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from activitysim.core import config
+from activitysim.core import inject
+
+from .partition_store import PartitionStore
+
+
+logger = logging.getLogger(__name__)
+
+# settings that control how (or which steps of) a run is run, or what it writes, rather than the
+# results of its steps, so that changing them (e.g. resume_after, which activitysim sets when
+# resuming) doesn't invalidate zone checkpoints
+RUN_CONTROL_SETTINGS = [
+    'resume_after', 'models', 'run_list', 'multiprocess', 'multiprocess_steps', 'num_processes',
+    'output_tables', 'output_synthetic_population', 'cleanup_pipeline_after_run', 'trace_geography',
+    'performance_log', 'ZONE_CHECKPOINTS', 'SPILL_ZONE_RESULTS', 'PARTITION_SEED_DATA',
+    'seed_partitions_file_name', 'shared_tables', 'shared_tables_dir_name', 'checkpoint_store',
+    'INTEGERIZER_MODEL_CACHE_SIZE', 'batch_scenarios', 'batch_input_tables', 'batch_num_processes',
+]
+
+
+def fingerprint(*args):
+    """
+    Hex digest identifying the contents of args (pandas objects, or anything with a stable repr)
+
+    Parameters
+    ----------
+    args : pandas.DataFrame, pandas.Series, str, ...
+
+    Returns
+    -------
+    str
+    """
+
+    digest = hashlib.sha1()
+    for arg in args:
+        if isinstance(arg, (pd.DataFrame, pd.Series)):
+            digest.update(repr(list(arg.columns) if isinstance(arg, pd.DataFrame) else arg.name).encode())
+            digest.update(pd.util.hash_pandas_object(arg, index=True).values.tobytes())
+        else:
+            digest.update(repr(arg).encode())
+    return digest.hexdigest()
+
+
+def results_settings(settings):
+    """
+    Settings that may affect the results of a step (all but RUN_CONTROL_SETTINGS), to include
+    in the fingerprint of its inputs
+
+    Parameters
+    ----------
+    settings : dict
+
+    Returns
+    -------
+    list of (str, object)
+        sorted settings items
+    """
+
+    return sorted((k, v) for k, v in settings.items() if k not in RUN_CONTROL_SETTINGS)
+
+
+class ZoneCheckpoints(PartitionStore):
+    """
+    Append-only PartitionStore of the results of a step for each zone, written as each zone
+    completes, so that a rerun of a step that was killed or crashed part way through can
+    skip the zones completed by the earlier run.
+
+    Each zone's results are stored with a fingerprint of the zone's inputs, and are only
+    reused if the rerun's inputs have the same fingerprint.
+
+    Parameters
+    ----------
+    file_path : str
+    """
+
+    def __init__(self, file_path):
+
+        super().__init__(file_path)
+
+        # (key, row count and dtypes) of zone results put or got by this run, in order
+        self.zone_results = []
+        self.columns = None
+        self.index_name = None
+
+        if os.path.exists(file_path):
+            try:
+                with self.open(mode='r') as store:
+                    zone_count = len(store.keys())
+                logger.info("found %s zone checkpoints in %s" % (zone_count, file_path))
+            except Exception as e:
+                # e.g. if killed while writing
+                logger.warning("discarding unreadable zone checkpoints %s: %s" % (file_path, e))
+                self.remove()
+
+    @staticmethod
+    def zone_key(zone_id):
+        return '/zone_%s' % zone_id
+
+    def get_zone(self, zone_id, zone_fingerprint):
+        """
+        Results stored for zone, or None if there are none (or inputs have changed)
+
+        Parameters
+        ----------
+        zone_id : zone id
+        zone_fingerprint : str
+            fingerprint of zone inputs
+
+        Returns
+        -------
+        pandas.DataFrame or None
+        """
+
+        df = self.get(self.zone_key(zone_id), fingerprint=zone_fingerprint)
+        if df is not None:
+            self.add_zone_result(zone_id, df)
+        return df
+
+    def put_zone(self, zone_id, zone_fingerprint, df):
+        """
+        Store results for zone
+
+        Parameters
+        ----------
+        zone_id : zone id
+        zone_fingerprint : str
+            fingerprint of zone inputs
+        df : pandas.DataFrame
+        """
+
+        self.put(self.zone_key(zone_id), df, fingerprint=zone_fingerprint)
+        self.add_zone_result(zone_id, df)
+
+    def add_zone_result(self, zone_id, df):
+
+        if self.columns is None:
+            self.columns = list(df.columns)
+            self.index_name = df.index.name
+        assert list(df.columns) == self.columns
+
+        self.zone_results.append((self.zone_key(zone_id), len(df.index), [df.index.dtype] + list(df.dtypes)))
+
+    def results_frame(self):
+        """
+        Concatenated results of the zones put or got by this run (in order), read back one zone
+        at a time into preallocated columns, so that peak memory is the result plus the
+        results of a single zone
+
+        Returns
+        -------
+        pandas.DataFrame
+        """
+
+        assert self.zone_results, "no zone results in %s" % self.file_path
+
+        rows = sum(zone_rows for _, zone_rows, _ in self.zone_results)
+        dtypes = [np.result_type(*dtypes) for dtypes in zip(*[zone_dtypes for _, _, zone_dtypes in self.zone_results])]
+        arrays = [np.empty(rows, dtype=dtype) for dtype in dtypes]
+
+        start = 0
+        with self.open(mode='r') as store:
+            for key, zone_rows, _ in self.zone_results:
+                df = store[key]
+                end = start + zone_rows
+                arrays[0][start:end] = df.index.values
+                for i in range(len(self.columns)):
+                    arrays[i + 1][start:end] = df.iloc[:, i].values
+                start = end
+
+        # copy=False leaves each column in its own block
+        df = pd.DataFrame(dict(enumerate(arrays[1:])), index=pd.Index(arrays[0], name=self.index_name), copy=False)
+        df.columns = self.columns
+
+        return df
+
+
+def zone_checkpoints(name):
+    """
+    ZoneCheckpoints for a step if the ZONE_CHECKPOINTS setting is enabled, otherwise None.
+
+    The store is in the output dir, with the process name as prefix when multiprocessing
+    (so that each subprocess has its own store)
+
+    Parameters
+    ----------
+    name : str
+        name of step (e.g. sub_balancing_TAZ)
+
+    Returns
+    -------
+    ZoneCheckpoints or None
+    """
+
+    if not config.setting('ZONE_CHECKPOINTS', False):
+        return None
+
+    file_name = '%s_checkpoints.h5' % name
+    prefix = inject.get_injectable('log_file_prefix', None)
+    return ZoneCheckpoints(config.build_output_file_path(file_name, use_prefix=prefix))